@@ -1,33 +1,56 @@
 from dotenv import load_dotenv
 import os
-import io
+import asyncio
 import base64
+import io
+import json
 import logging
-from datetime import date, datetime, timedelta
+import time
+_IMPORT_START = time.perf_counter()
+from datetime import date, datetime, time as dt_time, timedelta
+from itertools import islice
 from typing import Optional
+from zoneinfo import ZoneInfo
 
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form
+from fastapi import Body, FastAPI, Depends, HTTPException, File, UploadFile, Form, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy import text
-from gtts import gTTS
-import speech_recognition as sr
-from pydub import AudioSegment
-
-# Import LangChain & Google GenAI
-try:
-    from langchain.agents import AgentExecutor, create_tool_calling_agent
-except ImportError:
-    from langchain.agents.agent import AgentExecutor
-    from langchain.agents import create_tool_calling_agent
-
-from langchain.tools import tool
+
+# LangChain: chỉ import phần nhẹ ở đây; langchain.agents, langchain_google_genai và
+# RunnableWithMessageHistory được nạp khi dựng agent (lần dùng đầu hoặc warm-up lúc startup)
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.tools import tool
 
 from utils.thoi_gian_tu_nhien import parse_natural_time
-from app_dependencies import get_current_user_id, engine, supabase
+from utils.chat_history import create_history_store
+from utils.history_compaction import HistoryCompactor
+from utils.intent_router import IntentRouter
+from utils.tts import AudioCache, TTSService, create_engine as create_tts_engine
+from utils.stt import SpeechBusy, SpeechInputTooLarge, SpeechToText, create_recognizer
+from utils.metrics import metrics, metrics_callback, request_timings, server_timing_header
+from utils.lazy import Lazy, import_costs, startup_report, timed_import
+from utils.tool_cache import ToolResultCache
+from utils.admission import ConcurrencyGate, Overloaded, RateLimiter
+from utils.session_lanes import SessionLanes, content_key
+from utils.tool_scheduler import ToolScheduler
+from utils.reminders import ReminderDispatcher, create_delivery
+from utils.audio_store import AUDIO_MIME, CODECS as AUDIO_CODECS, AudioStore, iter_slices, parse_range
+from utils.conflicts import (collect_conflicts, conflict_columns, conflict_cte, conflict_params, find_conflicts,
+                             format_conflicts)
+from utils.recurrence import (REPEAT_LABEL, expand_all, fetch_occurrences, next_occurrence,
+                              parse_events_json, recurring_events_json, to_datetime)
+from utils.scheduler import Interval, TaskRequest, free_slots, plan_tasks
+from utils.bulk_events import (BATCH_CHUNK, BATCH_MAX_EVENTS, BatchResult, build_inputs, insert_events,
+                               iter_csv_rows, iter_ics_rows)
+from utils.calendar_export import (EXPORT_FORMATS, iter_export, list_events_page, list_notes_page,
+                                   normalize_type)
+from utils.search import (HIT_ORDER, OTHERS_JSON, SearchResult, hits_sql, parse_hits, search, search_params,
+                          trigram_enabled, unique_match)
+from app_dependencies import (AUTH_VERIFY_MODE, DB_MAX_OVERFLOW, DB_POOL_SIZE, get_async_engine, get_current_user_id, get_engine,
+                              jwt_verifier, lazy_async_engine, lazy_supabase)
 # from payment_service import router as payment_router
 
 # --- 1. CẤU HÌNH ---
@@ -36,218 +59,338 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Múi giờ của người dùng: giờ làm việc, "hôm nay", hiển thị giờ đề xuất
+APP_TZ = ZoneInfo(os.getenv("APP_TIMEZONE", "Asia/Ho_Chi_Minh"))
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     logger.warning("⚠️ Chưa tìm thấy GEMINI_API_KEY trong .env")
 
-# Sử dụng model Gemini để xử lý logic
-llm_brain = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", google_api_key=GEMINI_API_KEY, temperature=0.7)
+
+# Sử dụng model Gemini để xử lý logic (dựng ở lần dùng đầu tiên)
+def _create_llm():
+    ChatGoogleGenerativeAI = timed_import("langchain_google_genai").ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GEMINI_API_KEY, temperature=0.7)
+
+
+lazy_llm = Lazy("llm", _create_llm)
+
+# Kiểm soát tải: mỗi user CHAT_RATE_PER_MIN lượt/phút (dồn tối đa CHAT_BURST, tin nhắn thoại tính CHAT_VOICE_COST
+# lượt); cả server tối đa AGENT_CONCURRENCY lượt agent gọi Gemini cùng lúc, hàng đợi có hạn + thời gian chờ tối đa
+chat_rate_limiter = RateLimiter(per_minute=float(os.getenv("CHAT_RATE_PER_MIN", "20")),
+                                burst=float(os.getenv("CHAT_BURST", "5")))
+CHAT_VOICE_COST = float(os.getenv("CHAT_VOICE_COST", "2"))
+agent_gate = ConcurrencyGate(
+    "agent", int(os.getenv("AGENT_CONCURRENCY", "8")),
+    max_waiting=int(os.getenv("AGENT_MAX_WAITING", "32")),
+    timeout=float(os.getenv("AGENT_QUEUE_TIMEOUT", "15")), label="trợ lý AI")
+# Quá tải TTS -> bỏ phần audio, vẫn trả lời bằng chữ
+tts_gate = ConcurrencyGate(
+    "tts", int(os.getenv("TTS_CONCURRENCY", "4")),
+    max_waiting=int(os.getenv("TTS_MAX_WAITING", "16")),
+    timeout=float(os.getenv("TTS_QUEUE_TIMEOUT", "5")), label="đọc câu trả lời")
+
+# Mỗi session (user) một làn chạy tuần tự, tối đa SESSION_MAX_WAITING lượt chờ; request trùng dùng chung kết quả
+session_lanes = SessionLanes(max_waiting=int(os.getenv("SESSION_MAX_WAITING", "4")))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "120"))
+
+
+def _overloaded(e: Overloaded, gate: str) -> HTTPException:
+    metrics.inc("admission_rejected_total", gate=gate, status=e.status_code)
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": e.retry_after_header})
 
 # --- 2. XỬ LÝ ÂM THANH ---
 
 
-def clean_text_for_speech(text: str) -> str:
-    # Loại bỏ các ký tự markdown để giọng đọc tự nhiên hơn
-    return text.replace('*', '').replace('#', '').replace('-', ' ').replace('_', '')
+# TTS: tách câu, tổng hợp song song, cache theo nội dung (TTS_ENGINE=local để chạy không cần mạng)
+tts_service = TTSService(
+    create_tts_engine(os.getenv("TTS_ENGINE", "gtts")),
+    AudioCache(max_bytes=int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+               disk_dir=os.getenv("TTS_CACHE_DIR") or None),
+    max_workers=int(os.getenv("TTS_WORKERS", "4")),
+)
 
 
-def text_to_base64_audio(text: str) -> str:
+async def text_to_base64_audio(text: str) -> str:
     try:
         if not text:
             return ""
-        # Chỉ đọc 200 ký tự đầu để tránh chờ lâu nếu phản hồi quá dài
-        short_text = clean_text_for_speech(text)[:200]
-        tts = gTTS(short_text, lang='vi')
-        audio_fp = io.BytesIO()
-        tts.write_to_fp(audio_fp)
-        audio_fp.seek(0)
-        return base64.b64encode(audio_fp.read()).decode('utf-8')
+        async with tts_gate.slot(), metrics.stage("tts"):
+            audio = await tts_service.synthesize(text)
+        return base64.b64encode(audio).decode('utf-8')
+    except Overloaded as e:
+        metrics.inc("admission_rejected_total", gate="tts", status=e.status_code)
+        logger.warning(f"⚠️ Bỏ qua TTS: {e}")
+        return ""
     except Exception as e:
         logger.error(f"Lỗi TTS: {e}")
         return ""
 
 
+# Audio câu trả lời là tài nguyên riêng: /chat chỉ trả URL, client phát dần qua GET /audio/{id}
+# (nhị phân, hỗ trợ Range, codec gọn hơn); giữ AUDIO_TTL giây, tổng tối đa AUDIO_STORE_MAX_BYTES
+audio_store = AudioStore(max_bytes=int(os.getenv("AUDIO_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+                         ttl_seconds=float(os.getenv("AUDIO_TTL", "600")),
+                         max_items=int(os.getenv("AUDIO_STORE_MAX_ITEMS", "2000")))
+
+
+def start_audio(text: str, codec: Optional[str] = None) -> dict:
+    """Bắt đầu tổng hợp ở nền và trả ngay handle; câu nào xong trước được phát trước."""
+    if not text:
+        return {"audio_id": None, "audio_url": None}
+
+    async def synthesize():
+        async with tts_gate.slot(), metrics.stage("tts"):
+            async for audio in tts_service.iter_audio(text):
+                yield audio
+
+    clip = audio_store.create(synthesize, tts_service.engine.audio_format)
+    query = f"?codec={codec}" if codec in AUDIO_CODECS else ""
+    return {"audio_id": clip.id, "audio_url": f"/audio/{clip.id}{query}"}
+
+
+# STT: ffmpeg -> PCM ở process riêng, nhận dạng trong thread pool có giới hạn (STT_ENGINE=stub để test)
+stt_service = SpeechToText(
+    create_recognizer(os.getenv("STT_ENGINE", "google")),
+    max_bytes=int(os.getenv("STT_MAX_BYTES", str(10 * 1024 * 1024))),
+    max_concurrency=int(os.getenv("STT_CONCURRENCY", "2")),
+    max_waiting=int(os.getenv("STT_MAX_WAITING", "8")),
+)
+
+
 async def audio_to_text(audio_file: UploadFile) -> str:
     try:
-        r = sr.Recognizer()
-        audio_bytes = await audio_file.read()
-        audio_fp = io.BytesIO(audio_bytes)
-        sound = AudioSegment.from_file(audio_fp)
-        wav_fp = io.BytesIO()
-        sound.export(wav_fp, format="wav")
-        wav_fp.seek(0)
-        with sr.AudioFile(wav_fp) as source:
-            audio_data = r.record(source)
-            return r.recognize_google(audio_data, language="vi-VN")
+        async with metrics.stage("stt"):
+            return await stt_service.transcribe(audio_file)
+    except SpeechInputTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except SpeechBusy as e:
+        raise _overloaded(e, "stt")
     except Exception as e:
         logger.error(f"Lỗi STT: {e}")
         return ""
 
 # --- 3. CÁC CÔNG CỤ (TOOLS) ---
 
+# Cache tool đọc theo user; tool ghi tăng generation của user -> lần đọc sau lấy dữ liệu mới.
+# Generation chỉ có trong process -> nhiều worker uvicorn (WEB_CONCURRENCY > 1) thì tắt cache.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+if WEB_CONCURRENCY > 1:
+    logger.info(f"ℹ️ WEB_CONCURRENCY={WEB_CONCURRENCY}: tắt cache tool (generation không chia sẻ giữa các worker)")
+tool_cache = ToolResultCache(
+    max_entries=int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "4096")) if WEB_CONCURRENCY <= 1 else 0,
+    # App Flutter ghi thẳng vào Supabase (không qua tool, không gọi /tool-cache/invalidate): sau khi sửa trên app,
+    # agent có thể trả dữ liệu cũ tối đa TTL giây -> TTL ngắn (vẫn đủ gộp các tool call lặp lại trong một lượt chat)
+    ttl_seconds=float(os.getenv("TOOL_CACHE_TTL", "15")),
+)
+
 
 @tool
-def lay_ten_nguoi_dung(user_id: str) -> str:
+@tool_cache.cached
+async def lay_ten_nguoi_dung(user_id: str) -> str:
     """Lấy tên người dùng từ bảng profiles."""
-    with engine.connect() as conn:
-        res = conn.execute(text("SELECT name FROM profiles WHERE id = :uid"), {
-                           "uid": user_id}).fetchone()
+    async with get_async_engine().connect() as conn:
+        res = (await conn.execute(text("SELECT name FROM profiles WHERE id = :uid"), {
+            "uid": user_id})).fetchone()
         return f"Tên người dùng là {res.name}." if res else "Không rõ tên."
 
 
+# uu_tien tiếng Việt -> enum task_priority
+MUC_UU_TIEN = {"cao": "high", "trung bình": "medium", "trung binh": "medium", "thấp": "low", "thap": "low"}
+
+
 @tool
-def tao_su_kien_toan_dien(tieu_de: str, loai_su_kien: str, user_id: str, mo_ta: Optional[str] = None,
-                          bat_dau: Optional[str] = None, ket_thuc: Optional[str] = None,
-                          uu_tien: str = 'medium') -> str:
+@tool_cache.invalidates
+async def tao_su_kien_toan_dien(tieu_de: str, loai_su_kien: str, user_id: str, mo_ta: Optional[str] = None,
+                                bat_dau: Optional[str] = None, ket_thuc: Optional[str] = None,
+                                uu_tien: str = 'medium') -> str:
     """
     Tạo sự kiện/task. TỰ ĐỘNG CẢNH BÁO nếu trùng giờ.
     loai_su_kien: task, schedule, class, workshift, deadline.
+    bat_dau/ket_thuc: truyền nguyên văn lời user ("3 giờ chiều thứ sáu", "từ 8h đến 10h sáng mai", "20/10 14:30")
+    hoặc ISO; không cần tự quy đổi.
     uu_tien: cao, trung bình, thấp.
     """
     try:
-        with engine.connect() as conn:
-            with conn.begin():
-                start_dt, end_dt = None, None
-
-                if bat_dau:
-                    start_dt, end_dt = parse_natural_time(
-                        bat_dau, datetime.now())
-                if ket_thuc:
-                    _, end_dt = parse_natural_time(ket_thuc, start_dt or now)
-
-                # Tạo Event
-                event_id = conn.execute(text("""
+        async with get_async_engine().begin() as conn:
+            start_dt, end_dt = None, None
+
+            # Giờ người dùng nói ("3 giờ chiều thứ sáu") hiểu theo APP_TZ
+            if bat_dau:
+                start_dt, end_dt = parse_natural_time(
+                    bat_dau, datetime.now(APP_TZ))
+            if ket_thuc:
+                _, end_dt = parse_natural_time(
+                    ket_thuc, start_dt or datetime.now(APP_TZ))
+
+            # Event + Task + Schedule + kiểm tra trùng giờ trong một câu lệnh (CTE + RETURNING) -> 1 round trip.
+            # CTE `conflicts` đọc snapshot trước khi INSERT nên không tự trùng với chính nó.
+            kiem_tra = conflict_params(start_dt, end_dt, loai_su_kien)
+            row = (await conn.execute(text(f"""
+                WITH {conflict_cte()}, new_event AS (
                     INSERT INTO events (user_id, title, description, type, start_time, end_time)
-                    VALUES (:uid, :title, :desc, :type, :start, :end) RETURNING id
-                """), {
-                    "uid": user_id, "title": tieu_de, "desc": mo_ta,
-                    "type": loai_su_kien, "start": start_dt, "end": end_dt
-                }).scalar()
-
-                # Tạo Task
-                if loai_su_kien in ['task', 'deadline']:
-                    conn.execute(text("""
-                        INSERT INTO tasks (user_id, event_id, title, description, deadline, priority, status)
-                        VALUES (:uid, :eid, :title, :desc, :dl, :pri, 'todo')
-                    """), {
-                        "uid": user_id, "eid": event_id, "title": tieu_de,
-                        "desc": mo_ta, "dl": end_dt or start_dt, "pri": uu_tien
-                    })
-
-                # Tạo Schedule
-                if start_dt and loai_su_kien != 'deadline':
-                    final_end = end_dt if end_dt else (
-                        start_dt + timedelta(hours=1))
-                    conn.execute(text("""
-                        INSERT INTO schedules (user_id, event_id, start_time, end_time)
-                        VALUES (:uid, :eid, :start, :end)
-                    """), {
-                        "uid": user_id, "eid": event_id, "start": start_dt, "end": final_end
-                    })
-
-                return f"✅ Đã tạo {loai_su_kien}: '{tieu_de}' lúc {start_dt}."
+                    VALUES (:uid, :title, :desc, :type, :start, :end)
+                    RETURNING id, user_id, title, description, start_time
+                ), new_task AS (
+                    INSERT INTO tasks (user_id, event_id, title, description, deadline, priority, status)
+                    SELECT user_id, id, title, description, CAST(:dl AS timestamptz), CAST(:pri AS task_priority), 'todo'
+                    FROM new_event WHERE CAST(:with_task AS boolean)
+                    RETURNING id
+                ), new_schedule AS (
+                    INSERT INTO schedules (user_id, event_id, start_time, end_time)
+                    SELECT user_id, id, start_time, CAST(:schedule_end AS timestamptz)
+                    FROM new_event WHERE CAST(:with_schedule AS boolean)
+                    RETURNING id
+                )
+                SELECT (SELECT id FROM new_event) AS event_id,
+                       (SELECT id FROM new_task) AS task_id,
+                       (SELECT id FROM new_schedule) AS schedule_id,
+                       {conflict_columns()}
+            """), {
+                "uid": user_id, "title": tieu_de, "desc": mo_ta,
+                "type": loai_su_kien, "start": start_dt, "end": end_dt,
+                "with_task": loai_su_kien in ['task', 'deadline'],
+                "dl": end_dt or start_dt, "pri": MUC_UU_TIEN.get(uu_tien.lower(), uu_tien),
+                "with_schedule": bool(start_dt) and loai_su_kien != 'deadline',
+                "schedule_end": end_dt or (start_dt + timedelta(hours=1) if start_dt else None),
+                **kiem_tra,
+            })).fetchone()
+
+            reply = f"✅ Đã tạo {loai_su_kien}: '{tieu_de}' lúc {start_dt}."
+            warning = format_conflicts(collect_conflicts(row, kiem_tra, APP_TZ), tz=APP_TZ)
+            return f"{reply}\n{warning}" if warning else reply
     except Exception as e:
         logger.error(f"Lỗi tạo sự kiện: {e}")
         return f"❌ Có lỗi xảy ra: {str(e)}"
 
 
 @tool
-def cap_nhat_su_kien(tieu_de_cu: str, thoi_gian_moi: str, user_id: str) -> str:
-    """Dùng khi user muốn 'dời lịch', 'sắp xếp lại', 'đổi giờ'."""
+@tool_cache.invalidates
+async def cap_nhat_su_kien(tieu_de_cu: str, thoi_gian_moi: str, user_id: str,
+                           su_kien_id: Optional[int] = None) -> str:
+    """Dùng khi user muốn 'dời lịch', 'sắp xếp lại', 'đổi giờ'. TỰ ĐỘNG CẢNH BÁO nếu giờ mới bị trùng.
+    Tên khớp nhiều sự kiện/chỉ gần đúng -> trả danh sách (#id) để hỏi user, rồi gọi lại với su_kien_id."""
     try:
-        with engine.connect() as conn:
-            with conn.begin():
-                # Tìm event
-                event = conn.execute(text("SELECT id, start_time FROM events WHERE user_id = :uid AND title ILIKE :t LIMIT 1"),
-                                     {"uid": user_id, "t": f"%{tieu_de_cu}%"}).fetchone()
-                if not event:
-                    return "⚠️ Không tìm thấy sự kiện để dời."
-
-                # Tính giờ mới
-                new_start, new_end = parse_natural_time(
-                    thoi_gian_moi, datetime.now())
-                if not new_end:
-                    new_end = new_start + timedelta(hours=1)
-
-                # Update
-                conn.execute(text("""
+        async with get_async_engine().begin() as conn:
+            # Tìm event (full-text + trigram, không phân biệt dấu); chỉ dời khi chắc chắn là một mục
+            if su_kien_id is not None:
+                event = (await conn.execute(text(
+                    "SELECT id, title, CAST(type AS text) AS type FROM events WHERE user_id = :uid AND id = :id"
+                ), {"uid": user_id, "id": su_kien_id})).fetchone()
+            else:
+                found = await search(conn, user_id, tieu_de_cu, kinds=("event",), limit=5)
+                event = found.unique(fulltext_fallback=True)
+                if event is None and found.best:
+                    return (f"⚠️ Chưa dời: '{tieu_de_cu}' khớp nhiều mục hoặc không chắc chắn: "
+                            f"{found.describe_candidates(tz=APP_TZ)}. Hỏi user muốn dời mục nào rồi gọi lại với su_kien_id.")
+            if not event:
+                return "⚠️ Không tìm thấy sự kiện để dời."
+
+            # Tính giờ mới
+            new_start, new_end = parse_natural_time(
+                thoi_gian_moi, datetime.now(APP_TZ))
+            if not new_end:
+                new_end = new_start + timedelta(hours=1)
+
+            # Update event + bảng con + kiểm tra trùng giờ ở khung mới (trừ chính nó) trong một câu lệnh
+            kiem_tra = conflict_params(new_start, new_end, event.type)
+            row = (await conn.execute(text(f"""
+                WITH {conflict_cte("AND id <> :id")}, moved AS (
                     UPDATE events SET start_time = :s, end_time = :e, updated_at = NOW()
-                    WHERE id = :id
-                """), {"s": new_start, "e": new_end, "id": event.id})
-
-                # Update các bảng con
-                conn.execute(text("UPDATE schedules SET start_time=:s, end_time=:e WHERE event_id=:id"),
-                             {"s": new_start, "e": new_end, "id": event.id})
+                    WHERE id = :id RETURNING id
+                ), moved_schedules AS (
+                    UPDATE schedules SET start_time = :s, end_time = :e WHERE event_id = :id RETURNING id
+                )
+                SELECT (SELECT COUNT(*) FROM moved) AS moved, {conflict_columns("AND id <> :id")}
+            """), {"s": new_start, "e": new_end, "id": event.id, "uid": user_id, **kiem_tra})).fetchone()
 
-                return f"✅ Đã dời '{tieu_de_cu}' sang {new_start}."
+            reply = f"✅ Đã dời '{event.title}' sang {new_start}."
+            warning = format_conflicts(collect_conflicts(row, kiem_tra, APP_TZ), tz=APP_TZ)
+            return f"{reply}\n{warning}" if warning else reply
     except Exception as e:
         return f"Lỗi update: {e}"
 
 
 @tool
-def tao_ghi_chu_thong_minh(noi_dung: str, user_id: str, context_title: Optional[str] = None) -> str:
+@tool_cache.invalidates
+async def tao_ghi_chu_thong_minh(noi_dung: str, user_id: str, context_title: Optional[str] = None) -> str:
     """Tạo ghi chú gắn liền với Event hoặc Task cụ thể (XOR logic)."""
-    with engine.connect() as conn:
-        with conn.begin():
-            event_id = None
-            if context_title:
-                event_id = conn.execute(text("SELECT id FROM events WHERE user_id = :uid AND title ILIKE :t LIMIT 1"),
-                                        {"uid": user_id, "t": f"%{context_title}%"}).scalar()
+    async with get_async_engine().begin() as conn:
+        event_id = None
+        if context_title:
+            found = await search(conn, user_id, context_title, kinds=("event",), limit=1)
+            event_id = found.best.id if found.best else None
 
-            query = text(
-                "INSERT INTO notes (user_id, content, event_id) VALUES (:uid, :content, :eid)")
-            conn.execute(
-                query, {"uid": user_id, "content": noi_dung, "eid": event_id})
-            return "✅ Đã lưu ghi chú." if event_id else "✅ Đã tạo ghi chú độc lập."
+        query = text(
+            "INSERT INTO notes (user_id, content, event_id) VALUES (:uid, :content, :eid)")
+        await conn.execute(
+            query, {"uid": user_id, "content": noi_dung, "eid": event_id})
+        return "✅ Đã lưu ghi chú." if event_id else "✅ Đã tạo ghi chú độc lập."
 
 
 @tool
-def xoa_su_kien_toan_tap(tieu_de: str, user_id: str) -> str:
-    """Xóa sự kiện."""
+@tool_cache.invalidates
+async def xoa_su_kien_toan_tap(tieu_de: str, user_id: str, su_kien_id: Optional[int] = None) -> str:
+    """Xóa sự kiện. Chỉ xóa khi tên khớp chắc chắn một mục; khớp nhiều mục/chỉ gần đúng -> trả danh sách (#id)
+    để hỏi user, rồi gọi lại với su_kien_id."""
     try:
-        with engine.connect() as conn:
-            with conn.begin():
-                res = conn.execute(text("DELETE FROM events WHERE user_id = :uid AND title ILIKE :t"),
-                                   {"uid": user_id, "t": f"%{tieu_de}%"})
-            return f"🗑️ Đã xóa '{tieu_de}'." if res.rowcount > 0 else "⚠️ Không tìm thấy sự kiện."
+        async with get_async_engine().begin() as conn:
+            if su_kien_id is None:
+                found = await search(conn, user_id, tieu_de, kinds=("event",), limit=5)
+                target = found.unique(fulltext_fallback=True)
+                if target is None:
+                    if not found.best:
+                        return "⚠️ Không tìm thấy sự kiện."
+                    return (f"⚠️ Chưa xóa: '{tieu_de}' khớp nhiều mục hoặc không chắc chắn: "
+                            f"{found.describe_candidates(tz=APP_TZ)}. Hỏi user muốn xóa mục nào rồi gọi lại với su_kien_id.")
+                su_kien_id = target.id
+            title = (await conn.execute(text(
+                "DELETE FROM events WHERE user_id = :uid AND id = :id RETURNING title"
+            ), {"uid": user_id, "id": su_kien_id})).scalar()
+        if title is None:
+            return "⚠️ Không tìm thấy sự kiện."
+        return f"🗑️ Đã xóa '{title}'."
     except Exception as e:
         return f"Lỗi xóa: {e}"
 
 
 @tool
-def thong_ke_tong_quan(user_id: str) -> str:
+@tool_cache.cached
+async def thong_ke_tong_quan(user_id: str) -> str:
     """
     Đếm số lượng: Task (cần làm/đã xong), Ghi chú, Sự kiện trong tuần.
     Dùng khi user hỏi: "Tổng quan", "Tôi có bao nhiêu việc", "Báo cáo tiến độ".
     """
     try:
-        with engine.connect() as conn:
-            # 1. Đếm Task theo trạng thái
-            task_stats = conn.execute(text("""
-                SELECT 
-                    COUNT(*) FILTER (WHERE status = 'todo') as todo,
-                    COUNT(*) FILTER (WHERE status = 'in_progress') as doing,
-                    COUNT(*) FILTER (WHERE status = 'done') as done
-                FROM tasks WHERE user_id = :uid
-            """), {"uid": user_id}).fetchone()
-
-            # 2. Đếm Note
-            note_count = conn.execute(text("SELECT COUNT(*) FROM notes WHERE user_id = :uid"),
-                                      {"uid": user_id}).scalar()
-
-            # 3. Đếm Sự kiện tuần này
-            event_count = conn.execute(text("""
-                SELECT COUNT(*) FROM events 
-                WHERE user_id = :uid 
-                AND start_time >= CURRENT_DATE 
-                AND start_time < CURRENT_DATE + INTERVAL '7 days'
-            """), {"uid": user_id}).scalar()
+        start = datetime.now(APP_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=7)
+        async with get_async_engine().connect() as conn:
+            # Task theo trạng thái + Note + Sự kiện 7 ngày tới (event lặp gom JSON để mở rộng) trong một truy vấn
+            stats = (await conn.execute(text(f"""
+                SELECT t.todo, t.doing, t.done, n.note_count, e.event_count,
+                       {recurring_events_json("start", "end")} AS recurring_events
+                FROM (
+                    SELECT
+                        COUNT(*) FILTER (WHERE status = 'todo') AS todo,
+                        COUNT(*) FILTER (WHERE status = 'in_progress') AS doing,
+                        COUNT(*) FILTER (WHERE status = 'done') AS done
+                    FROM tasks WHERE user_id = :uid
+                ) t,
+                (SELECT COUNT(*) AS note_count FROM notes WHERE user_id = :uid) n,
+                (
+                    SELECT COUNT(*) AS event_count FROM events
+                    WHERE user_id = :uid AND (recurring IS NULL OR recurring = 'none')
+                    AND start_time >= :start
+                    AND start_time < :end
+                ) e
+            """), {"uid": user_id, "start": start, "end": end})).fetchone()
+            event_count = stats.event_count + len(
+                expand_all(parse_events_json(stats.recurring_events), start, end, APP_TZ))
 
             return (
                 f"📊 BÁO CÁO TỔNG QUAN:\n"
-                f"- Công việc: {task_stats.todo} cần làm, {task_stats.doing} đang làm, {task_stats.done} đã xong.\n"
-                f"- Ghi chú: {note_count} ghi chú đã lưu.\n"
+                f"- Công việc: {stats.todo} cần làm, {stats.doing} đang làm, {stats.done} đã xong.\n"
+                f"- Ghi chú: {stats.note_count} ghi chú đã lưu.\n"
                 f"- Lịch trình: {event_count} sự kiện trong 7 ngày tới."
             )
     except Exception as e:
@@ -255,124 +398,111 @@ def thong_ke_tong_quan(user_id: str) -> str:
 
 
 @tool
-def liet_ke_danh_sach(user_id: str, loai: str = 'all', gioi_han: int = 5) -> str:
+@tool_cache.cached
+async def liet_ke_danh_sach(user_id: str, loai: str = 'all', gioi_han: int = 5, con_tro: Optional[str] = None) -> str:
     """
     Liệt kê danh sách các mục theo loại.
     loai: 'task' (công việc), 'note' (ghi chú), 'schedule' (lịch), 'deadline', hoặc 'all'.
     gioi_han: số lượng mục muốn xem (mặc định 5).
+    con_tro: để xem trang tiếp theo, truyền đúng giá trị con_tro mà lần gọi trước trả về.
     """
     try:
-        with engine.connect() as conn:
+        async with get_async_engine().connect() as conn:
             if loai in ['ghi chú', 'note']:
-                query = text("""
-                    SELECT content, created_at 
-                    FROM notes 
-                    WHERE user_id = :uid 
-                    ORDER BY created_at DESC 
-                    LIMIT :limit
-                """)
-                rows = conn.execute(
-                    query, {"uid": user_id, "limit": gioi_han}).fetchall()
-
-                if not rows:
+                page = await list_notes_page(conn, user_id, gioi_han, con_tro)
+                if not page.items:
                     return "📭 Bạn chưa có ghi chú nào."
 
-                result = f"📝 DANH SÁCH GHI CHÚ ({len(rows)} mục mới nhất):\n"
-                for row in rows:
+                result = f"📝 DANH SÁCH GHI CHÚ ({len(page.items)} mục mới nhất):\n"
+                for row in page.items:
                     date_str = row.created_at.strftime(
                         '%d/%m') if row.created_at else ""
                     preview = row.content.split('\n')[0][:50]
                     result += f"- [{date_str}] {preview}...\n"
-                return result
             else:
-                base_query = "SELECT title, type, start_time, description FROM events WHERE user_id = :uid"
-
-                if loai not in ['all', 'tất cả']:
-                    if loai in ['công việc', 'task']:
-                        db_type = 'task'
-                    elif loai in ['hạn', 'deadline']:
-                        db_type = 'deadline'
-                    elif loai in ['lịch', 'schedule']:
-                        db_type = 'schedule'
-                    else:
-                        db_type = loai
-                    base_query += f" AND type = '{db_type}'"
-
-                query = text(
-                    base_query + " ORDER BY start_time ASC NULLS LAST LIMIT :limit")
-                rows = conn.execute(
-                    query, {"uid": user_id, "limit": gioi_han}).fetchall()
-
-                if not rows:
+                page = await list_events_page(conn, user_id, normalize_type(loai), gioi_han, con_tro)
+                if not page.items:
                     return f"📭 Không tìm thấy mục nào thuộc loại '{loai}'."
 
-                result = f"📋 DANH SÁCH {loai.upper()} ({len(rows)} mục mới nhất):\n"
-                for row in rows:
-                    time_str = row.start_time.strftime(
+                result = f"📋 DANH SÁCH {loai.upper()} ({len(page.items)} mục):\n"
+                now = datetime.now(APP_TZ)
+                for row in page.items:
+                    time_str = row.start_time.astimezone(APP_TZ).strftime(
                         '%d/%m %H:%M') if row.start_time else "Không có giờ"
+                    if row.recurring in REPEAT_LABEL:
+                        # Event lặp: hiện lần diễn ra sắp tới thay cho lần đầu tiên
+                        upcoming = next_occurrence(row, now, tz=APP_TZ)
+                        time_str = f"{REPEAT_LABEL[row.recurring]}, lần tới " + (
+                            upcoming.start.strftime('%d/%m %H:%M') if upcoming else "không còn")
                     result += f"- [{row.type}] **{row.title}** ({time_str})\n"
-                return result
+            if page.next_cursor:
+                result += f"➡️ Còn nữa: gọi lại với con_tro='{page.next_cursor}' để xem tiếp."
+            return result
+    except ValueError as e:
+        return f"⚠️ {e}"
     except Exception as e:
         return f"Lỗi liệt kê: {e}"
 
 
 @tool
-def xem_chi_tiet_su_kien(user_id: str, tu_khoa: str) -> str:
+async def xem_chi_tiet_su_kien(user_id: str, tu_khoa: str) -> str:
     """
     Xem chi tiết MỘT sự kiện/task/note cụ thể dựa trên từ khóa tìm kiếm.
     Trả về toàn bộ nội dung, trạng thái, priority, checklist...
     """
     try:
-        with engine.connect() as conn:
-            # 1. Tìm Event cha trước
-            search_condition = """
-                (
-                    title ILIKE :kw_like
-                    OR 
-                    to_tsvector('simple', title) @@ plainto_tsquery('simple', :kw_plain)
+        query = search_params(tu_khoa)
+        if query is None:
+            return f"⚠️ Không tìm thấy sự kiện nào tên là '{tu_khoa}'."
+        async with get_async_engine().connect() as conn:
+            # Xếp hạng event + note, lấy chi tiết mục khớp nhất (kèm task + checklist) và các mục gần giống: 1 round trip
+            row = (await conn.execute(text(f"""
+                WITH {hits_sql(trigram=await trigram_enabled(conn))},
+                best AS (SELECT kind, id FROM hits ORDER BY {HIT_ORDER} LIMIT 1),
+                ev AS (
+                    SELECT e.id, e.title, e.description, e.type, e.start_time, e.end_time
+                    FROM events e JOIN best ON best.kind = 'event' AND e.id = best.id
+                ), task AS (
+                    SELECT t.id, t.priority, t.status, t.deadline
+                    FROM tasks t JOIN ev ON t.event_id = ev.id
+                    WHERE ev.type IN ('task', 'deadline')
+                    LIMIT 1
                 )
-            """
-            event = conn.execute(text(f"""
-                SELECT id, title, description, type, start_time, end_time 
-                FROM events 
-                WHERE user_id = :uid AND {search_condition}
-                LIMIT 1
-            """), {"uid": user_id, "kw_like": f"%{tu_khoa}%", "kw_plain": tu_khoa}).fetchone()
-
-            if event:
+                SELECT ev.title, ev.description, ev.type, ev.start_time, ev.end_time,
+                       task.id AS task_id, task.priority, task.status, task.deadline,
+                       (
+                           SELECT json_agg(json_build_object('content', c.content, 'is_checked', c.is_checked)
+                                           ORDER BY c.id)
+                           FROM checklist_items c WHERE c.task_id = task.id
+                       ) AS checklist,
+                       (
+                           SELECT n.content FROM notes n JOIN best ON best.kind = 'note' AND n.id = best.id
+                       ) AS note_content,
+                       {OTHERS_JSON} AS others
+                FROM (SELECT 1) AS one
+                LEFT JOIN ev ON true
+                LEFT JOIN task ON true
+            """), {"uid": user_id, "search_limit": 3, **query})).fetchone()
+            others = SearchResult(others=parse_hits(row.others)).describe_others()
+
+            if row.title is not None:
                 details = (
-                    f"🔎 CHI TIẾT: {event.title.upper()}\n"
-                    f"- Loại: {event.type}\n"
-                    f"- Thời gian: {event.start_time} -> {event.end_time}\n"
-                    f"- Mô tả chung: {event.description or 'Trống'}\n"
+                    f"🔎 CHI TIẾT: {row.title.upper()}\n"
+                    f"- Loại: {row.type}\n"
+                    f"- Thời gian: {row.start_time} -> {row.end_time}\n"
+                    f"- Mô tả chung: {row.description or 'Trống'}\n"
                 )
-                if event.type == 'task' or event.type == 'deadline':
-                    task = conn.execute(text("SELECT priority, status, deadline FROM tasks WHERE event_id = :eid"), {
-                                        "eid": event.id}).fetchone()
-                    if task:
-                        details += f"- Ưu tiên: {task.priority}\n- Trạng thái: {task.status}\n- Deadline: {task.deadline}\n"
-                        checklists = conn.execute(text("SELECT item_text, is_done FROM checklist_items WHERE task_id = (SELECT id FROM tasks WHERE event_id = :eid)"), {
-                                                  "eid": event.id}).fetchall()
-                        if checklists:
-                            details += "- Checklist:\n" + \
-                                "\n".join(
-                                    [f"  [{'x' if c.is_done else ' '}] {c.item_text}" for c in checklists])
-                return details
-
-            # 2. Tìm trong bảng NOTES
-            note_condition = """
-                (
-                    content ILIKE :kw_like 
-                    OR 
-                    to_tsvector('simple', content) @@ plainto_tsquery('simple', :kw_plain)
-                )
-            """
-            note = conn.execute(text(f"""
-                SELECT content, created_at FROM notes WHERE user_id = :uid AND {note_condition} LIMIT 1
-            """), {"uid": user_id, "kw_like": f"%{tu_khoa}%", "kw_plain": tu_khoa}).fetchone()
-
-            if note:
-                return f"📝 CHI TIẾT GHI CHÚ:\n{note.content}"
+                if row.task_id is not None:
+                    details += f"- Ưu tiên: {row.priority}\n- Trạng thái: {row.status}\n- Deadline: {row.deadline}\n"
+                    checklists = json.loads(row.checklist) if isinstance(row.checklist, str) else row.checklist
+                    if checklists:
+                        details += "- Checklist:\n" + \
+                            "\n".join(
+                                [f"  [{'x' if c['is_checked'] else ' '}] {c['content']}" for c in checklists])
+                return f"{details}\n{others}" if others else details
+
+            if row.note_content is not None:
+                return f"📝 CHI TIẾT GHI CHÚ:\n{row.note_content}" + (f"\n{others}" if others else "")
 
             return f"⚠️ Không tìm thấy sự kiện nào tên là '{tu_khoa}'."
     except Exception as e:
@@ -380,34 +510,195 @@ def xem_chi_tiet_su_kien(user_id: str, tu_khoa: str) -> str:
 
 
 @tool
-def lay_lich_trinh_tuan(user_id: str, start_date: Optional[str] = None) -> str:
+@tool_cache.cached
+async def lay_lich_trinh_tuan(user_id: str, start_date: Optional[str] = None) -> str:
     """Lấy danh sách sự kiện trong 7 ngày tới."""
     try:
-        with engine.connect() as conn:
-            s_date = datetime.now()
+        async with get_async_engine().connect() as conn:
+            s_date = datetime.now(APP_TZ)
             if start_date:
-                s_date, _ = parse_natural_time(start_date, datetime.now())
+                s_date, _ = parse_natural_time(start_date, s_date)
             e_date = s_date + timedelta(days=7)
 
-            query = text("""
-                SELECT title, type, start_time, end_time 
-                FROM events 
-                WHERE user_id = :uid 
-                AND start_time >= :start AND start_time <= :end
-                ORDER BY start_time ASC
-            """)
-            rows = conn.execute(
-                query, {"uid": user_id, "start": s_date, "end": e_date}).fetchall()
+            # Event thường + các lần lặp (daily/weekly/monthly) rơi vào 7 ngày, đã sắp theo giờ
+            occurrences = await fetch_occurrences(conn, user_id, s_date, e_date, tz=APP_TZ)
 
-            if not rows:
+            if not occurrences:
                 return "Lịch trình trống trong 7 ngày tới."
 
             data = "\n".join(
-                [f"- [{row.type}] {row.title}: {row.start_time}" for row in rows])
+                [f"- [{occ.type}] {occ.title}: {occ.start:%d/%m/%Y %H:%M}"
+                 + (f" ({REPEAT_LABEL[occ.recurring]})" if occ.recurring in REPEAT_LABEL else "")
+                 for occ in occurrences])
             return f"Dữ liệu lịch trình:\n{data}"
     except Exception as e:
         return f"Lỗi lấy lịch: {e}"
 
+
+THU = ["T2", "T3", "T4", "T5", "T6", "T7", "CN"]
+
+
+def _cua_so_xep_lich(tu_ngay: Optional[str], so_ngay: int) -> tuple[datetime, datetime]:
+    now = datetime.now(APP_TZ)
+    start = now
+    if tu_ngay:
+        parsed, _ = parse_natural_time(tu_ngay, now)
+        start = max(now, parsed.astimezone(APP_TZ))
+    return start, start + timedelta(days=max(1, min(so_ngay, 31)))
+
+
+def _gio_lam_viec(gio_bat_dau: int, gio_ket_thuc: int) -> tuple[dt_time, dt_time]:
+    gio_bat_dau = max(0, min(gio_bat_dau, 23))
+    return dt_time(gio_bat_dau), dt_time(gio_ket_thuc) if gio_bat_dau < gio_ket_thuc < 24 else dt_time.max
+
+
+async def _lay_khoang_ban(conn, user_id: str, start: datetime, end: datetime, bo_qua: tuple = ()) -> list[Interval]:
+    """Các khoảng bận của user trong cửa sổ (cùng truy vấn theo index với kiểm tra trùng giờ)."""
+    busy = []
+    for item in await find_conflicts(conn, user_id, start, end, exclude_ids=bo_qua, tz=APP_TZ):
+        s = to_datetime(item["start_time"]).astimezone(APP_TZ)
+        e = to_datetime(item["end_time"]).astimezone(APP_TZ) if item.get("end_time") else s + timedelta(hours=1)
+        busy.append(Interval(s, e))
+    return busy
+
+
+# Không cache: cửa sổ bắt đầu từ lúc gọi, kết quả cũ có thể chứa khung giờ đã trôi qua
+@tool
+async def tim_khung_gio_trong(user_id: str, so_phut: int = 60, tu_ngay: Optional[str] = None, so_ngay: int = 7,
+                              gio_bat_dau: int = 8, gio_ket_thuc: int = 22) -> str:
+    """
+    Tìm các khung giờ TRỐNG (dài ít nhất so_phut) trong so_ngay ngày tới, chỉ trong giờ làm việc
+    [gio_bat_dau, gio_ket_thuc). Dùng khi user hỏi 'lúc nào rảnh', 'còn giờ trống không', 'xếp thêm được không'.
+    """
+    try:
+        start, end = _cua_so_xep_lich(tu_ngay, so_ngay)
+        async with get_async_engine().connect() as conn:
+            busy = await _lay_khoang_ban(conn, user_id, start, end)
+        slots = free_slots(busy, start, end, *_gio_lam_viec(gio_bat_dau, gio_ket_thuc),
+                           min_duration=timedelta(minutes=so_phut))
+        if not slots:
+            return f"📭 Không còn khung trống nào dài {so_phut} phút trong {so_ngay} ngày tới."
+
+        by_day: dict[date, list[str]] = {}
+        for slot in slots:
+            by_day.setdefault(slot.start.date(), []).append(f"{slot.start:%H:%M}-{slot.end:%H:%M}")
+        lines = [f"- {THU[d.weekday()]} {d:%d/%m}: {', '.join(ranges)}" for d, ranges in by_day.items()]
+        return f"🕒 KHUNG GIỜ TRỐNG (≥ {so_phut} phút, {gio_bat_dau}h-{gio_ket_thuc}h):\n" + "\n".join(lines)
+    except Exception as e:
+        return f"Lỗi tìm giờ trống: {e}"
+
+
+@tool
+async def sap_xep_lich_tu_dong(user_id: str, tieu_de: Optional[str] = None, ap_dung: bool = False,
+                               so_ngay: int = 7, thoi_luong_phut: int = 60,
+                               gio_bat_dau: int = 8, gio_ket_thuc: int = 22) -> str:
+    """
+    Tự động xếp giờ cho công việc chưa xong, không trùng lịch, theo deadline và độ ưu tiên.
+    - tieu_de: chỉ xếp (hoặc dời) các task có tên khớp; bỏ trống = xếp mọi task chưa có giờ.
+    - ap_dung=False: chỉ ĐỀ XUẤT; gọi lại với ap_dung=True khi user đồng ý để lưu vào lịch.
+    - thoi_luong_phut: thời lượng mặc định cho task chưa có giờ kết thúc.
+    Dùng khi user nói 'sắp xếp lại', 'dời lịch giúp', 'xếp lịch cho các việc'.
+    """
+    try:
+        start, end = _cua_so_xep_lich(None, so_ngay)
+        async with get_async_engine().begin() as conn:
+            rows = (await conn.execute(text("""
+                SELECT e.id AS event_id, e.title, e.start_time, e.end_time, t.priority, t.deadline
+                FROM tasks t JOIN events e ON e.id = t.event_id
+                WHERE t.user_id = :uid AND t.status <> 'done'
+                  AND (
+                      (CAST(:kw AS text) IS NULL AND e.start_time IS NULL)
+                      OR e.title ILIKE CAST(:kw AS text)
+                  )
+                ORDER BY t.deadline ASC NULLS LAST
+                LIMIT 20
+            """), {"uid": user_id, "kw": f"%{tieu_de}%" if tieu_de else None})).fetchall()
+            if not rows:
+                return "📭 Không có công việc nào cần xếp lịch."
+
+            requests = []
+            for row in rows:
+                duration = (row.end_time - row.start_time) if row.start_time and row.end_time \
+                    else timedelta(minutes=thoi_luong_phut)
+                requests.append(TaskRequest(key=row.event_id, title=row.title, duration=duration,
+                                            priority=row.priority or "medium",
+                                            deadline=row.deadline.astimezone(APP_TZ) if row.deadline else None))
+
+            busy = await _lay_khoang_ban(conn, user_id, start, end, bo_qua=tuple(r.event_id for r in rows))
+            slots = free_slots(busy, start, end, *_gio_lam_viec(gio_bat_dau, gio_ket_thuc))
+            plan = plan_tasks(requests, slots)
+
+            if ap_dung and plan.placements:
+                # Dời toàn bộ event + schedule (tạo schedule nếu chưa có) trong một câu lệnh
+                await conn.execute(text("""
+                    WITH moves AS (
+                        SELECT * FROM unnest(CAST(:ids AS bigint[]), CAST(:starts AS timestamptz[]),
+                                             CAST(:ends AS timestamptz[])) AS m(event_id, s, e)
+                    ), moved AS (
+                        UPDATE events ev SET start_time = m.s, end_time = m.e, updated_at = NOW()
+                        FROM moves m WHERE ev.id = m.event_id AND ev.user_id = :uid
+                        RETURNING ev.id
+                    ), moved_schedules AS (
+                        UPDATE schedules sc SET start_time = m.s, end_time = m.e, updated_at = NOW()
+                        FROM moves m JOIN moved ON moved.id = m.event_id
+                        WHERE sc.event_id = m.event_id
+                        RETURNING sc.event_id
+                    )
+                    INSERT INTO schedules (user_id, event_id, start_time, end_time)
+                    SELECT :uid, m.event_id, m.s, m.e
+                    FROM moves m JOIN moved ON moved.id = m.event_id
+                    WHERE NOT EXISTS (SELECT 1 FROM schedules sc WHERE sc.event_id = m.event_id)
+                """), {"uid": user_id,
+                       "ids": [p.task.key for p in plan.placements],
+                       "starts": [p.start for p in plan.placements],
+                       "ends": [p.end for p in plan.placements]})
+        if ap_dung and plan.placements:
+            # Chỉ làm mất hiệu lực cache khi thật sự đã ghi (sau commit); đề xuất (ap_dung=False) không ghi gì
+            tool_cache.bump(user_id)
+
+        header = "✅ ĐÃ XẾP LỊCH:" if ap_dung else "📝 ĐỀ XUẤT XẾP LỊCH (chưa lưu, cần user xác nhận):"
+        lines = [f"- {p.task.title}: {THU[p.start.weekday()]} {p.start:%d/%m %H:%M}-{p.end:%H:%M}"
+                 for p in plan.placements]
+        lines += [f"- ⚠️ {task.title}: {reason}" for task, reason in plan.unplaced]
+        return header + "\n" + "\n".join(lines)
+    except Exception as e:
+        return f"Lỗi xếp lịch: {e}"
+
+
+class SuKienMoi(BaseModel):
+    tieu_de: str
+    loai_su_kien: str = "schedule"
+    bat_dau: Optional[str] = None
+    ket_thuc: Optional[str] = None
+    mo_ta: Optional[str] = None
+    uu_tien: str = "medium"
+    lap_lai: str = "none"
+    lap_den: Optional[str] = None
+    dia_diem: Optional[str] = None
+
+
+@tool
+@tool_cache.invalidates
+async def tao_nhieu_su_kien(user_id: str, danh_sach: list[SuKienMoi]) -> str:
+    """
+    Tạo NHIỀU sự kiện/task trong MỘT lần gọi (thời khóa biểu cả học kỳ, lịch ca cả tháng).
+    Mỗi mục: tieu_de, loai_su_kien (class, workshift, task, schedule, deadline), bat_dau/ket_thuc (ISO hoặc lời user),
+    lap_lai ('weekly', 'daily', 'monthly') + lap_den (ngày cuối) để một mục thay cho cả chuỗi buổi học.
+    """
+    try:
+        if len(danh_sach) > BATCH_MAX_EVENTS:
+            return f"⚠️ Tối đa {BATCH_MAX_EVENTS} sự kiện mỗi lần."
+        rows = [item.model_dump() if isinstance(item, BaseModel) else dict(item) for item in danh_sach]
+        inputs, errors = build_inputs(rows, datetime.now(APP_TZ))
+        async with get_async_engine().begin() as conn:
+            result = await insert_events(conn, user_id, inputs)
+        result.errors = errors
+        return result.summary()
+    except Exception as e:
+        logger.error(f"Lỗi tạo nhiều sự kiện: {e}")
+        return f"❌ Có lỗi xảy ra: {str(e)}"
+
+
 # --- 4. CẤU HÌNH AGENT & PROMPT ---
 
 
@@ -420,9 +711,21 @@ tools = [
     xoa_su_kien_toan_tap,
     thong_ke_tong_quan,
     liet_ke_danh_sach,
-    xem_chi_tiet_su_kien
+    xem_chi_tiet_su_kien,
+    tim_khung_gio_trong,
+    sap_xep_lich_tu_dong,
+    tao_nhieu_su_kien,
 ]
 
+# Nhiều tool call trong một bước: tool đọc chạy song song (tối đa TOOL_USER_CONCURRENCY/user), tool ghi của cùng
+# user giữ đúng thứ tự; toàn server tối đa TOOL_CONCURRENCY tool giữ connection, mặc định chừa TOOL_POOL_RESERVE
+# connection của pool cho các API khác
+WRITE_TOOLS = {"tao_su_kien_toan_dien", "cap_nhat_su_kien", "tao_ghi_chu_thong_minh", "xoa_su_kien_toan_tap",
+               "sap_xep_lich_tu_dong", "tao_nhieu_su_kien"}
+tool_scheduler = ToolScheduler(
+    int(os.getenv("TOOL_CONCURRENCY") or DB_POOL_SIZE + DB_MAX_OVERFLOW - int(os.getenv("TOOL_POOL_RESERVE", "4"))),
+    per_user=int(os.getenv("TOOL_USER_CONCURRENCY", "4")), writes=WRITE_TOOLS)
+
 system_prompt = f"""
 Bạn là Skedule AI Agent. Hôm nay là {date.today().strftime('%d/%m/%Y')}
 
@@ -435,6 +738,15 @@ QUY TẮC CỐT LÕI:
    - Tự động dùng 'medium' cho độ ưu tiên nếu thiếu.
    - Tự suy luận loại event (deadline, class, task...) từ ngữ cảnh.
    - Trả lời ngắn gọn, đi thẳng vào vấn đề.
+
+3. XẾP LỊCH:
+   - Hỏi giờ rảnh -> `tim_khung_gio_trong`, không tự suy luận từ danh sách lịch.
+   - 'Sắp xếp lại', 'xếp lịch cho các việc' -> `sap_xep_lich_tu_dong` (ap_dung=False để đề xuất trước,
+     chỉ gọi ap_dung=True khi user đồng ý).
+
+4. NHIỀU SỰ KIỆN (thời khóa biểu, lịch ca):
+   - Gọi `tao_nhieu_su_kien` MỘT lần với cả danh sách, không gọi `tao_su_kien_toan_dien` lặp lại.
+   - Buổi học/ca lặp hằng tuần: một mục với lap_lai='weekly' và lap_den = ngày kết thúc học kỳ.
 """
 
 prompt_template = ChatPromptTemplate.from_messages([
@@ -444,44 +756,541 @@ prompt_template = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="agent_scratchpad"),
 ])
 
-agent_executor = AgentExecutor(agent=create_tool_calling_agent(
-    llm_brain, tools, prompt_template), tools=tools, verbose=True)
+# Lịch sử chat: 'memory' (LRU + TTL, 1 worker) hoặc 'sql' (Postgres/SQLite dùng chung nhiều worker)
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "memory")
+CHAT_HISTORY_URL = os.getenv("CHAT_HISTORY_URL")
 
-store = {}
 
+def _create_history_store():
+    history_engine = None
+    if CHAT_HISTORY_BACKEND == "sql":
+        history_engine = (timed_import("sqlalchemy").create_engine(CHAT_HISTORY_URL, pool_pre_ping=True)
+                          if CHAT_HISTORY_URL else get_engine())
+    return create_history_store(
+        CHAT_HISTORY_BACKEND,
+        engine=history_engine,
+        max_sessions=int(os.getenv("CHAT_HISTORY_MAX_SESSIONS", "1000")),
+        ttl_seconds=int(os.getenv("CHAT_HISTORY_TTL", "3600")),
+        max_messages=int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "40")),
+    )
 
-def get_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+
+lazy_history_store = Lazy("history_store", _create_history_store)
 
 
-agent_with_history = RunnableWithMessageHistory(
-    agent_executor, get_history, input_messages_key="input", history_messages_key="chat_history")
+def get_history(session_id: str) -> BaseChatMessageHistory:
+    return lazy_history_store.get().get_history(session_id)
+
+
+def build_agent(llm):
+    """Dựng agent (kèm nén lịch sử) quanh một chat model; benchmark truyền model giả lập vào đây."""
+    agents = timed_import("langchain.agents")
+    AgentExecutor, create_tool_calling_agent = agents.AgentExecutor, agents.create_tool_calling_agent
+    RunnableWithMessageHistory = timed_import("langchain_core.runnables.history").RunnableWithMessageHistory
+
+    class ScheduledAgentExecutor(AgentExecutor):
+        """Tool call trong một bước vẫn chạy cùng lúc, nhưng qua tool_scheduler (giới hạn + thứ tự ghi)."""
+
+        async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+            tool_input = agent_action.tool_input if isinstance(agent_action.tool_input, dict) else {}
+            async with tool_scheduler.slot(tool_input.get("user_id"), agent_action.tool):
+                return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action,
+                                                            run_manager)
+
+    executor = ScheduledAgentExecutor(agent=create_tool_calling_agent(
+        llm, tools, prompt_template), tools=tools, verbose=os.getenv("AGENT_VERBOSE", "1") == "1")
+    # Nén lịch sử: giữ N lượt gần nhất, phần cũ gộp vào tóm tắt cuộn, giới hạn theo token
+    compactor = HistoryCompactor(
+        llm,
+        keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", "6")),
+        max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "3000")),
+    )
+    return RunnableWithMessageHistory(
+        compactor.as_runnable() | executor, get_history, input_messages_key="input", history_messages_key="chat_history")
+
+
+# Agent (RunnableWithMessageHistory) dựng ở lần dùng đầu tiên; benchmark gọi lazy_agent.set(...)
+lazy_agent = Lazy("agent", lambda: build_agent(lazy_llm.get()))
+
+
+async def _xoa_ro_rang(args: dict, user_id: str) -> bool:
+    """Xóa không qua LLM chỉ khi từ khóa trỏ đúng một sự kiện; mơ hồ/không thấy -> agent hỏi lại."""
+    async with get_async_engine().connect() as conn:
+        return await unique_match(conn, user_id, args["tieu_de"]) is not None
+
+
+# Fast-path: lệnh đơn giản (xem lịch tuần, tổng quan, liệt kê, xóa) gọi thẳng tool, không qua LLM
+intent_router = IntentRouter({t.name: t for t in tools}, callbacks=[metrics_callback],
+                             guards={"xoa_su_kien_toan_tap": _xoa_ro_rang})
+
+# Gửi nhắc nhở: REMINDER_DELIVERY=off (mặc định, không chạy) | log | stub | webhook (REMINDER_WEBHOOK_URL)
+REMINDER_DELIVERY = os.getenv("REMINDER_DELIVERY", "off").lower()
+reminder_dispatcher = ReminderDispatcher(
+    get_async_engine,
+    create_delivery(REMINDER_DELIVERY, url=os.getenv("REMINDER_WEBHOOK_URL")) if REMINDER_DELIVERY != "off"
+    else create_delivery("log"),
+    batch=int(os.getenv("REMINDER_BATCH", "200")),
+    lookahead=float(os.getenv("REMINDER_LOOKAHEAD", "600")),
+    refresh=float(os.getenv("REMINDER_REFRESH", "30")),
+    tick=float(os.getenv("REMINDER_TICK", "1")),
+    max_late=float(os.getenv("REMINDER_MAX_LATE", "3600")),
+)
 
 # --- 5. API ---
 app = FastAPI(title="Skedule AI Agent v1.5")
 # app.include_router(payment_router) # Uncomment nếu cần
 
 
+metrics.add_collector("history", lambda: lazy_history_store.peek().stats() if lazy_history_store.ready else {})
+metrics.add_collector("router", intent_router.stats)
+metrics.add_collector("tool_cache", tool_cache.stats)
+metrics.add_collector("tts", tts_service.stats)
+metrics.add_collector("stt", stt_service.stats)
+metrics.add_collector("admission_agent", agent_gate.stats)
+metrics.add_collector("admission_tts", tts_gate.stats)
+metrics.add_collector("rate_limit", chat_rate_limiter.stats)
+metrics.add_collector("session_lanes", session_lanes.stats)
+metrics.add_collector("audio_store", audio_store.stats)
+metrics.add_collector("tool_scheduler", tool_scheduler.stats)
+metrics.add_collector("reminders", reminder_dispatcher.stats)
+
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    total = time.perf_counter() - start
+    # Nhãn theo mẫu route (/audio/{audio_id}), không theo URL thật: số series/histogram không tăng theo id, con trỏ
+    route = request.scope.get("route")
+    metrics.observe("request", total, path=getattr(route, "path", None) or "other")
+    # Với response streaming, header chỉ chứa các stage xong trước byte đầu tiên
+    response.headers["Server-Timing"] = server_timing_header({**timings, "total": total})
+    return response
+
+
+# STARTUP_WARMUP: background (mặc định, server nhận request ngay) | blocking | off (dựng khi dùng lần đầu)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+_warmup_task: Optional[asyncio.Task] = None
+
+
+async def warm_up() -> None:
+    """Nạp các module/client nặng trong thread riêng rồi log báo cáo chi phí khởi động."""
+    targets = [lazy_history_store, lazy_async_engine, lazy_agent]
+    if AUTH_VERIFY_MODE != "local" or not jwt_verifier.enabled:
+        targets.append(lazy_supabase)
+    for target in targets:
+        try:
+            await target.aget()
+        except Exception as e:
+            logger.error(f"❌ Warm-up {target.name} lỗi: {e}")
+    report = startup_report()
+    logger.info("🚀 Warm-up xong. Import: " + ", ".join(f"{i['name']}={i['ms']}ms" for i in report["imports"])
+                + " | Khởi tạo: " + ", ".join(f"{i['name']}={i['ms']}ms" for i in report["inits"]))
+
+
+@app.on_event("startup")
+async def on_startup():
+    global _warmup_task
+    # Nạp & làm mới JWKS ở background để xác thực token không cần gọi Supabase Auth
+    jwt_verifier.start_background_refresh()
+    if REMINDER_DELIVERY != "off":
+        reminder_dispatcher.start()
+    if STARTUP_WARMUP == "blocking":
+        await warm_up()
+    elif STARTUP_WARMUP == "background":
+        _warmup_task = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if _warmup_task and not _warmup_task.done():
+        _warmup_task.cancel()
+    await jwt_verifier.stop_background_refresh()
+    await reminder_dispatcher.stop()
+    if lazy_async_engine.ready:
+        await lazy_async_engine.peek().dispose()
+
+
+@app.get("/")
+@app.get("/healthz")
+async def health():
+    # Trả lời ngay, không chờ warm-up (Render ping khi dyno vừa thức dậy)
+    return {"status": "online", "ready": lazy_agent.ready,
+            "warmup": "done" if lazy_agent.ready else STARTUP_WARMUP}
+
+
+@app.get("/startup/report")
+async def startup_report_endpoint():
+    return startup_report()
+
+
+@app.get("/metrics")
+async def metrics_endpoint(format: str = "prometheus"):
+    if format == "json":
+        return metrics.snapshot()
+    text_metrics = await asyncio.to_thread(metrics.render_prometheus)
+    return PlainTextResponse(text_metrics, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/history/stats")
+async def history_stats():
+    return await asyncio.to_thread(lambda: lazy_history_store.get().stats())
+
+
+@app.get("/router/stats")
+async def router_stats():
+    return intent_router.stats()
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return {"rate_limit": chat_rate_limiter.stats(), "agent": agent_gate.stats(), "tts": tts_gate.stats(),
+            "stt": stt_service.stats(), "session_lanes": session_lanes.stats()}
+
+
+@app.get("/reminders/stats")
+async def reminders_stats():
+    return reminder_dispatcher.stats()
+
+
+@app.get("/tool-cache/stats")
+async def tool_cache_stats():
+    return tool_cache.stats()
+
+
+@app.post("/tool-cache/invalidate")
+async def tool_cache_invalidate(user_id: str = Depends(get_current_user_id)):
+    # App ghi thẳng vào Supabase gọi endpoint này để agent không trả dữ liệu cũ
+    tool_cache.bump(user_id)
+    return {"status": "ok"}
+
+
+@app.post("/events/batch")
+async def events_batch(items: list[dict] = Body(...), user_id: str = Depends(get_current_user_id)):
+    """Tạo nhiều sự kiện trong một transaction (cùng định dạng mục với tool tao_nhieu_su_kien)."""
+    if len(items) > BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {BATCH_MAX_EVENTS} sự kiện mỗi lần.")
+    inputs, errors = build_inputs(items, datetime.now(APP_TZ))
+    async with get_async_engine().begin() as conn:
+        result = await insert_events(conn, user_id, inputs)
+    result.errors = errors
+    tool_cache.bump(user_id)
+    return result.as_dict()
+
+
+@app.post("/events/import")
+async def events_import(file: UploadFile = File(...), loai_mac_dinh: str = Form("schedule"),
+                        user_id: str = Depends(get_current_user_id)):
+    """
+    Import thời khóa biểu/lịch ca từ file CSV (dòng đầu là tên cột) hoặc ICS.
+    Đọc file theo từng BATCH_CHUNK dòng và ghi ngay, tất cả trong một transaction (lỗi giữa chừng -> không ghi gì).
+    """
+    is_ics = (file.filename or "").lower().endswith(".ics") or file.content_type == "text/calendar"
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", errors="replace", newline="")
+    rows = iter_ics_rows(stream, APP_TZ) if is_ics else iter_csv_rows(stream)
+    base = datetime.now(APP_TZ)
+    result, row_number = BatchResult(), 1 if is_ics else 2
+    async with get_async_engine().begin() as conn:
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(islice(rows, BATCH_CHUNK)))
+            if not chunk:
+                break
+            if result.events + len(chunk) > BATCH_MAX_EVENTS:
+                raise HTTPException(status_code=413, detail=f"Tối đa {BATCH_MAX_EVENTS} sự kiện mỗi lần.")
+            inputs, errors = build_inputs(chunk, base, loai_mac_dinh, first_row=row_number)
+            row_number += len(chunk)
+            written = await insert_events(conn, user_id, inputs)
+            written.errors = errors
+            result.add(written)
+    tool_cache.bump(user_id)
+    return result.as_dict()
+
+
+@app.get("/events")
+async def events_page(loai: str = "all", limit: int = 20, cursor: Optional[str] = None,
+                      user_id: str = Depends(get_current_user_id)):
+    """Danh sách sự kiện theo giờ bắt đầu, phân trang keyset: gửi lại next_cursor để lấy trang sau."""
+    try:
+        event_type = normalize_type(loai)
+        async with get_async_engine().connect() as conn:
+            page = await list_events_page(conn, user_id, event_type, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = [{"id": r.id, "title": r.title, "type": r.type, "start_time": r.start_time, "end_time": r.end_time,
+              "recurring": r.recurring, "recurring_until": r.recurring_until, "description": r.description,
+              "location": r.location} for r in page.items]
+    return {"items": items, "next_cursor": page.next_cursor}
+
+
+@app.get("/notes")
+async def notes_page(limit: int = 20, cursor: Optional[str] = None, user_id: str = Depends(get_current_user_id)):
+    """Ghi chú mới nhất trước, phân trang keyset theo (created_at, id)."""
+    try:
+        async with get_async_engine().connect() as conn:
+            page = await list_notes_page(conn, user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": [{"id": r.id, "content": r.content, "created_at": r.created_at} for r in page.items],
+            "next_cursor": page.next_cursor}
+
+
+@app.get("/events/export")
+async def events_export(format: str = "ics", loai: str = "all", user_id: str = Depends(get_current_user_id)):
+    """Tải toàn bộ lịch dạng .ics (import vào Google/Apple Calendar) hoặc NDJSON, stream từ server-side cursor."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format phải là 'ics' hoặc 'ndjson'.")
+    try:
+        event_type = normalize_type(loai)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body():
+        # Kết nối sống cùng response: mở trong generator, trả về pool khi stream xong (hoặc client ngắt)
+        async with get_async_engine().connect() as conn:
+            async for chunk in iter_export(conn, user_id, format, event_type):
+                yield chunk
+
+    filename = "skedule.ics" if format == "ics" else "skedule.ndjson"
+    return StreamingResponse(body(), media_type=EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                                      "Cache-Control": "no-cache"})
+
+
+@app.api_route("/audio/{audio_id}", methods=["GET", "HEAD"])
+async def get_audio(audio_id: str, request: Request, codec: Optional[str] = None):
+    """
+    Audio câu trả lời dạng nhị phân. Không kèm Range và codec -> gửi từng câu ngay khi tổng hợp xong;
+    có Range -> 206 đúng đoạn yêu cầu (player tua/tiếp tục tải). id ngẫu nhiên 128 bit, hết hạn sau AUDIO_TTL.
+    """
+    clip = audio_store.get(audio_id)
+    if clip is None:
+        raise HTTPException(status_code=404, detail="Audio không tồn tại hoặc đã hết hạn.")
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": f"private, max-age={int(audio_store.ttl_seconds)}",
+               "ETag": f'"{clip.id}-{codec or clip.format}"'}
+    range_header = request.headers.get("range")
+    await clip.ready()
+    if not range_header and codec not in AUDIO_CODECS and not clip.done:
+        return StreamingResponse(clip.iter_chunks(), media_type=AUDIO_MIME.get(clip.format), headers=headers)
+
+    try:
+        chunks, audio_format = await audio_store.encoded(clip, codec)
+    except Overloaded as e:
+        raise _overloaded(e, "tts")
+    except Exception as e:
+        logger.error(f"Lỗi TTS: {e}")
+        raise HTTPException(status_code=503, detail="Không tạo được audio, thử lại sau nhé.")
+    size = sum(len(c) for c in chunks)
+    headers["ETag"] = f'"{clip.id}-{audio_format}"'
+    try:
+        byte_range = parse_range(range_header, size) if request.headers.get("if-range", headers["ETag"]) == \
+            headers["ETag"] else None
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Range không hợp lệ.", headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if request.method == "HEAD":
+        return Response(status_code=206 if byte_range else 200, headers=headers,
+                        media_type=AUDIO_MIME.get(audio_format))
+    return StreamingResponse(iter_slices(chunks, start, end), status_code=206 if byte_range else 200,
+                             media_type=AUDIO_MIME.get(audio_format), headers=headers)
+
+
 @app.post("/chat")
-async def chat(prompt: Optional[str] = Form(None), audio_file: Optional[UploadFile] = File(None), user_id: str = Depends(get_current_user_id)):
+async def chat(request: Request, prompt: Optional[str] = Form(None), audio_file: Optional[UploadFile] = File(None),
+               audio: str = Form("base64"), audio_codec: Optional[str] = Form(None),
+               user_id: str = Depends(get_current_user_id)):
+    """audio=base64 (mặc định, app bản cũ chỉ đọc audio_base64): audio nằm trong JSON;
+    audio=url (app mới gửi): trả audio_url để tải/phát dần."""
+    try:
+        chat_rate_limiter.check(user_id, CHAT_VOICE_COST if audio_file else 1)
+    except Overloaded as e:
+        raise _overloaded(e, "rate_limit")
+    # Client gửi Idempotency-Key (mỗi tin nhắn một khóa): retry nhận lại đúng kết quả cũ trong IDEMPOTENCY_TTL giây
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key:
+        return await session_lanes.coalesce(("chat-idem", user_id, idempotency_key),
+                                            lambda: _chat(prompt, audio_file, user_id, audio, audio_codec),
+                                            keep=IDEMPOTENCY_TTL)
+    return await _chat(prompt, audio_file, user_id, audio, audio_codec)
+
+
+async def _chat(prompt: Optional[str], audio_file: Optional[UploadFile], user_id: str, audio: str = "base64",
+                audio_codec: Optional[str] = None) -> dict:
     user_prompt = await audio_to_text(audio_file) if audio_file else prompt
     if not user_prompt:
         raise HTTPException(status_code=400, detail="Thiếu nội dung.")
+    # Cùng nội dung khi request trước vẫn đang chạy (double tap, mạng chập chờn) -> dùng chung một lượt agent
+    return await session_lanes.coalesce(("chat", user_id, content_key(user_prompt), audio, audio_codec),
+                                        lambda: _chat_reply(user_prompt, user_id, audio, audio_codec))
 
+
+async def _chat_reply(user_prompt: str, user_id: str, audio: str = "base64", audio_codec: Optional[str] = None) -> dict:
+    session_id = f"user_{user_id}"
     try:
-        result = agent_with_history.invoke(
-            {"input": user_prompt, "user_id": user_id},
-            config={"configurable": {"session_id": f"user_{user_id}"}}
-        )
-        ai_text = result.get("output", "Tôi đang suy nghĩ...")
+        # Một user chỉ một lượt tại một thời điểm: history và tool ghi không bị hai request chen nhau
+        async with session_lanes.lane(session_id):
+            ai_text = await intent_router.aroute(user_prompt, user_id)
+            if ai_text is not None:
+                metrics.inc("chat_requests_total", route="fast_path")
+                # Ghi vào lịch sử để agent vẫn có ngữ cảnh ở các lượt sau
+                await get_history(session_id).aadd_messages(
+                    [HumanMessage(content=user_prompt), AIMessage(content=ai_text)])
+            else:
+                metrics.inc("chat_requests_total", route="agent")
+                async with agent_gate.slot(), metrics.stage("agent"):
+                    agent_with_history = await lazy_agent.aget()
+                    result = await agent_with_history.ainvoke(
+                        {"input": user_prompt, "user_id": user_id},
+                        config={"configurable": {"session_id": session_id}, "callbacks": [metrics_callback]}
+                    )
+                ai_text = result.get("output", "Tôi đang suy nghĩ...")
+    except Overloaded as e:
+        raise _overloaded(e, "session" if e.status_code == 429 else "agent")
     except Exception as e:
         logger.error(f"Agent Error: {e}")
         ai_text = "Hệ thống đang bận, bạn thử lại sau nhé."
 
-    return {
-        "user_prompt": user_prompt,
-        "text_response": ai_text,
-        "audio_base64": text_to_base64_audio(ai_text)
-    }
+    if audio == "base64":
+        return {
+            "user_prompt": user_prompt,
+            "text_response": ai_text,
+            "audio_base64": await text_to_base64_audio(ai_text)
+        }
+    return {"user_prompt": user_prompt, "text_response": ai_text, **start_audio(ai_text, audio_codec)}
+
+
+def _chunk_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    # Gemini có thể trả về list các phần nội dung
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content or [])
+
+
+async def _chat_events(user_prompt: str, user_id: str, key: tuple, keep: float = 0, audio: str = "base64",
+                       audio_codec: Optional[str] = None):
+    """Sinh (event, data) theo thứ tự: prompt -> tool -> text -> done -> audio -> end."""
+    yield "prompt", {"user_prompt": user_prompt}
+
+    session_id = f"user_{user_id}"
+    ai_text = None
+    shared, leader = session_lanes.claim(key, keep)
+    if not leader:
+        # Request giống hệt đang chạy (double tap / retry): chờ câu trả lời của nó, không gọi agent lần nữa
+        metrics.inc("chat_requests_total", route="coalesced")
+        ai_text = await asyncio.shield(shared) or "Hệ thống đang bận, bạn thử lại sau nhé."
+        yield "text", {"delta": ai_text}
+    else:
+        try:
+            async with session_lanes.lane(session_id):
+                ai_text = await intent_router.aroute(user_prompt, user_id)
+                if ai_text is not None:
+                    metrics.inc("chat_requests_total", route="fast_path")
+                    await get_history(session_id).aadd_messages(
+                        [HumanMessage(content=user_prompt), AIMessage(content=ai_text)])
+                    yield "text", {"delta": ai_text}
+                else:
+                    metrics.inc("chat_requests_total", route="agent")
+                    streamed = []
+                    async with agent_gate.slot():
+                        agent_with_history = await lazy_agent.aget()
+                        async for event in agent_with_history.astream_events(
+                                {"input": user_prompt, "user_id": user_id},
+                                config={"configurable": {"session_id": session_id}, "callbacks": [metrics_callback]},
+                                version="v2"):
+                            kind = event["event"]
+                            if kind == "on_tool_start":
+                                yield "tool_start", {"tool": event["name"], "input": event["data"].get("input")}
+                            elif kind == "on_tool_end":
+                                yield "tool_end", {"tool": event["name"]}
+                            elif kind == "on_chat_model_stream":
+                                delta = _chunk_text(event["data"]["chunk"].content)
+                                if delta:
+                                    streamed.append(delta)
+                                    yield "text", {"delta": delta}
+                            elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                                output = event["data"].get("output")
+                                if isinstance(output, dict) and output.get("output"):
+                                    ai_text = _chunk_text(output["output"])
+                    ai_text = ai_text or "".join(streamed) or "Tôi đang suy nghĩ..."
+        except Overloaded as e:
+            # Header đã gửi (200) -> báo quá tải bằng event, client tự thử lại sau retry_after giây
+            metrics.inc("admission_rejected_total", gate="session" if e.status_code == 429 else "agent",
+                        status=e.status_code)
+            yield "error", {"status": e.status_code, "detail": str(e), "retry_after": int(e.retry_after_header)}
+            yield "end", {}
+            return
+        except Exception as e:
+            logger.error(f"Agent Error: {e}")
+            ai_text = "Hệ thống đang bận, bạn thử lại sau nhé."
+            yield "text", {"delta": ai_text}
+        finally:
+            # Kể cả khi client ngắt giữa chừng: request trùng đang chờ không bị treo
+            session_lanes.resolve(key, shared, ai_text)
+
+    yield "done", {"text_response": ai_text}
+
+    if audio != "base64":
+        # Một event với URL: client phát dần qua GET /audio/{id}, stream chữ không phải chở audio
+        if ai_text:
+            yield "audio", start_audio(ai_text, audio_codec)
+        yield "end", {}
+        return
+
+    # Kiểu cũ: audio base64 theo từng câu, câu nào tổng hợp xong thì gửi ngay
+    try:
+        index = 0
+        async with tts_gate.slot():
+            async for audio in tts_service.iter_audio(ai_text):
+                yield "audio", {"index": index, "format": tts_service.engine.audio_format,
+                                "audio_base64": base64.b64encode(audio).decode('utf-8')}
+                index += 1
+    except Overloaded as e:
+        metrics.inc("admission_rejected_total", gate="tts", status=e.status_code)
+        logger.warning(f"⚠️ Bỏ qua TTS: {e}")
+    except Exception as e:
+        logger.error(f"Lỗi TTS: {e}")
+    yield "end", {}
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request, prompt: Optional[str] = Form(None),
+                      audio_file: Optional[UploadFile] = File(None), format: str = "sse",
+                      audio: str = Form("base64"), audio_codec: Optional[str] = Form(None),
+                      user_id: str = Depends(get_current_user_id)):
+    """Giống /chat nhưng trả về từng phần: Server-Sent Events (mặc định) hoặc NDJSON (?format=ndjson)."""
+    try:
+        chat_rate_limiter.check(user_id, CHAT_VOICE_COST if audio_file else 1)
+        if agent_gate.would_reject():
+            # Từ chối trước khi gửi header 200 để client nhận đúng 503 + Retry-After
+            raise Overloaded("Hàng đợi trợ lý AI đang đầy", retry_after=agent_gate.retry_after())
+    except Overloaded as e:
+        raise _overloaded(e, "rate_limit" if e.status_code == 429 else "agent")
+    user_prompt = await audio_to_text(audio_file) if audio_file else prompt
+    if not user_prompt:
+        raise HTTPException(status_code=400, detail="Thiếu nội dung.")
+
+    idempotency_key = request.headers.get("Idempotency-Key")
+    key = ("stream-idem", user_id, idempotency_key) if idempotency_key else ("stream", user_id, content_key(user_prompt))
+
+    async def body():
+        async for event, data in _chat_events(user_prompt, user_id, key, IDEMPOTENCY_TTL if idempotency_key else 0,
+                                              audio, audio_codec):
+            payload = json.dumps(data, ensure_ascii=False, default=str)
+            if format == "ndjson":
+                yield f'{{"event": "{event}", "data": {payload}}}\n'
+            else:
+                yield f"event: {event}\ndata: {payload}\n\n"
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(body(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+import_costs[__name__] = time.perf_counter() - _IMPORT_START
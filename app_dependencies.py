@@ -1,12 +1,20 @@
 import os
 import logging
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.engine.base import Engine
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from utils.jwt_verifier import SupabaseJWTVerifier
+from utils.lazy import Lazy, timed_import
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine.base import Engine
+    from sqlalchemy.ext.asyncio import AsyncEngine
+    from supabase import Client
+
 # Load env vars
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -15,22 +23,120 @@ logger = logging.getLogger(__name__)
 DATABASE_URL = os.getenv("DATABASE_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL", f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None)
+# local: chỉ xác thực tại chỗ | remote: luôn gọi supabase.auth.get_user | local_then_remote: thử local trước.
+# Mặc định local chỉ khi có SUPABASE_JWT_SECRET: project còn ký HS256 mà thiếu secret thì mọi token sẽ bị 401
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local" if SUPABASE_JWT_SECRET else "local_then_remote").lower()
+if AUTH_VERIFY_MODE == "local" and not SUPABASE_JWT_SECRET:
+    logger.warning("⚠️ AUTH_VERIFY_MODE=local nhưng chưa có SUPABASE_JWT_SECRET: token HS256 sẽ bị từ chối (401)")
+
+MISSING_ENV = [name for name, value in [
+    ("DATABASE_URL", DATABASE_URL), ("SUPABASE_URL", SUPABASE_URL), ("SUPABASE_ANON_KEY", SUPABASE_KEY)] if not value]
+if MISSING_ENV:
+    # Không crash lúc import (health check vẫn trả lời được); lỗi khi client đầu tiên được dựng
+    logger.error(f"❌ Thiếu các biến môi trường cần thiết trong file .env: {', '.join(MISSING_ENV)}")
+
+
+def _require_env() -> None:
+    if MISSING_ENV:
+        raise ValueError(f"❌ Thiếu các biến môi trường cần thiết trong file .env: {', '.join(MISSING_ENV)}")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Cache prepared statement của asyncpg theo từng connection (đặt 0 nếu đi qua pgbouncer transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+
+def to_async_database_url(url: str):
+    """postgres://... (psycopg2) -> postgresql+asyncpg://... ; asyncpg dùng `ssl` thay cho `sslmode`."""
+    from sqlalchemy.engine import make_url
+    db_url = make_url(url.replace("postgres://", "postgresql://", 1))
+    query = dict(db_url.query)
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    query.setdefault("prepared_statement_cache_size", str(DB_STATEMENT_CACHE_SIZE))
+    return db_url.set(drivername="postgresql+asyncpg", query=query)
+
+
+# Database & Supabase Clients: dựng ở lần dùng đầu tiên (hoặc warm-up lúc startup) để cold start nhanh
+def _create_engine() -> "Engine":
+    _require_env()
+    return timed_import("sqlalchemy").create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
+
+
+def _create_async_engine() -> "AsyncEngine":
+    # Engine bất đồng bộ cho các tool của agent (không chặn event loop)
+    _require_env()
+    return timed_import("sqlalchemy.ext.asyncio").create_async_engine(
+        to_async_database_url(DATABASE_URL), pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True, pool_recycle=300)
+
+
+def _create_supabase() -> "Client":
+    _require_env()
+    return timed_import("supabase").create_client(SUPABASE_URL, SUPABASE_KEY)
 
-if not all([DATABASE_URL, SUPABASE_URL, SUPABASE_KEY]):
-    raise ValueError("❌ Thiếu các biến môi trường cần thiết trong file .env")
 
-# Database & Supabase Clients
-engine: Engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+lazy_engine: Lazy["Engine"] = Lazy("db_engine", _create_engine)
+lazy_async_engine: Lazy["AsyncEngine"] = Lazy("db_async_engine", _create_async_engine)
+lazy_supabase: Lazy["Client"] = Lazy("supabase", _create_supabase)
+
+
+def get_engine() -> "Engine":
+    return lazy_engine.get()
+
+
+def get_async_engine() -> "AsyncEngine":
+    return lazy_async_engine.get()
+
+
+def get_supabase() -> "Client":
+    return lazy_supabase.get()
+
+
+def __getattr__(name: str):
+    # Tương thích `from app_dependencies import engine, async_engine, supabase` (dựng ngay khi truy cập)
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    if name == "supabase":
+        return get_supabase()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Auth Dependency
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+jwt_verifier = SupabaseJWTVerifier(
+    jwt_secret=SUPABASE_JWT_SECRET,
+    jwks_url=SUPABASE_JWKS_URL,
+    issuer=f"{SUPABASE_URL}/auth/v1" if SUPABASE_URL else None,
+)
+
+
+def _get_user_id_remote(token: str) -> str:
+    user_response = get_supabase().auth.get_user(token)
+    return str(user_response.user.id)
+
+
 def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
+    with metrics.stage("auth"):
+        return _verify_token(token)
+
+
+def _verify_token(token: str) -> str:
     try:
-        user_response = supabase.auth.get_user(token)
-        user_id = user_response.user.id
-        return str(user_id)
+        if AUTH_VERIFY_MODE == "remote" or not jwt_verifier.enabled:
+            return _get_user_id_remote(token)
+        try:
+            return jwt_verifier.verify(token)
+        except Exception as e:
+            if AUTH_VERIFY_MODE != "local_then_remote":
+                raise
+            logger.warning(f"⚠️ Xác thực JWT tại chỗ thất bại ({e}), thử lại qua Supabase Auth")
+            return _get_user_id_remote(token)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,86 @@
+# File: bench/bench_time_parser.py
+"""
+Kiểm tra độ đúng + microbenchmark bộ phân tích thời gian tiếng Việt (utils.thoi_gian_tu_nhien).
+Corpus: bench/time_corpus.json (ngày gốc cố định, kết quả mong đợi cho từng biểu thức).
+
+    python -m bench.bench_time_parser --rounds 2000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.thoi_gian_tu_nhien import parse_many, parse_natural_time, parser  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "time_corpus.json")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> tuple[datetime, list[dict]]:
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    return datetime.fromisoformat(corpus["base"]), corpus["cases"]
+
+
+def check(base: datetime, cases: list[dict]) -> list[str]:
+    failures = []
+    for case in cases:
+        got = parse_natural_time(case["text"], base)
+        expected = (datetime.fromisoformat(case["start"]), datetime.fromisoformat(case["end"]))
+        if got != expected:
+            failures.append(f"{case['text']!r}: {got[0]:%d/%m/%Y %H:%M} → {got[1]:%d/%m/%Y %H:%M}, "
+                            f"mong đợi {expected[0]:%d/%m/%Y %H:%M} → {expected[1]:%d/%m/%Y %H:%M}")
+    return failures
+
+
+def timed(label: str, func, rounds: int, per_round: int) -> None:
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) / per_round)
+    samples.sort()
+    print(f"{label:>18}: p50={statistics.median(samples) * 1e6:.2f}µs "
+          f"p95={samples[int(0.95 * len(samples)) - 1] * 1e6:.2f}µs /biểu thức")
+
+
+def main(argv=None) -> None:
+    args_parser = argparse.ArgumentParser(description="Benchmark bộ phân tích thời gian tự nhiên")
+    args_parser.add_argument("--corpus", default=CORPUS_PATH)
+    args_parser.add_argument("--rounds", type=int, default=500)
+    args = args_parser.parse_args(argv)
+
+    base, cases = load_corpus(args.corpus)
+    parser.clear()
+    failures = check(base, cases)
+    print(f"Độ đúng: {len(cases) - len(failures)}/{len(cases)} biểu thức")
+    for line in failures:
+        print(f"  ❌ {line}")
+
+    texts = [case["text"] for case in cases]
+
+    def cold():
+        # Xóa cả cache biên dịch lẫn cache kết quả: đo chi phí phân tích ngữ pháp thật
+        for text in texts:
+            parser.clear()
+            parse_natural_time(text, base)
+
+    def warm():
+        for text in texts:
+            parse_natural_time(text, base)
+
+    timed("không cache", cold, args.rounds, len(texts))
+    timed("cache nóng", warm, args.rounds, len(texts))
+    timed("parse_many", lambda: parse_many(texts, base), args.rounds, len(texts))
+    print(f"Cache: {parser.stats()}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
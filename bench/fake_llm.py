@@ -0,0 +1,72 @@
+# File: bench/fake_llm.py
+
+import asyncio
+import re
+import time
+import uuid
+from typing import Any, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# (regex trên PROMPT, tên tool, tham số) - lượt đầu gọi tool, lượt sau (có ToolMessage) trả lời text.
+# Tên tool là list [(tool, tham số), ...] -> nhiều tool call trong cùng một bước (như Gemini khi chào hỏi)
+DEFAULT_SCRIPT = [
+    (r"chào|hello|xin chào", [("lay_ten_nguoi_dung", {}), ("lay_lich_trinh_tuan", {})], {}),
+    (r"tạo|thêm|đặt lịch", "tao_su_kien_toan_dien",
+     {"tieu_de": "Họp benchmark", "loai_su_kien": "task", "bat_dau": "mai"}),
+    (r"dời|đổi giờ", "cap_nhat_su_kien", {"tieu_de_cu": "Họp benchmark", "thoi_gian_moi": "2 ngày sau"}),
+    (r"ghi chú|ghi lại", "tao_ghi_chu_thong_minh", {"noi_dung": "Ghi chú benchmark"}),
+    (r"chi tiết", "xem_chi_tiet_su_kien", {"tu_khoa": "Sự kiện"}),
+    (r"lịch", "lay_lich_trinh_tuan", {}),
+    (r"tổng quan|bao nhiêu", "thong_ke_tong_quan", {}),
+    (r"liệt kê|danh sách", "liet_ke_danh_sach", {"loai": "all"}),
+]
+
+
+class ScriptedToolCallingModel(BaseChatModel):
+    """Chat model giả lập: phát tool call theo kịch bản, độ trễ cố định; thay cho Gemini khi benchmark."""
+
+    script: list = DEFAULT_SCRIPT
+    latency: float = 0.05
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-tool-calling"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedToolCallingModel":
+        return self
+
+    def _respond(self, messages: list[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Xong rồi nhé. {str(last.content)[:300]}")
+
+        content = str(last.content)
+        user_id = re.search(r"USER_ID:\s*(\S+)", content)
+        prompt = re.search(r"PROMPT:\s*(.*)", content, re.S)
+        text = (prompt.group(1) if prompt else content).lower()
+        if user_id:
+            for pattern, tool_name, args in self.script:
+                if re.search(pattern, text):
+                    calls = tool_name if isinstance(tool_name, list) else [(tool_name, args)]
+                    return AIMessage(content="", tool_calls=[{
+                        "name": name, "args": {**call_args, "user_id": user_id.group(1)},
+                        "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call",
+                    } for name, call_args in calls])
+        return AIMessage(content="Mình có thể giúp gì cho lịch trình của bạn?")
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
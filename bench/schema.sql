@@ -0,0 +1,188 @@
+-- File: bench/schema.sql
+-- Schema tối thiểu theo Database.md (v1.5) cho Postgres local dùng khi benchmark.
+-- Không có auth.users: profiles.id là uuid độc lập.
+
+DO $$ BEGIN
+    CREATE TYPE event_type AS ENUM ('task','note','schedule','class','workshift','deadline','custom');
+EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+DO $$ BEGIN
+    CREATE TYPE task_status AS ENUM ('todo', 'in_progress', 'done');
+EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+DO $$ BEGIN
+    CREATE TYPE task_priority AS ENUM ('low', 'medium', 'high');
+EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+DO $$ BEGIN
+    CREATE TYPE schedule_recurring AS ENUM ('none', 'daily', 'weekly', 'monthly');
+EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+DO $$ BEGIN
+    CREATE TYPE reminder_status AS ENUM ('pending', 'sent', 'expired');
+EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+
+CREATE TABLE IF NOT EXISTS public.profiles (
+    id uuid PRIMARY KEY,
+    name varchar,
+    avatar_url text,
+    settings_json jsonb,
+    birth_date date,
+    gender text,
+    email text UNIQUE,
+    updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.events (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    user_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    title varchar NOT NULL,
+    description text,
+    type event_type NOT NULL DEFAULT 'task',
+    start_time timestamptz NULL,
+    end_time timestamptz NULL,
+    recurring schedule_recurring DEFAULT 'none',
+    location text NULL,
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz DEFAULT now(),
+    CONSTRAINT events_time_check CHECK (end_time IS NULL OR end_time > start_time)
+);
+
+-- Lặp đến hết ngày này (NULL = lặp mãi); ngoại lệ từng lần lặp nằm ở event_occurrence_overrides
+ALTER TABLE public.events ADD COLUMN IF NOT EXISTS recurring_until timestamptz NULL;
+
+CREATE TABLE IF NOT EXISTS public.event_occurrence_overrides (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    event_id bigint NOT NULL REFERENCES public.events(id) ON DELETE CASCADE,
+    original_start timestamptz NOT NULL,
+    is_cancelled boolean NOT NULL DEFAULT false,
+    start_time timestamptz NULL,
+    end_time timestamptz NULL,
+    title varchar NULL,
+    created_at timestamptz DEFAULT now(),
+    UNIQUE (event_id, original_start)
+);
+
+CREATE TABLE IF NOT EXISTS public.tasks (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    user_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    event_id bigint NULL REFERENCES public.events(id) ON DELETE CASCADE,
+    title varchar NOT NULL,
+    description text,
+    deadline timestamptz NULL,
+    priority task_priority DEFAULT 'medium',
+    status task_status DEFAULT 'todo',
+    is_completed boolean NOT NULL DEFAULT false,
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.checklist_items (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    task_id bigint NOT NULL REFERENCES public.tasks(id) ON DELETE CASCADE,
+    content text NOT NULL,
+    is_checked boolean DEFAULT false,
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.schedules (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    user_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    event_id bigint NULL REFERENCES public.events(id) ON DELETE CASCADE,
+    task_id bigint NULL REFERENCES public.tasks(id) ON DELETE CASCADE,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz NOT NULL,
+    recurring schedule_recurring DEFAULT 'none',
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz DEFAULT now(),
+    CHECK (end_time > start_time)
+);
+
+-- Cho phép note độc lập (tool tạo ghi chú không gắn event) -> điều kiện <= 1
+CREATE TABLE IF NOT EXISTS public.notes (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    user_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    event_id bigint NULL REFERENCES public.events(id) ON DELETE CASCADE,
+    task_id bigint NULL REFERENCES public.tasks(id) ON DELETE CASCADE,
+    schedule_id bigint NULL REFERENCES public.schedules(id) ON DELETE CASCADE,
+    content text NOT NULL,
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz DEFAULT now(),
+    CONSTRAINT notes_one_parent_check CHECK (
+        (CASE WHEN event_id IS NOT NULL THEN 1 ELSE 0 END) +
+        (CASE WHEN task_id IS NOT NULL THEN 1 ELSE 0 END) +
+        (CASE WHEN schedule_id IS NOT NULL THEN 1 ELSE 0 END) <= 1
+    )
+);
+
+CREATE TABLE IF NOT EXISTS public.reminders (
+    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    user_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    event_id bigint NULL REFERENCES public.events(id) ON DELETE CASCADE,
+    task_id bigint NULL REFERENCES public.tasks(id) ON DELETE CASCADE,
+    remind_time timestamptz NOT NULL,
+    type text DEFAULT 'default',
+    status reminder_status DEFAULT 'pending',
+    created_at timestamptz DEFAULT now()
+);
+
+-- Reminder dispatcher: số lần gửi lỗi và thời điểm được thử lại (chung cho mọi instance)
+ALTER TABLE public.reminders ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;
+ALTER TABLE public.reminders ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz NULL;
+
+CREATE INDEX IF NOT EXISTS idx_events_user_id_start_time ON public.events(user_id, start_time DESC);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_id_status ON public.tasks(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_schedules_user_id_start_time ON public.schedules(user_id, start_time DESC);
+CREATE INDEX IF NOT EXISTS idx_reminders_remind_time_status ON public.reminders(remind_time, status);
+-- Reminder dispatcher: chỉ reminder chưa gửi (bảng lớn dần nhưng index giữ nhỏ), sắp theo thời điểm nhắc
+CREATE INDEX IF NOT EXISTS idx_reminders_pending ON public.reminders(remind_time, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_events_user_recurring ON public.events(user_id) WHERE recurring <> 'none';
+-- Phân trang keyset (start_time, id) / (created_at, id) và export theo thứ tự thời gian
+CREATE INDEX IF NOT EXISTS idx_events_user_start_id ON public.events(user_id, start_time, id);
+CREATE INDEX IF NOT EXISTS idx_notes_user_created_id ON public.notes(user_id, created_at DESC, id DESC);
+-- Khóa ngoại tasks.event_id: JOIN event -> task khi export (và ON DELETE CASCADE)
+CREATE INDEX IF NOT EXISTS idx_tasks_event_id ON public.tasks(event_id);
+
+-- Kiểm tra trùng giờ: GiST trên (user_id, khoảng thời gian) cho toán tử &&
+-- Postgres local không có contrib (btree_gist) thì chỉ index khoảng thời gian
+DO $$ BEGIN
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    CREATE INDEX IF NOT EXISTS idx_events_user_time_range ON public.events
+        USING gist (user_id, tstzrange(start_time, end_time, '[)'))
+        WHERE start_time IS NOT NULL AND end_time IS NOT NULL;
+EXCEPTION WHEN feature_not_supported OR undefined_file THEN
+    CREATE INDEX IF NOT EXISTS idx_events_user_time_range ON public.events
+        USING gist (tstzrange(start_time, end_time, '[)'))
+        WHERE start_time IS NOT NULL AND end_time IS NOT NULL;
+END $$;
+
+-- Tìm kiếm: bỏ dấu tiếng Việt (IMMUTABLE nên dùng được trong cột generated / index biểu thức)
+CREATE OR REPLACE FUNCTION public.vn_unaccent(value text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(translate(value,
+        'àáạảãâầấậẩẫăằắặẳẵÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴèéẹẻẽêềếệểễÈÉẸẺẼÊỀẾỆỂỄìíịỉĩÌÍỊỈĨòóọỏõôồốộổỗơờớợởỡÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠùúụủũưừứựửữÙÚỤỦŨƯỪỨỰỬỮỳýỵỷỹỲÝỴỶỸđĐ',
+        'aaaaaaaaaaaaaaaaaAAAAAAAAAAAAAAAAAeeeeeeeeeeeEEEEEEEEEEEiiiiiIIIIIoooooooooooooooooOOOOOOOOOOOOOOOOOuuuuuuuuuuuUUUUUUUUUUUyyyyyYYYYYdD'))
+$$;
+
+-- Bản không dấu lưu sẵn: so khớp/thưởng điểm không phải translate() từng dòng lúc truy vấn
+ALTER TABLE public.events ADD COLUMN IF NOT EXISTS search_title text GENERATED ALWAYS AS (
+    public.vn_unaccent(title)
+) STORED;
+ALTER TABLE public.notes ADD COLUMN IF NOT EXISTS search_text text GENERATED ALWAYS AS (
+    public.vn_unaccent(content)
+) STORED;
+ALTER TABLE public.events ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', public.vn_unaccent(title)), 'A')
+    || setweight(to_tsvector('simple', public.vn_unaccent(coalesce(description, ''))), 'B')
+) STORED;
+ALTER TABLE public.notes ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('simple', public.vn_unaccent(content))
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_events_search_vector ON public.events USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_notes_search_vector ON public.notes USING gin (search_vector);
+
+-- Tìm gần đúng (gõ sai, thiếu chữ): trigram trên tiêu đề/nội dung đã bỏ dấu; không có pg_trgm thì bỏ qua
+DO $$ BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS idx_events_title_trgm ON public.events USING gin (search_title gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_notes_content_trgm ON public.notes USING gin (search_text gin_trgm_ops);
+EXCEPTION WHEN feature_not_supported OR undefined_file THEN
+    RAISE NOTICE 'pg_trgm không có sẵn: chỉ dùng full-text search';
+END $$;
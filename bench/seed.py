@@ -0,0 +1,63 @@
+# File: bench/seed.py
+
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+EVENT_TYPES = ["task", "schedule", "class", "workshift", "deadline"]
+
+
+def bench_user_ids(count: int) -> list[str]:
+    # uuid xác định để các lần chạy dùng lại cùng dữ liệu
+    return [str(uuid.uuid5(uuid.NAMESPACE_URL, f"skedule-bench-user-{i}")) for i in range(count)]
+
+
+def apply_schema(database_url: str) -> None:
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(open(SCHEMA_PATH, encoding="utf-8").read())
+    engine.dispose()
+
+
+def seed(database_url: str, users: int = 20, events_per_user: int = 200, seed_value: int = 42) -> list[str]:
+    """Tạo user + sự kiện/task/note giả lập. Chạy lại sẽ xóa dữ liệu cũ của các user benchmark."""
+    rng = random.Random(seed_value)
+    user_ids = bench_user_ids(users)
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM profiles WHERE id = ANY(CAST(:ids AS uuid[]))"), {"ids": user_ids})
+        conn.execute(text("INSERT INTO profiles (id, name, email) VALUES (:id, :name, :email)"), [
+            {"id": uid, "name": f"Bench {i}", "email": f"bench{i}@skedule.local"} for i, uid in enumerate(user_ids)
+        ])
+        for uid in user_ids:
+            rows = []
+            for j in range(events_per_user):
+                start = now + timedelta(hours=rng.randint(-24 * 30, 24 * 60))
+                rows.append({
+                    "uid": uid, "title": f"Sự kiện {j}", "type": rng.choice(EVENT_TYPES),
+                    "start": start, "end": start + timedelta(minutes=rng.choice([30, 60, 90, 120])),
+                })
+            conn.execute(text("""
+                INSERT INTO events (user_id, title, type, start_time, end_time)
+                VALUES (:uid, :title, :type, :start, :end)
+            """), rows)
+            conn.execute(text("""
+                INSERT INTO tasks (user_id, event_id, title, deadline, priority, status)
+                SELECT user_id, id, title, end_time, 'medium', 'todo'
+                FROM events WHERE user_id = :uid AND type IN ('task', 'deadline')
+            """), {"uid": uid})
+            conn.execute(text("""
+                INSERT INTO schedules (user_id, event_id, start_time, end_time)
+                SELECT user_id, id, start_time, end_time
+                FROM events WHERE user_id = :uid AND type NOT IN ('task', 'deadline')
+            """), {"uid": uid})
+            conn.execute(text("INSERT INTO notes (user_id, content) VALUES (:uid, :content)"), [
+                {"uid": uid, "content": f"Ghi chú {k}\nNội dung benchmark"} for k in range(max(events_per_user // 10, 1))
+            ])
+    engine.dispose()
+    return user_ids
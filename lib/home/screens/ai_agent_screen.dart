@@ -150,6 +150,8 @@ class _AiAgentScreenState extends State<AiAgentScreen> {
       var request = http.MultipartRequest('POST', Uri.parse('$serverUrl/chat'));
       request.headers['Authorization'] = 'Bearer $accessToken';
       request.headers['ngrok-skip-browser-warning'] = 'true';
+      // Nhận audio qua URL (phát dần, JSON nhỏ); server mặc định vẫn trả audio_base64 cho app bản cũ
+      request.fields['audio'] = 'url';
 
       if (text != null) {
         request.fields['prompt'] = text;
@@ -174,6 +176,7 @@ class _AiAgentScreenState extends State<AiAgentScreen> {
               Provider.of<SettingsProvider>(context, listen: false);
           final String responseText = decodedResponse['text_response'] ??
               settings.strings.translate('error_no_response');
+          final String audioUrl = decodedResponse['audio_url'] ?? '';
           final String audioBase64 = decodedResponse['audio_base64'] ?? '';
 
           if (decodedResponse['user_prompt'] != null && audioFilePath != null) {
@@ -182,7 +185,10 @@ class _AiAgentScreenState extends State<AiAgentScreen> {
 
           _addMessageToChat(responseText, isUser: false);
 
-          if (audioBase64.isNotEmpty) {
+          if (audioUrl.isNotEmpty) {
+            // Audio là tài nguyên riêng: player tải và phát dần, không phải giải mã base64
+            _playAudioUrl('$serverUrl$audioUrl');
+          } else if (audioBase64.isNotEmpty) {
             _playAudio(audioBase64);
           }
         } else {
@@ -235,6 +241,14 @@ class _AiAgentScreenState extends State<AiAgentScreen> {
     }
   }
 
+  Future<void> _playAudioUrl(String url) async {
+    try {
+      await _audioPlayer.play(UrlSource(url));
+    } catch (e) {
+      debugPrint("Lỗi phát audio: $e");
+    }
+  }
+
   Future<void> _playAudio(String base64Audio) async {
     try {
       final audioBytes = base64Decode(base64Audio);
@@ -0,0 +1,84 @@
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from utils.jwt_verifier import SupabaseJWTVerifier
+
+ISSUER = "https://example.supabase.co/auth/v1"
+USER_ID = "89a88dcd-6b42-5ea2-8e5d-9e4799cc70e9"
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _jwks(private_key, kid="k1") -> dict:
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    return {"keys": [{**jwk, "kid": kid, "alg": "RS256", "use": "sig"}]}
+
+
+def _token(private_key, kid="k1", **claims) -> str:
+    payload = {"sub": USER_ID, "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 3600, **claims}
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def _verifier(private_key, **kwargs) -> SupabaseJWTVerifier:
+    verifier = SupabaseJWTVerifier(jwks_url="https://example.supabase.co/auth/v1/.well-known/jwks.json",
+                                   issuer=ISSUER, **kwargs)
+    verifier.set_jwks(_jwks(private_key))
+    return verifier
+
+
+def test_valid_token_returns_sub_and_is_cached(private_key):
+    verifier = _verifier(private_key)
+    token = _token(private_key)
+    assert verifier.verify(token) == USER_ID
+    assert len(verifier._token_cache) == 1
+    assert verifier.verify(token) == USER_ID
+
+
+def test_expired_token_rejected(private_key):
+    verifier = _verifier(private_key, leeway=0)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(_token(private_key, exp=int(time.time()) - 60))
+
+
+def test_wrong_audience_rejected(private_key):
+    verifier = _verifier(private_key)
+    with pytest.raises(jwt.InvalidAudienceError):
+        verifier.verify(_token(private_key, aud="anon"))
+
+
+def test_hs256_without_secret_rejected():
+    verifier = SupabaseJWTVerifier(issuer=ISSUER)
+    token = jwt.encode({"sub": USER_ID, "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 60},
+                       "x" * 32, algorithm="HS256")
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token)
+
+
+def test_unknown_kid_refetches_with_backoff(private_key, monkeypatch):
+    verifier = _verifier(private_key, jwks_min_refetch=60)
+    calls = []
+
+    def failing_refresh():
+        calls.append(time.monotonic())
+        raise OSError("JWKS không truy cập được")
+
+    monkeypatch.setattr(verifier, "refresh_jwks", failing_refresh)
+    token = _token(private_key, kid="rotated")
+    for _ in range(5):
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(token)
+    assert len(calls) == 1
+
+
+def test_unknown_kid_picks_up_rotated_key(private_key):
+    verifier = _verifier(private_key)
+    rotated = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    verifier.refresh_jwks = lambda: verifier.set_jwks(_jwks(rotated, kid="k2"))
+    assert verifier.verify(_token(rotated, kid="k2")) == USER_ID
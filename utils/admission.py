@@ -0,0 +1,148 @@
+# File: utils/admission.py
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+
+class Overloaded(Exception):
+    """Từ chối nhận thêm việc: 429 (user gửi quá nhanh) hoặc 503 (server hết chỗ); kèm số giây nên chờ."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+# --- 1. GIỚI HẠN TỐC ĐỘ THEO USER ---
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Lấy cost token; trả về 0 nếu được, ngược lại số giây đến khi đủ token."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token bucket cho từng user (per_minute token/phút, tối đa burst). Giữ tối đa max_keys bucket (LRU):
+    user lâu không gửi bị bỏ ra cũng không sao vì bucket của họ đã đầy lại.
+    """
+
+    def __init__(self, per_minute: float = 20, burst: float = 5, max_keys: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, key: str, cost: float = 1) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take(min(cost, self.burst), now)
+        if wait > 0:
+            self.limited += 1
+            raise Overloaded("Bạn gửi yêu cầu quá nhanh, thử lại sau ít giây nhé.", status_code=429, retry_after=wait)
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {"users": len(self._buckets), "allowed": self.allowed, "limited": self.limited}
+
+
+# --- 2. GIỚI HẠN ĐỒNG THỜI + HÀNG ĐỢI CÓ HẠN ---
+
+
+class ConcurrencyGate:
+    """
+    Tối đa `limit` việc chạy cùng lúc, tối đa `max_waiting` việc chờ, mỗi việc chờ không quá `timeout` giây.
+    Quá giới hạn -> Overloaded(503) ngay, Retry-After ước lượng từ thời gian giữ slot gần đây.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int = 16, timeout: float = 10.0,
+                 label: Optional[str] = None):
+        self.name = name
+        self.label = label or name  # tên hiển thị trong thông báo lỗi cho user
+        self.limit = max(1, limit)
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(self.limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._avg_hold = 1.0  # EWMA thời gian giữ slot (giây)
+
+    def retry_after(self) -> float:
+        # Số "lượt" phải chờ trước mình nhân thời gian giữ slot trung bình
+        return self._avg_hold * (self.waiting + 1) / self.limit
+
+    def would_reject(self) -> bool:
+        """Kiểm tra trước (không giữ chỗ) để trả 503 trước khi bắt đầu stream response."""
+        return self._slots.locked() and self.waiting >= self.max_waiting
+
+    async def acquire(self) -> None:
+        if not self._slots.locked():
+            await self._slots.acquire()  # còn slot: lấy ngay, không nhường event loop
+        elif self.waiting >= self.max_waiting:
+            self.rejected_full += 1
+            raise Overloaded(f"Hàng đợi {self.label} đang đầy", retry_after=self.retry_after())
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise Overloaded(f"Chờ {self.label} quá lâu", retry_after=self.retry_after())
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+
+    def release(self, held: float) -> None:
+        self.active -= 1
+        self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "admitted": self.admitted,
+                "rejected_full": self.rejected_full, "rejected_timeout": self.rejected_timeout,
+                "avg_hold_seconds": round(self._avg_hold, 3)}
@@ -0,0 +1,198 @@
+# File: utils/audio_store.py
+
+import asyncio
+import logging
+import secrets
+import shutil
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+AUDIO_MIME = {"mp3": "audio/mpeg", "ogg": "audio/ogg", "wav": "audio/wav"}
+# codec -> (định dạng, tham số ffmpeg): giọng nói mono, bitrate thấp
+CODECS = {
+    "opus": ("ogg", ["-ac", "1", "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"]),
+    "mp3-low": ("mp3", ["-ac", "1", "-ar", "22050", "-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3"]),
+}
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Header Range 'bytes=a-b' / 'bytes=a-' / 'bytes=-n' -> (đầu, cuối) tính cả hai đầu; None = cả file.
+    ValueError nếu đoạn không hợp lệ (trả 416)."""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # nhiều đoạn: trả cả file (client vẫn dùng được)
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} ngoài kích thước {size}")
+    return start, end
+
+
+def iter_slices(chunks: list[bytes], start: int, end: int) -> Iterator[memoryview]:
+    """Đoạn [start, end] của các chunk nối liền, không ghép lại thành một bytes mới."""
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start and offset <= end:
+            yield memoryview(chunk)[max(0, start - offset):min(len(chunk), end - offset + 1)]
+        if chunk_end > end:
+            return
+        offset = chunk_end
+
+
+class AudioClip:
+    """Audio của một câu trả lời: các chunk (mỗi câu một chunk) được thêm dần trong lúc tổng hợp."""
+
+    def __init__(self, clip_id: str, audio_format: str, expires_at: float):
+        self.id = clip_id
+        self.format = audio_format
+        self.expires_at = expires_at
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.variants: dict[str, list[bytes]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._changed.set()
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._changed.set()
+
+    async def ready(self) -> None:
+        """Chờ câu đầu tiên (hoặc lỗi) trước khi gửi header, để lỗi TTS vẫn trả đúng mã lỗi."""
+        while not self.chunks and not self.done:
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def wait(self) -> None:
+        while not self.done:
+            self._changed.clear()
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Phát từng chunk ngay khi có, không chờ tổng hợp xong cả câu trả lời."""
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class AudioStore:
+    """
+    Audio câu trả lời giữ theo id ngẫu nhiên (URL không đoán được) trong ttl_seconds, tổng tối đa max_bytes.
+    Chunk là chính các bytes trong AudioCache của TTS -> không nhân bản dữ liệu; hết chỗ thì bỏ clip cũ nhất.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 600, max_items: int = 2000,
+                 ffmpeg: str = "ffmpeg"):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.ffmpeg = ffmpeg
+        self._clips: OrderedDict[str, AudioClip] = OrderedDict()
+        self._bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _drop(self, clip: AudioClip) -> None:
+        self._clips.pop(clip.id, None)
+        self._bytes -= clip.size + sum(len(c) for chunks in clip.variants.values() for c in chunks)
+        if clip.task is not None and not clip.task.done():
+            clip.task.cancel()
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        while self._clips:
+            oldest = next(iter(self._clips.values()))
+            if oldest.expires_at > now:
+                break
+            self._drop(oldest)
+            self.expired += 1
+        while self._clips and (self._bytes > self.max_bytes or len(self._clips) > self.max_items):
+            self._drop(next(iter(self._clips.values())))
+            self.evicted += 1
+
+    def create(self, source: Callable[[], AsyncIterator[bytes]], audio_format: str) -> AudioClip:
+        """Tạo clip và bắt đầu tổng hợp ở nền; trả về ngay để /chat gửi URL cho client."""
+        self._purge()
+        clip = AudioClip(secrets.token_urlsafe(16), audio_format, time.monotonic() + self.ttl_seconds)
+        self._clips[clip.id] = clip
+        clip.task = asyncio.ensure_future(self._fill(clip, source))
+        self.created += 1
+        return clip
+
+    async def _fill(self, clip: AudioClip, source: Callable[[], AsyncIterator[bytes]]) -> None:
+        try:
+            async for chunk in source():
+                clip._append(chunk)
+                if clip.id in self._clips:
+                    self._bytes += len(chunk)
+            clip._finish()
+        except asyncio.CancelledError:
+            clip._finish(RuntimeError("Audio đã bị hủy"))
+            raise
+        except Exception as e:
+            clip._finish(e)
+        self._purge()
+
+    def get(self, clip_id: str) -> Optional[AudioClip]:
+        self._purge()
+        return self._clips.get(clip_id)
+
+    async def encoded(self, clip: AudioClip, codec: Optional[str]) -> tuple[list[bytes], str]:
+        """Các chunk + định dạng theo codec yêu cầu (chuyển mã bằng ffmpeg một lần, giữ cùng clip);
+        không có ffmpeg/codec lạ -> định dạng gốc."""
+        await clip.wait()
+        if not codec or codec not in CODECS:
+            return clip.chunks, clip.format
+        if codec not in clip.variants:
+            if shutil.which(self.ffmpeg) is None:
+                return clip.chunks, clip.format
+            try:
+                data = await self._transcode(b"".join(clip.chunks), CODECS[codec][1])
+            except RuntimeError as e:
+                logger.warning(f"⚠️ Không chuyển mã audio sang {codec}: {e}")
+                return clip.chunks, clip.format
+            clip.variants[codec] = [data]
+            if clip.id in self._clips:
+                self._bytes += len(data)
+        return clip.variants[codec], CODECS[codec][0]
+
+    async def _transcode(self, data: bytes, args: list[str]) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *args, "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        out, err = await proc.communicate(data)
+        if proc.returncode != 0 or not out:
+            raise RuntimeError(err.decode(errors="ignore").strip() or "ffmpeg không trả về dữ liệu")
+        return out
+
+    def stats(self) -> dict:
+        return {"clips": len(self._clips), "bytes": self._bytes, "created": self.created,
+                "expired": self.expired, "evicted": self.evicted}
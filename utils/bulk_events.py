@@ -0,0 +1,344 @@
+# File: utils/bulk_events.py
+
+import csv
+import io
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from typing import Any, Iterable, Iterator, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import text
+
+from utils.recurrence import STEPS
+from utils.thoi_gian_tu_nhien import add_months, parser as time_parser
+
+# Số dòng mỗi câu lệnh INSERT (mọi chunk nằm trong cùng một transaction của người gọi)
+BATCH_CHUNK = int(os.getenv("BATCH_CHUNK", "500"))
+# Giới hạn một lần tạo/import để không khóa bảng quá lâu
+BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", "2000"))
+
+# Khóa phụ trong dict dòng: số dòng trong file gốc / lý do lỗi đã biết khi đọc file
+ROW_KEY, ERROR_KEY = "_row", "_error"
+
+EVENT_TYPES = ("task", "note", "schedule", "class", "workshift", "deadline", "custom")
+TYPE_ALIASES = {
+    "lớp": "class", "lớp học": "class", "môn": "class", "học": "class",
+    "ca": "workshift", "ca làm": "workshift", "làm thêm": "workshift",
+    "việc": "task", "công việc": "task", "hạn": "deadline", "hạn chót": "deadline", "lịch": "schedule", "ghi chú": "note",
+}
+PRIORITY_ALIASES = {"cao": "high", "trung bình": "medium", "trung binh": "medium", "thấp": "low", "thap": "low",
+                    "high": "high", "medium": "medium", "low": "low"}
+RECURRING_ALIASES = {"": "none", "none": "none", "không": "none", "daily": "daily", "hằng ngày": "daily",
+                     "weekly": "weekly", "hằng tuần": "weekly", "monthly": "monthly", "hằng tháng": "monthly"}
+
+# Tên cột CSV (tiếng Việt hoặc tiếng Anh) -> trường của EventInput
+COLUMN_ALIASES = {
+    "tieu_de": "title", "tiêu đề": "title", "title": "title", "summary": "title", "môn": "title", "mon": "title",
+    "loai": "type", "loại": "type", "loai_su_kien": "type", "type": "type",
+    "ngay": "date", "ngày": "date", "date": "date",
+    "bat_dau": "start", "bắt đầu": "start", "start": "start", "giờ bắt đầu": "start",
+    "ket_thuc": "end", "kết thúc": "end", "end": "end", "giờ kết thúc": "end",
+    "mo_ta": "description", "mô tả": "description", "description": "description",
+    "uu_tien": "priority", "ưu tiên": "priority", "priority": "priority",
+    "lap_lai": "recurring", "lặp lại": "recurring", "recurring": "recurring",
+    "lap_den": "until", "lặp đến": "until", "until": "until",
+    "dia_diem": "location", "địa điểm": "location", "phòng": "location", "location": "location",
+}
+
+
+@dataclass
+class EventInput:
+    """Một dòng đã kiểm tra, sẵn sàng để INSERT."""
+    title: str
+    type: str = "schedule"
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    description: Optional[str] = None
+    priority: str = "medium"
+    recurring: str = "none"
+    recurring_until: Optional[datetime] = None
+    location: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    events: int = 0
+    tasks: int = 0
+    schedules: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)   # (số dòng, lý do)
+
+    def add(self, other: "BatchResult") -> None:
+        self.events += other.events
+        self.tasks += other.tasks
+        self.schedules += other.schedules
+        self.errors.extend(other.errors)
+
+    def summary(self, limit: int = 5) -> str:
+        lines = [f"✅ Đã tạo {self.events} sự kiện ({self.tasks} task, {self.schedules} lịch)."]
+        if self.errors:
+            lines.append(f"⚠️ Bỏ qua {len(self.errors)} dòng lỗi:")
+            lines.extend(f"- Dòng {row}: {reason}" for row, reason in self.errors[:limit])
+            if len(self.errors) > limit:
+                lines.append(f"- ... và {len(self.errors) - limit} dòng khác")
+        return "\n".join(lines)
+
+    def as_dict(self) -> dict:
+        return {"events": self.events, "tasks": self.tasks, "schedules": self.schedules,
+                "errors": [{"row": row, "reason": reason} for row, reason in self.errors]}
+
+
+# --- CHUẨN HÓA DỮ LIỆU ĐẦU VÀO ---
+
+
+def _clean(value: Any) -> str:
+    return str(value).strip() if value is not None else ""
+
+
+def _parse_time(value: str, base: datetime) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = time_parser.parse(value, base)
+    return parsed[0] if parsed else None
+
+
+def _is_iso_date(value: str) -> bool:
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def to_event_input(raw: dict, base: datetime, default_type: str = "schedule") -> EventInput:
+    """
+    Chuẩn hóa một dòng (dict từ tool/API/CSV) -> EventInput; ValueError nếu dòng không hợp lệ.
+    Thời gian nhận cả ISO lẫn tiếng Việt tự nhiên ("thứ 2 7h", "07/09/2026 13:30"); cột `date` riêng thì ghép với giờ.
+    """
+    row = {COLUMN_ALIASES.get(key.strip().lower(), key.strip().lower()): _clean(value)
+           for key, value in raw.items() if key}
+    title = row.get("title")
+    if not title:
+        raise ValueError("thiếu tiêu đề")
+
+    event_type = row.get("type", "").lower() or default_type
+    event_type = TYPE_ALIASES.get(event_type, event_type)
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"loại '{event_type}' không hợp lệ")
+
+    day = row.get("date", "")
+    start_text, end_text = row.get("start", ""), row.get("end", "")
+    when = f"{day} {start_text}".strip()
+    start = _parse_time(when, base)
+    if when and start is None:
+        raise ValueError(f"không hiểu thời gian bắt đầu '{when}'")
+    end = _parse_time(f"{day} {end_text}".strip() if end_text else "", start or base)
+    if end_text and end is None:
+        raise ValueError(f"không hiểu thời gian kết thúc '{end_text}'")
+    if start and end and end <= start:
+        raise ValueError("giờ kết thúc phải sau giờ bắt đầu")
+
+    recurring = RECURRING_ALIASES.get(row.get("recurring", "").lower())
+    if recurring is None:
+        raise ValueError(f"kiểu lặp '{row['recurring']}' không hợp lệ")
+    # Ngày lặp cuối không ghi giờ (kể cả ISO '2026-12-20') -> tính hết ngày đó
+    until_text = row.get("until", "")
+    until = _parse_time(until_text, base.replace(hour=23, minute=59, second=59, microsecond=0))
+    if until and _is_iso_date(until_text):
+        until = until.replace(hour=23, minute=59, second=59, microsecond=0)
+    if recurring != "none" and start is None:
+        raise ValueError("sự kiện lặp cần thời gian bắt đầu")
+
+    return EventInput(
+        title=title[:255], type=event_type, start=start, end=end,
+        description=row.get("description") or None,
+        priority=PRIORITY_ALIASES.get(row.get("priority", "").lower(), "medium"),
+        recurring=recurring, recurring_until=until, location=row.get("location") or None,
+    )
+
+
+def build_inputs(rows: Iterable[dict], base: datetime, default_type: str = "schedule",
+                 first_row: int = 1) -> tuple[list[EventInput], list[tuple[int, str]]]:
+    inputs, errors = [], []
+    for number, raw in enumerate(rows, start=first_row):
+        number = raw.get(ROW_KEY, number)
+        if ERROR_KEY in raw:
+            errors.append((number, raw[ERROR_KEY]))
+            continue
+        try:
+            inputs.append(to_event_input(raw, base, default_type))
+        except ValueError as e:
+            errors.append((number, str(e)))
+    return inputs, errors
+
+
+# --- GHI VÀO DB ---
+
+# Cấp id trước bằng nextval để task/schedule tham chiếu đúng event của từng dòng, rồi
+# events + tasks + schedules trong MỘT câu lệnh (unnest các mảng tham số = multi-row insert).
+_INSERT_BATCH = """
+WITH input AS (
+    SELECT nextval(pg_get_serial_sequence('public.events', 'id')) AS id, i.*
+    FROM unnest(CAST(:titles AS text[]), CAST(:types AS event_type[]), CAST(:starts AS timestamptz[]),
+                CAST(:ends AS timestamptz[]), CAST(:descriptions AS text[]), CAST(:priorities AS task_priority[]),
+                CAST(:recurrings AS schedule_recurring[]), CAST(:untils AS timestamptz[]), CAST(:locations AS text[]))
+         AS i(title, type, start_time, end_time, description, priority, recurring, recurring_until, location)
+), new_events AS (
+    INSERT INTO events (id, user_id, title, description, type, start_time, end_time, recurring, recurring_until, location)
+    OVERRIDING SYSTEM VALUE
+    SELECT id, :uid, title, description, type, start_time, end_time, recurring, recurring_until, location FROM input
+    RETURNING id
+), new_tasks AS (
+    INSERT INTO tasks (user_id, event_id, title, description, deadline, priority, status)
+    SELECT :uid, id, title, description, coalesce(end_time, start_time), priority, 'todo'
+    FROM input WHERE type IN ('task', 'deadline')
+    RETURNING id
+), new_schedules AS (
+    INSERT INTO schedules (user_id, event_id, start_time, end_time, recurring)
+    SELECT :uid, id, start_time, coalesce(end_time, start_time + INTERVAL '1 hour'), recurring
+    FROM input WHERE start_time IS NOT NULL AND type <> 'deadline'
+    RETURNING id
+)
+SELECT (SELECT COUNT(*) FROM new_events) AS events,
+       (SELECT COUNT(*) FROM new_tasks) AS tasks,
+       (SELECT COUNT(*) FROM new_schedules) AS schedules
+"""
+
+
+async def insert_events(conn, user_id: str, inputs: list[EventInput]) -> BatchResult:
+    """Ghi cả loạt trong transaction của `conn`: mỗi BATCH_CHUNK dòng là một câu lệnh."""
+    result = BatchResult()
+    for offset in range(0, len(inputs), BATCH_CHUNK):
+        chunk = inputs[offset:offset + BATCH_CHUNK]
+        row = (await conn.execute(text(_INSERT_BATCH), {
+            "uid": user_id,
+            "titles": [e.title for e in chunk], "types": [e.type for e in chunk],
+            "starts": [e.start for e in chunk], "ends": [e.end for e in chunk],
+            "descriptions": [e.description for e in chunk], "priorities": [e.priority for e in chunk],
+            "recurrings": [e.recurring for e in chunk], "untils": [e.recurring_until for e in chunk],
+            "locations": [e.location for e in chunk],
+        })).fetchone()
+        result.add(BatchResult(events=row.events, tasks=row.tasks, schedules=row.schedules))
+    return result
+
+
+# --- ĐỌC FILE (CSV / ICS) THEO DÒNG ---
+
+
+def iter_csv_rows(stream: io.TextIOBase) -> Iterator[dict]:
+    """Đọc dần từng dòng CSV (dấu phân cách , hoặc ; tự nhận theo dòng tiêu đề)."""
+    header = stream.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    columns = next(csv.reader([header], delimiter=delimiter), [])
+    yield from csv.DictReader(stream, fieldnames=[c.strip() for c in columns], delimiter=delimiter)
+
+
+_ICS_ESCAPES = re.compile(r"\\([\\;,nN])")
+_ICS_FREQ = {"DAILY": "daily", "WEEKLY": "weekly", "MONTHLY": "monthly"}
+_ICS_DAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+# INTERVAL > 1 không biểu diễn được bằng cột recurring -> trải thành từng sự kiện, tối đa chừng này lần
+ICS_MAX_EXPANDED = 366
+
+
+def _ics_unescape(value: str) -> str:
+    return _ICS_ESCAPES.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ics_datetime(value: str, params: dict, default_tz: tzinfo) -> datetime:
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.combine(date(int(value[:4]), int(value[4:6]), int(value[6:8])), datetime.min.time(), default_tz)
+    parsed = datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return parsed.replace(tzinfo=timezone.utc)
+    try:
+        return parsed.replace(tzinfo=ZoneInfo(params["TZID"]) if "TZID" in params else default_tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        return parsed.replace(tzinfo=default_tz)
+
+
+def _ics_lines(stream: io.TextIOBase) -> Iterator[tuple[int, str]]:
+    """(số dòng bắt đầu, dòng logic): gộp các dòng bị gập (dòng sau bắt đầu bằng khoảng trắng) theo RFC 5545."""
+    current, current_number = None, 0
+    for number, line in enumerate(stream, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current_number, current
+        current, current_number = line, number
+    if current:
+        yield current_number, current
+
+
+def _ics_rows(props: dict, default_tz: tzinfo) -> list[dict]:
+    """Một VEVENT -> một hoặc nhiều dòng EventInput dạng dict (BYDAY nhiều ngày tách thành nhiều chuỗi lặp)."""
+    (start_value, start_params) = props["DTSTART"]
+    start = _ics_datetime(start_value, start_params, default_tz)
+    end = _ics_datetime(*props["DTEND"], default_tz) if "DTEND" in props else None
+    base = {"title": _ics_unescape(props.get("SUMMARY", ("",))[0]),
+            "description": _ics_unescape(props.get("DESCRIPTION", ("",))[0]),
+            "location": _ics_unescape(props.get("LOCATION", ("",))[0])}
+    rule = dict(part.split("=", 1) for part in props.get("RRULE", ("",))[0].split(";") if "=" in part)
+    recurring = _ICS_FREQ.get(rule.get("FREQ", ""), "none")
+    interval, count = int(rule.get("INTERVAL", "1")), int(rule.get("COUNT", "0"))
+    until = _ics_datetime(rule["UNTIL"], {}, start.tzinfo) if "UNTIL" in rule else None
+    if until and len(rule["UNTIL"]) == 8:
+        # UNTIL dạng ngày (RFC 5545) tính cả ngày đó, theo múi giờ của sự kiện
+        until = datetime.combine(until.date(), time(23, 59, 59), start.tzinfo)
+
+    starts = [start]
+    if recurring == "weekly" and "BYDAY" in rule:
+        days = sorted({_ICS_DAYS[d[-2:]] for d in rule["BYDAY"].split(",") if d[-2:] in _ICS_DAYS})
+        starts = [start + timedelta(days=(day - start.weekday()) % 7) for day in days] or [start]
+    rows = []
+    for first in starts:
+        duration = (end - start) if end else None
+        if recurring != "none" and count:
+            # COUNT -> ngày kết thúc chuỗi (xấp xỉ khi có nhiều BYDAY: mỗi chuỗi giữ đủ số tuần)
+            weeks = -(-count // len(starts))
+            last_index = (weeks if recurring == "weekly" else count) - 1
+            until = first + STEPS[recurring] * last_index * interval if recurring in STEPS \
+                else add_months(first, last_index * interval)
+        if recurring != "none" and interval > 1:
+            # Không có cột interval: trải thành từng lần riêng
+            limit = until or first + STEPS.get(recurring, timedelta(days=31)) * interval * ICS_MAX_EXPANDED
+            index, current = 0, first
+            while current <= limit and index < ICS_MAX_EXPANDED:
+                rows.append({**base, "start": current.isoformat(),
+                             "end": (current + duration).isoformat() if duration else ""})
+                index += 1
+                current = first + STEPS[recurring] * index * interval if recurring in STEPS \
+                    else add_months(first, index * interval)
+            continue
+        rows.append({**base, "start": first.isoformat(), "end": (first + duration).isoformat() if duration else "",
+                     "recurring": recurring, "until": until.isoformat() if until and recurring != "none" else ""})
+    return rows
+
+
+def iter_ics_rows(stream: io.TextIOBase, default_tz: tzinfo = timezone.utc) -> Iterator[dict]:
+    """
+    Đọc dần các VEVENT của file .ics (SUMMARY, DTSTART/DTEND, DESCRIPTION, LOCATION, RRULE).
+    Mỗi dòng mang số dòng BEGIN:VEVENT trong file; VEVENT hỏng -> một dòng lỗi, các VEVENT khác vẫn được đọc.
+    """
+    props: Optional[dict] = None
+    begin = 0
+    for number, line in _ics_lines(stream):
+        if line == "BEGIN:VEVENT":
+            props, begin = {}, number
+        elif line == "END:VEVENT" and props is not None:
+            if "DTSTART" not in props:
+                yield {ROW_KEY: begin, "title": _ics_unescape(props.get("SUMMARY", ("",))[0])}
+            else:
+                try:
+                    rows = _ics_rows(props, default_tz)
+                except (ValueError, KeyError, IndexError) as e:
+                    rows = [{ERROR_KEY: f"VEVENT không hợp lệ ({e})"}]
+                for row in rows:
+                    yield {ROW_KEY: begin, **row}
+            props = None
+        elif props is not None and ":" in line:
+            name_part, value = line.split(":", 1)
+            name, *params = name_part.split(";")
+            props[name.upper()] = (value, dict(p.split("=", 1) for p in params if "=" in p))
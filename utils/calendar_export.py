@@ -0,0 +1,253 @@
+# File: utils/calendar_export.py
+
+import base64
+import binascii
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import text
+
+from utils.bulk_events import EVENT_TYPES, TYPE_ALIASES
+from utils.recurrence import EVENT_COLUMNS, OVERRIDES_JSON, parse_overrides, to_datetime
+
+# Số dòng mỗi lần lấy từ server-side cursor khi export (bộ nhớ không phụ thuộc số sự kiện của user)
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "500"))
+PAGE_MAX = 100
+
+# Mốc đầu/cuối cho con trỏ keyset: một câu lệnh cố định cho mọi trang (không ghép chuỗi theo tham số)
+_BIGINT_MAX = 2 ** 63 - 1
+_NEG_INF = datetime.min.replace(tzinfo=timezone.utc)
+_POS_INF = datetime.max.replace(tzinfo=timezone.utc)
+
+
+def normalize_type(loai: Optional[str]) -> Optional[str]:
+    """'all'/'tất cả'/None -> None (không lọc); tên tiếng Việt -> event_type. ValueError nếu không hợp lệ."""
+    value = (loai or "all").strip().lower()
+    if value in ("all", "tất cả", "tat ca"):
+        return None
+    value = TYPE_ALIASES.get(value, value)
+    if value not in EVENT_TYPES:
+        raise ValueError(f"Loại '{loai}' không hợp lệ (dùng: {', '.join(EVENT_TYPES)}).")
+    return value
+
+
+# --- CON TRỎ KEYSET ---
+
+def encode_cursor(at: Optional[datetime], row_id: int) -> str:
+    raw = json.dumps([at.isoformat() if at else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[Optional[datetime], int]:
+    """Ngược lại encode_cursor; ValueError nếu con trỏ hỏng."""
+    try:
+        at, row_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return (datetime.fromisoformat(at) if at else None), int(row_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Con trỏ phân trang không hợp lệ.") from e
+
+
+@dataclass
+class Page:
+    items: list = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+# Sự kiện: start_time ASC NULLS LAST, id. Hai nhánh UNION ALL đều đi theo idx_events_user_start_id (mỗi nhánh tối đa
+# :limit dòng); UNION ALL không đảm bảo thứ tự nên vẫn sắp lại ở ngoài (sort trên <= 2*:limit dòng).
+_EVENTS_PAGE = """
+    (SELECT {columns}, e.description, e.location FROM events e
+     WHERE e.user_id = :uid AND e.start_time IS NOT NULL {type_filter}
+       AND (e.start_time, e.id) > (CAST(:after_time AS timestamptz), CAST(:after_id AS bigint))
+     ORDER BY e.start_time, e.id LIMIT :limit)
+    UNION ALL
+    (SELECT {columns}, e.description, e.location FROM events e
+     WHERE e.user_id = :uid AND e.start_time IS NULL {type_filter} AND e.id > CAST(:after_null_id AS bigint)
+     ORDER BY e.id LIMIT :limit)
+    ORDER BY start_time NULLS LAST, id
+    LIMIT :limit
+"""
+_TYPE_FILTER = "AND e.type = CAST(:type AS event_type)"
+EVENTS_PAGE_SQL = {
+    False: text(_EVENTS_PAGE.format(columns=EVENT_COLUMNS, type_filter="")),
+    True: text(_EVENTS_PAGE.format(columns=EVENT_COLUMNS, type_filter=_TYPE_FILTER)),
+}
+
+# Ghi chú: mới nhất trước (created_at DESC NULLS LAST, id DESC), theo idx_notes_user_created_id; sắp lại ở ngoài như trên
+NOTES_PAGE_SQL = text("""
+    (SELECT n.id, n.content, n.created_at FROM notes n
+     WHERE n.user_id = :uid AND n.created_at IS NOT NULL
+       AND (n.created_at, n.id) < (CAST(:after_time AS timestamptz), CAST(:after_id AS bigint))
+     ORDER BY n.created_at DESC, n.id DESC LIMIT :limit)
+    UNION ALL
+    (SELECT n.id, n.content, n.created_at FROM notes n
+     WHERE n.user_id = :uid AND n.created_at IS NULL AND n.id < CAST(:after_null_id AS bigint)
+     ORDER BY n.id DESC LIMIT :limit)
+    ORDER BY created_at DESC NULLS LAST, id DESC
+    LIMIT :limit
+""")
+
+
+def _keyset_params(cursor: Optional[str], ascending: bool) -> dict:
+    if not cursor:
+        return {"after_time": _NEG_INF if ascending else _POS_INF, "after_id": 0 if ascending else _BIGINT_MAX,
+                "after_null_id": 0 if ascending else _BIGINT_MAX}
+    at, row_id = decode_cursor(cursor)
+    if at is None:
+        # Đã sang vùng không có giờ: nhánh có giờ không còn dòng nào
+        return {"after_time": _POS_INF if ascending else _NEG_INF, "after_id": row_id, "after_null_id": row_id}
+    return {"after_time": at, "after_id": row_id, "after_null_id": 0 if ascending else _BIGINT_MAX}
+
+
+def _page(rows: list, limit: int, time_attr: str) -> Page:
+    # Lấy dư một dòng để biết còn trang sau hay không
+    if len(rows) <= limit:
+        return Page(items=rows)
+    last = rows[limit - 1]
+    return Page(items=rows[:limit], next_cursor=encode_cursor(getattr(last, time_attr), last.id))
+
+
+async def list_events_page(conn, user_id: str, event_type: Optional[str] = None, limit: int = 20,
+                           cursor: Optional[str] = None) -> Page:
+    limit = max(1, min(limit, PAGE_MAX))
+    rows = (await conn.execute(EVENTS_PAGE_SQL[event_type is not None], {
+        "uid": user_id, "type": event_type, "limit": limit + 1, **_keyset_params(cursor, ascending=True),
+    })).fetchall()
+    return _page(rows, limit, "start_time")
+
+
+async def list_notes_page(conn, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Page:
+    limit = max(1, min(limit, PAGE_MAX))
+    rows = (await conn.execute(NOTES_PAGE_SQL, {
+        "uid": user_id, "limit": limit + 1, **_keyset_params(cursor, ascending=False),
+    })).fetchall()
+    return _page(rows, limit, "created_at")
+
+
+# --- EXPORT ---
+
+_EXPORT_SQL = """
+    SELECT e.id, e.title, e.description, e.type, e.start_time, e.end_time, e.recurring, e.recurring_until,
+           e.location, t.priority, t.status, {overrides} AS overrides
+    FROM events e
+    LEFT JOIN LATERAL (SELECT priority, status FROM tasks WHERE tasks.event_id = e.id LIMIT 1) t ON true
+    WHERE e.user_id = :uid {type_filter}
+    ORDER BY e.start_time NULLS LAST, e.id
+"""
+EXPORT_SQL = {
+    False: text(_EXPORT_SQL.format(overrides=OVERRIDES_JSON, type_filter="")),
+    True: text(_EXPORT_SQL.format(overrides=OVERRIDES_JSON, type_filter=_TYPE_FILTER)),
+}
+EXPORT_FORMATS = {"ics": "text/calendar; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+_ICS_FREQ = {"daily": "DAILY", "weekly": "WEEKLY", "monthly": "MONTHLY"}
+_ICS_PRIORITY = {"high": 1, "medium": 5, "low": 9}
+
+
+def _iso(value) -> Optional[str]:
+    value = to_datetime(value)
+    return value.isoformat() if value else None
+
+
+def _ics_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _ics_escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _ics_fold(line: str) -> str:
+    """Gập dòng dài hơn 75 byte (RFC 5545), không cắt giữa một ký tự UTF-8."""
+    if len(line.encode()) <= 75:
+        return line + "\r\n"
+    parts, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_event(row, stamp: str) -> str:
+    """Một event -> VEVENT (lần hủy thành EXDATE, lần dời giờ thành VEVENT có RECURRENCE-ID), không giờ -> VTODO."""
+    uid = f"{row.id}@skedule"
+    lines = []
+    common = [f"CATEGORIES:{row.type}"]
+    if row.description:
+        common.append(f"DESCRIPTION:{_ics_escape(row.description)}")
+    if row.location:
+        common.append(f"LOCATION:{_ics_escape(row.location)}")
+    if row.priority in _ICS_PRIORITY:
+        common.append(f"PRIORITY:{_ICS_PRIORITY[row.priority]}")
+    start, end = to_datetime(row.start_time), to_datetime(row.end_time)
+
+    if start is None:
+        lines += ["BEGIN:VTODO", f"UID:{uid}", f"DTSTAMP:{stamp}", f"SUMMARY:{_ics_escape(row.title)}", *common]
+        if row.status == "done":
+            lines.append("STATUS:COMPLETED")
+        lines.append("END:VTODO")
+        return "".join(_ics_fold(line) for line in lines)
+
+    lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{stamp}", f"DTSTART:{_ics_time(start)}"]
+    if end:
+        lines.append(f"DTEND:{_ics_time(end)}")
+    lines += [f"SUMMARY:{_ics_escape(row.title)}", *common]
+    overrides = parse_overrides(row.overrides) if row.recurring in _ICS_FREQ else []
+    if row.recurring in _ICS_FREQ:
+        rule = f"RRULE:FREQ={_ICS_FREQ[row.recurring]}"
+        if row.recurring_until:
+            rule += f";UNTIL={_ics_time(to_datetime(row.recurring_until))}"
+        lines.append(rule)
+        lines += [f"EXDATE:{_ics_time(o.original_start)}" for o in overrides if o.cancelled]
+    lines.append("END:VEVENT")
+
+    for override in overrides:
+        if override.cancelled or override.start is None:
+            continue
+        moved_end = override.end or (override.start + (end - start) if end else None)
+        lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{stamp}",
+                  f"RECURRENCE-ID:{_ics_time(override.original_start)}", f"DTSTART:{_ics_time(override.start)}"]
+        if moved_end:
+            lines.append(f"DTEND:{_ics_time(moved_end)}")
+        lines += [f"SUMMARY:{_ics_escape(override.title or row.title)}", "END:VEVENT"]
+    return "".join(_ics_fold(line) for line in lines)
+
+
+def ndjson_event(row) -> str:
+    overrides = row.overrides
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    return json.dumps({
+        "id": row.id, "title": row.title, "description": row.description, "type": row.type,
+        "start_time": _iso(row.start_time), "end_time": _iso(row.end_time),
+        "recurring": row.recurring, "recurring_until": _iso(row.recurring_until), "location": row.location,
+        "priority": row.priority, "status": row.status, "overrides": overrides or [],
+    }, ensure_ascii=False) + "\n"
+
+
+async def iter_export(conn, user_id: str, fmt: str = "ics", event_type: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Stream toàn bộ lịch của user dạng ICS hoặc NDJSON qua server-side cursor (yield_per=EXPORT_CHUNK):
+    mỗi lần chỉ giữ một chunk dòng trong bộ nhớ, gửi đi ngay.
+    """
+    stamp = _ics_time(datetime.now(timezone.utc))
+    if fmt == "ics":
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Skedule//Calendar Export//VI\r\nCALSCALE:GREGORIAN\r\n"
+    result = await conn.stream(EXPORT_SQL[event_type is not None], {"uid": user_id, "type": event_type},
+                               execution_options={"yield_per": EXPORT_CHUNK})
+    async for rows in result.partitions(EXPORT_CHUNK):
+        if fmt == "ics":
+            yield "".join(ics_event(row, stamp) for row in rows)
+        else:
+            yield "".join(ndjson_event(row) for row in rows)
+    if fmt == "ics":
+        yield "END:VCALENDAR\r\n"
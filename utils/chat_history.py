@@ -0,0 +1,178 @@
+# File: utils/chat_history.py
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, String, Table, Text,
+                        delete, distinct, func, insert, select)
+from sqlalchemy.engine.base import Engine
+
+
+def _message_bytes(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    return len(content.encode("utf-8"))
+
+
+# --- 1. BỘ NHỚ TRONG PROCESS (LRU + TTL) ---
+
+
+class BoundedChatMessageHistory(BaseChatMessageHistory):
+    """Lịch sử chat trong RAM, chỉ giữ `max_messages` tin nhắn gần nhất."""
+
+    def __init__(self, max_messages: int = 40):
+        self.max_messages = max_messages
+        self.messages: list[BaseMessage] = []
+        self.last_access = time.monotonic()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.messages.extend(messages)
+        if self.max_messages and len(self.messages) > self.max_messages:
+            del self.messages[:len(self.messages) - self.max_messages]
+        self.last_access = time.monotonic()
+
+    def clear(self) -> None:
+        self.messages = []
+
+
+class InMemoryHistoryStore:
+    """Thay cho dict `store` toàn cục: giới hạn số session (LRU) và hết hạn theo TTL."""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: int = 3600, max_messages: int = 40):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._sessions: OrderedDict[str, BoundedChatMessageHistory] = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._sessions:
+            session_id, history = next(iter(self._sessions.items()))
+            expired = self.ttl_seconds and now - history.last_access > self.ttl_seconds
+            if not expired and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+    def get_history(self, session_id: str) -> BaseChatMessageHistory:
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = BoundedChatMessageHistory(self.max_messages)
+                self._sessions[session_id] = history
+            history.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return history
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._evict()
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(h.messages) for h in self._sessions.values()),
+                "bytes": sum(_message_bytes(m) for h in self._sessions.values() for m in h.messages),
+                "evictions": self.evictions,
+            }
+
+
+# --- 2. LƯU BỀN (POSTGRES / SQLITE) - DÙNG CHUNG GIỮA NHIỀU WORKER ---
+
+metadata = MetaData()
+
+chat_messages = Table(
+    "agent_chat_messages", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("session_id", String(128), nullable=False),
+    Column("message", Text, nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False,
+           default=lambda: datetime.now(timezone.utc)),
+    Index("idx_agent_chat_messages_session_id", "session_id", "id"),
+)
+
+
+class SQLChatHistory(BaseChatMessageHistory):
+    """Lịch sử của một session, đọc/ghi trực tiếp trên bảng `agent_chat_messages`."""
+
+    def __init__(self, engine: Engine, session_id: str, max_messages: int = 40,
+                 ttl_seconds: Optional[int] = None):
+        self.engine = engine
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        query = select(chat_messages.c.message).where(chat_messages.c.session_id == self.session_id)
+        if self.ttl_seconds:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+            query = query.where(chat_messages.c.created_at >= cutoff)
+        query = query.order_by(chat_messages.c.id.desc()).limit(self.max_messages)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        return messages_from_dict([json.loads(row.message) for row in reversed(rows)])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(insert(chat_messages), [
+                {"session_id": self.session_id, "message": json.dumps(message_to_dict(m), ensure_ascii=False)}
+                for m in messages
+            ])
+            # Cắt bớt tin cũ vượt quá giới hạn của session
+            keep_from = select(chat_messages.c.id).where(
+                chat_messages.c.session_id == self.session_id
+            ).order_by(chat_messages.c.id.desc()).offset(self.max_messages).limit(1).scalar_subquery()
+            conn.execute(delete(chat_messages).where(
+                chat_messages.c.session_id == self.session_id,
+                chat_messages.c.id <= keep_from,
+            ))
+            if self.ttl_seconds:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+                conn.execute(delete(chat_messages).where(
+                    chat_messages.c.session_id == self.session_id,
+                    chat_messages.c.created_at < cutoff,
+                ))
+
+    def clear(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(chat_messages).where(chat_messages.c.session_id == self.session_id))
+
+
+class SQLHistoryStore:
+    def __init__(self, engine: Engine, max_messages: int = 40, ttl_seconds: Optional[int] = None):
+        self.engine = engine
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        metadata.create_all(engine, tables=[chat_messages])
+
+    def get_history(self, session_id: str) -> BaseChatMessageHistory:
+        return SQLChatHistory(self.engine, session_id, self.max_messages, self.ttl_seconds)
+
+    def stats(self) -> dict:
+        with self.engine.connect() as conn:
+            row = conn.execute(select(
+                func.count(distinct(chat_messages.c.session_id)).label("sessions"),
+                func.count().label("messages"),
+                func.coalesce(func.sum(func.length(chat_messages.c.message)), 0).label("bytes"),
+            )).fetchone()
+        return {"backend": "sql", "sessions": row.sessions, "messages": row.messages, "bytes": int(row.bytes)}
+
+
+def create_history_store(backend: str = "memory", engine: Optional[Engine] = None,
+                         max_sessions: int = 1000, ttl_seconds: int = 3600, max_messages: int = 40):
+    """backend: 'memory' (mặc định, 1 worker) hoặc 'sql' (Postgres/SQLite, chia sẻ giữa các worker)."""
+    if backend == "sql":
+        if engine is None:
+            raise ValueError("Backend 'sql' cần một SQLAlchemy engine")
+        return SQLHistoryStore(engine, max_messages=max_messages, ttl_seconds=ttl_seconds)
+    return InMemoryHistoryStore(max_sessions=max_sessions, ttl_seconds=ttl_seconds, max_messages=max_messages)
@@ -0,0 +1,121 @@
+# File: utils/conflicts.py
+
+import json
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+
+from utils.recurrence import expand_all, parse_events_json, recurring_events_json, to_datetime
+
+# Loại sự kiện không chiếm khoảng thời gian (deadline là một mốc, note không có giờ)
+NON_BLOCKING_TYPES = ("deadline", "note")
+# Sự kiện chỉ có start_time được coi là kéo dài chừng này khi xét trùng giờ
+DEFAULT_DURATION = timedelta(hours=1)
+
+# CTE `conflicts`: sự kiện của :uid giao với [:new_start, :new_end).
+# - Có end_time: toán tử && trên tstzrange, dùng GiST index idx_events_user_time_range.
+# - Không có end_time: lọc theo start_time trên idx_events_user_id_start_time.
+# - Event lặp (recurring <> 'none') không xét ở đây mà mở rộng trong Python (xem conflict_columns).
+# :check_conflict = false thì CTE rỗng (vd: tạo deadline); `exclude` loại chính sự kiện đang dời.
+_CONFLICT_CTE = """
+conflicts AS (
+    SELECT id, title, type, start_time, end_time FROM events
+    WHERE user_id = :uid AND CAST(:check_conflict AS boolean)
+      AND type NOT IN ('deadline', 'note') AND (recurring IS NULL OR recurring = 'none') {exclude}
+      AND start_time IS NOT NULL AND end_time IS NOT NULL
+      AND tstzrange(start_time, end_time, '[)')
+          && tstzrange(CAST(:new_start AS timestamptz), CAST(:new_end AS timestamptz), '[)')
+    UNION ALL
+    SELECT id, title, type, start_time, end_time FROM events
+    WHERE user_id = :uid AND CAST(:check_conflict AS boolean)
+      AND type NOT IN ('deadline', 'note') AND (recurring IS NULL OR recurring = 'none') {exclude}
+      AND start_time IS NOT NULL AND end_time IS NULL
+      AND start_time > CAST(:new_start AS timestamptz) - INTERVAL '1 hour'
+      AND start_time < CAST(:new_end AS timestamptz)
+)"""
+
+CONFLICTS_JSON = """(
+    SELECT json_agg(json_build_object('id', id, 'title', title, 'type', type,
+                                      'start_time', start_time, 'end_time', end_time) ORDER BY start_time)
+    FROM conflicts
+)"""
+
+
+def conflict_cte(exclude: str = "") -> str:
+    """Đoạn CTE để ghép vào câu lệnh ghi (1 round trip); `exclude` là điều kiện SQL thêm, vd 'AND id <> ...'."""
+    return _CONFLICT_CTE.format(exclude=exclude)
+
+
+def conflict_columns(exclude: str = "") -> str:
+    """Các cột cần SELECT cùng conflict_cte: sự kiện trùng trực tiếp + các event lặp ứng viên (JSON)."""
+    recurring = recurring_events_json(
+        "new_start", "new_end", f"AND CAST(:check_conflict AS boolean) AND e.type NOT IN ('deadline', 'note') {exclude}")
+    return f"{CONFLICTS_JSON} AS conflicts, {recurring} AS recurring_conflicts"
+
+
+def conflict_params(start: Optional[datetime], end: Optional[datetime], event_type: str) -> dict:
+    return {
+        "check_conflict": bool(start) and event_type not in NON_BLOCKING_TYPES,
+        "new_start": start,
+        "new_end": end or (start + DEFAULT_DURATION if start else None),
+    }
+
+
+def parse_conflicts(value) -> list[dict]:
+    if not value:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _aware(value: datetime) -> datetime:
+    # asyncpg coi datetime naive gửi vào timestamptz là UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def collect_conflicts(row, params: dict, tz: tzinfo = timezone.utc) -> list[dict]:
+    """Gộp sự kiện trùng trực tiếp với các lần lặp (đã mở rộng theo múi giờ tz) rơi vào khung giờ mới."""
+    conflicts = parse_conflicts(row.conflicts)
+    candidates = parse_events_json(row.recurring_conflicts)
+    if not candidates or not params["check_conflict"]:
+        return conflicts
+    start, end = _aware(params["new_start"]), _aware(params["new_end"])
+    # Lần lặp không có giờ kết thúc được coi là dài DEFAULT_DURATION như sự kiện thường
+    for event in candidates:
+        if not event.get("end_time"):
+            event = {**event, "end_time": (to_datetime(event["start_time"]) + DEFAULT_DURATION).isoformat()}
+        for occ in expand_all([event], start, end, tz):
+            conflicts.append({"id": occ.event_id, "title": occ.title, "type": occ.type,
+                              "start_time": occ.start, "end_time": occ.end})
+    return sorted(conflicts, key=lambda item: to_datetime(item["start_time"]))
+
+
+async def find_conflicts(conn, user_id: str, start: datetime, end: Optional[datetime] = None,
+                         event_type: str = "task", exclude_ids: Sequence[int] = (),
+                         tz: tzinfo = timezone.utc) -> list[dict]:
+    """Truy vấn độc lập: các sự kiện chiếm giờ trong [start, end) (công cụ xếp lịch / benchmark)."""
+    exclude = "AND id <> ALL(CAST(:exclude_ids AS bigint[]))" if exclude_ids else ""
+    params = conflict_params(start, end, event_type)
+    row = (await conn.execute(text(f"WITH {conflict_cte(exclude)} SELECT {conflict_columns(exclude)}"), {
+        "uid": user_id, "exclude_ids": list(exclude_ids), **params,
+    })).fetchone()
+    return collect_conflicts(row, params, tz)
+
+
+def _fmt_time(value, tz: Optional[tzinfo] = None) -> str:
+    if not value:
+        return "?"
+    value = to_datetime(value)
+    return (value.astimezone(tz) if tz else value).strftime("%d/%m %H:%M")
+
+
+def format_conflicts(conflicts: list[dict], limit: int = 5, tz: Optional[tzinfo] = None) -> str:
+    if not conflicts:
+        return ""
+    lines = [f"⚠️ TRÙNG GIỜ với {len(conflicts)} sự kiện:"]
+    for item in conflicts[:limit]:
+        end = f" → {_fmt_time(item.get('end_time'), tz)}" if item.get("end_time") else ""
+        lines.append(f"- [{item['type']}] {item['title']} ({_fmt_time(item['start_time'], tz)}{end})")
+    if len(conflicts) > limit:
+        lines.append(f"- ... và {len(conflicts) - limit} sự kiện khác")
+    return "\n".join(lines)
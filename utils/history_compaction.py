@@ -0,0 +1,160 @@
+# File: utils/history_compaction.py
+
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "TÓM TẮT HỘI THOẠI TRƯỚC ĐÓ:\n"
+SUMMARY_INSTRUCTION = (
+    "Cập nhật bản tóm tắt hội thoại giữa người dùng và trợ lý lịch trình Skedule. "
+    "Giữ lại tên, sự kiện, thời gian, quyết định và yêu cầu còn dang dở; bỏ câu xã giao. "
+    "Viết ngắn gọn bằng tiếng Việt, tối đa {max_words} từ.\n\n"
+    "Tóm tắt hiện tại:\n{summary}\n\nĐoạn hội thoại mới:\n{transcript}"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô (tiếng Việt ~3 ký tự/token), đủ để giữ prompt dưới ngân sách
+    return len(text) // 3 + 1
+
+
+def _message_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def _message_hash(message: BaseMessage) -> str:
+    return hashlib.sha1(f"{message.type}:{_message_text(message)}".encode("utf-8")).hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Nén `chat_history` trước khi đưa vào prompt:
+    - Giữ nguyên văn `keep_turns` lượt gần nhất.
+    - Các lượt cũ hơn được gộp vào một bản tóm tắt cuộn (cache theo session), cập nhật ở background.
+    - Tổng số token (ước lượng) của lịch sử không vượt quá `max_tokens`.
+    """
+
+    def __init__(self, llm: BaseChatModel, keep_turns: int = 6, max_tokens: int = 3000,
+                 summarize_every: int = 6, cache_size: int = 1000, summary_max_words: int = 200):
+        self.llm = llm
+        self.keep_turns = keep_turns
+        self.max_tokens = max_tokens
+        self.summarize_every = summarize_every
+        self.cache_size = cache_size
+        self.summary_max_words = summary_max_words
+        # session_id -> (summary, hash của tin nhắn cuối cùng đã gộp)
+        self._summaries: OrderedDict[str, tuple[str, Optional[str]]] = OrderedDict()
+        self._pending: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    # --- CACHE ---
+
+    def _get_summary(self, session_id: str) -> tuple[str, Optional[str]]:
+        with self._lock:
+            entry = self._summaries.get(session_id)
+            if entry is None:
+                return "", None
+            self._summaries.move_to_end(session_id)
+            return entry
+
+    def _set_summary(self, session_id: str, summary: str, last_hash: Optional[str]) -> None:
+        with self._lock:
+            self._summaries[session_id] = (summary, last_hash)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+
+    @staticmethod
+    def _unfolded(older: list[BaseMessage], last_hash: Optional[str]) -> list[BaseMessage]:
+        """Các tin cũ chưa được gộp vào tóm tắt (tin đã gộp có thể đã bị store cắt mất)."""
+        if last_hash is None:
+            return older
+        for i in range(len(older) - 1, -1, -1):
+            if _message_hash(older[i]) == last_hash:
+                return older[i + 1:]
+        return older
+
+    # --- NÉN ---
+
+    def _split(self, messages: list[BaseMessage], summary: str) -> tuple[list[BaseMessage], list[BaseMessage]]:
+        keep = self.keep_turns * 2
+        older, recent = messages[:-keep] if keep else messages, messages[-keep:] if keep else []
+        budget = self.max_tokens - estimate_tokens(summary)
+        while len(recent) > 1 and sum(estimate_tokens(_message_text(m)) for m in recent) > budget:
+            older, recent = older + recent[:1], recent[1:]
+        return older, recent
+
+    def build(self, messages: list[BaseMessage], session_id: str) -> tuple[list[BaseMessage], list[BaseMessage], bool]:
+        """Trả về (lịch sử đã nén cho prompt, các tin cũ còn chờ gộp, tất cả tin chờ có nằm trong prompt không)."""
+        summary, last_hash = self._get_summary(session_id)
+        older, recent = self._split(messages, summary)
+        pending = self._unfolded(older, last_hash)
+
+        # Tin chờ gộp vẫn được giữ nguyên văn nếu còn ngân sách
+        budget = self.max_tokens - estimate_tokens(summary) - sum(estimate_tokens(_message_text(m)) for m in recent)
+        carried = []
+        for message in reversed(pending):
+            cost = estimate_tokens(_message_text(message))
+            if cost > budget:
+                break
+            carried.insert(0, message)
+            budget -= cost
+
+        compacted = carried + recent
+        if summary:
+            compacted = [SystemMessage(content=SUMMARY_PREFIX + summary)] + compacted
+        return compacted, pending, len(carried) == len(pending)
+
+    async def _summarize(self, session_id: str, pending: list[BaseMessage]) -> None:
+        try:
+            summary, _ = self._get_summary(session_id)
+            transcript = "\n".join(f"{m.type}: {_message_text(m)}" for m in pending)
+            prompt = SUMMARY_INSTRUCTION.format(
+                max_words=self.summary_max_words, summary=summary or "(trống)", transcript=transcript)
+            result = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            self._set_summary(session_id, _message_text(result).strip(), _message_hash(pending[-1]))
+        except Exception as e:
+            logger.warning(f"⚠️ Không tóm tắt được lịch sử {session_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def _schedule_summary(self, session_id: str, pending: list[BaseMessage], carried_all: bool) -> None:
+        if not pending or (carried_all and len(pending) < self.summarize_every):
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        # Tóm tắt chạy nền, không làm chậm request hiện tại; context riêng để không
+        # dính callback/stream của run hiện tại
+        task = asyncio.get_running_loop().create_task(
+            self._summarize(session_id, list(pending)), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def acompact(self, inputs: dict, config: RunnableConfig) -> dict:
+        session_id = config.get("configurable", {}).get("session_id", "default")
+        messages = list(inputs.get("chat_history") or [])
+        compacted, pending, carried_all = self.build(messages, session_id)
+        self._schedule_summary(session_id, pending, carried_all)
+        return {**inputs, "chat_history": compacted}
+
+    def compact(self, inputs: dict, config: RunnableConfig) -> dict:
+        session_id = config.get("configurable", {}).get("session_id", "default")
+        compacted, _, _ = self.build(list(inputs.get("chat_history") or []), session_id)
+        return {**inputs, "chat_history": compacted}
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.compact, afunc=self.acompact, name="HistoryCompactor")
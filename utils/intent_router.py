@@ -0,0 +1,173 @@
+# File: utils/intent_router.py
+
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def bo_dau(text: str) -> str:
+    """Bỏ dấu tiếng Việt theo từng ký tự (giữ nguyên độ dài chuỗi để map lại vị trí)."""
+    out = []
+    for ch in text:
+        if ch in "đĐ":
+            out.append("d")
+        else:
+            out.append(unicodedata.normalize("NFD", ch)[0])
+    return "".join(out)
+
+
+def chuan_hoa(text: str) -> str:
+    text = unicodedata.normalize("NFC", text)
+    text = re.sub(r"[?!.,;:\"']+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# Các cụm lịch sự ở đầu/cuối câu không ảnh hưởng tới ý định
+_PREFIX = r"(?:(?:cho|giup|hay|vui long|lam on|xem|mo|hien thi|hien)(?: (?:toi|minh|em|tui))? )*"
+_SUFFIX = r"(?: (?:nhe|nha|di|voi|a|giup (?:toi|minh|em)|cua (?:toi|minh|em)|duoc khong))*"
+
+_LOAI_DANH_SACH = {
+    "ghi chu": "note", "note": "note",
+    "cong viec": "task", "viec": "task", "task": "task", "nhiem vu": "task",
+    "deadline": "deadline", "han": "deadline", "han chot": "deadline",
+    "lich": "schedule", "lich hoc": "schedule", "su kien": "all", "tat ca": "all",
+}
+
+
+# Từ chung chung, không phải tên một sự kiện cụ thể ("xóa lịch", "hủy công việc")
+_TIEU_DE_CHUNG = {
+    "lich", "lich hoc", "lich trinh", "su kien", "cong viec", "viec", "task", "deadline", "han", "buoi",
+    "nhiem vu", "cai nay", "cai do", "cai kia", "no", "hom nay", "ngay mai", "tuan nay",
+}
+
+
+@dataclass
+class Intent:
+    name: str
+    tool: str
+    pattern: re.Pattern
+    build_args: Callable[[re.Match, str], Optional[dict]]
+    template: Callable[[str], str] = field(default=lambda out: out)
+
+
+def _intent(name: str, tool: str, body: str, build_args, template=None) -> Intent:
+    pattern = re.compile(rf"{_PREFIX}{body}{_SUFFIX}")
+    return Intent(name, tool, pattern, build_args, template or (lambda out: out))
+
+
+def _args_xoa(match: re.Match, original: str) -> Optional[dict]:
+    start, end = match.span("tieu_de")
+    tieu_de = original[start:end].strip()
+    khong_dau = match.group("tieu_de")
+    # Xóa hàng loạt / nhiều mục trong một câu -> để agent hỏi lại cho chắc
+    if len(tieu_de) < 2 or khong_dau.startswith("ghi chu") or khong_dau.strip() in _TIEU_DE_CHUNG or \
+            re.search(r"\b(tat ca|het|moi|toan bo|va|voi)\b", khong_dau):
+        return None
+    return {"tieu_de": tieu_de}
+
+
+def _args_liet_ke(match: re.Match, original: str) -> Optional[dict]:
+    args = {"loai": _LOAI_DANH_SACH[match.group("loai")]}
+    if match.group("so"):
+        args["gioi_han"] = min(int(match.group("so")), 50)
+    return args
+
+
+def _template_lich_tuan(output: str) -> str:
+    return output.replace("Dữ liệu lịch trình:", "📅 Lịch trình 7 ngày tới của bạn:", 1)
+
+
+INTENTS = [
+    _intent(
+        "lich_tuan", "lay_lich_trinh_tuan",
+        r"(?:lich|lich trinh|thoi khoa bieu|su kien)(?: cua (?:toi|minh|em))?"
+        r" (?:tuan nay|trong tuan|7 ngay toi|bay ngay toi)(?: co gi)?",
+        lambda m, o: {}, _template_lich_tuan),
+    _intent(
+        "tong_quan", "thong_ke_tong_quan",
+        r"(?:tong quan|bao cao(?: tien do)?|thong ke|(?:toi|minh|em) co bao nhieu viec)",
+        lambda m, o: {}),
+    _intent(
+        "liet_ke", "liet_ke_danh_sach",
+        r"(?:liet ke|danh sach|xem)(?: (?:tat ca|cac|nhung))?(?: (?P<so>\d{1,2}))?"
+        r" (?P<loai>ghi chu|note|cong viec|viec|task|nhiem vu|deadline|han chot|han|lich hoc|lich|su kien|tat ca)",
+        _args_liet_ke),
+    _intent(
+        "khung_gio_trong", "tim_khung_gio_trong",
+        r"(?:(?:toi|minh|em) )?(?:con )?(?:co )?(?:khung gio trong|gio trong|gio ranh|luc nao ranh|khi nao ranh)"
+        r"(?: (?:tuan nay|trong tuan|7 ngay toi|bay ngay toi))?(?: nao| khong)?",
+        lambda m, o: {}),
+    _intent(
+        "xoa_su_kien", "xoa_su_kien_toan_tap",
+        r"(?:xoa|huy) (?:(?:su kien|lich|cong viec|task|deadline|buoi) )?(?P<tieu_de>.+?)",
+        _args_xoa),
+]
+
+
+class IntentRouter:
+    """
+    Bộ định tuyến dựa trên luật đặt trước agent: câu lệnh đơn giản, rõ nghĩa được map thẳng
+    vào tool (không gọi LLM); mọi trường hợp mơ hồ trả về None để agent xử lý.
+    guards[tool](args, user_id): kiểm tra thêm trước khi gọi tool (vd: xóa chỉ khi khớp đúng một mục), False -> agent.
+    """
+
+    def __init__(self, tools: dict, intents: Optional[list[Intent]] = None, callbacks: Optional[list] = None,
+                 guards: Optional[dict[str, Callable[[dict, str], Awaitable[bool]]]] = None):
+        self.tools = tools
+        self.intents = intents if intents is not None else INTENTS
+        self.callbacks = callbacks
+        self.guards = guards or {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits: Counter = Counter()
+        self.guarded: Counter = Counter()
+
+    def match(self, text: str) -> Optional[tuple[Intent, dict]]:
+        original = chuan_hoa(text)
+        normalized = bo_dau(original.lower())
+        for intent in self.intents:
+            m = intent.pattern.fullmatch(normalized)
+            if not m:
+                continue
+            args = intent.build_args(m, original)
+            if args is not None and intent.tool in self.tools:
+                return intent, args
+        return None
+
+    async def aroute(self, text: str, user_id: str) -> Optional[str]:
+        """Trả về câu trả lời nếu xử lý được bằng fast-path, ngược lại None."""
+        routed = self.match(text)
+        if routed and routed[0].tool in self.guards and not await self.guards[routed[0].tool](routed[1], user_id):
+            with self._lock:
+                self.requests += 1
+                self.guarded[routed[0].name] += 1
+            return None
+        with self._lock:
+            self.requests += 1
+            if routed:
+                self.hits[routed[0].name] += 1
+        if not routed:
+            return None
+
+        intent, args = routed
+        logger.info(f"⚡ Fast-path '{intent.name}' -> {intent.tool}({args})")
+        output = await self.tools[intent.tool].ainvoke(
+            {**args, "user_id": user_id}, config={"callbacks": self.callbacks})
+        return intent.template(str(output))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total_hits = sum(self.hits.values())
+            return {
+                "requests": self.requests,
+                "hits": total_hits,
+                "hit_rate": round(total_hits / self.requests, 4) if self.requests else 0.0,
+                "by_intent": dict(self.hits),
+                "guarded": dict(self.guarded),
+            }
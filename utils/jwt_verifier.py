@@ -0,0 +1,180 @@
+# File: utils/jwt_verifier.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+# Supabase ký access token bằng HS256 (JWT secret của project) hoặc
+# bằng khóa bất đối xứng công bố tại /auth/v1/.well-known/jwks.json
+ASYMMETRIC_ALGS = ["RS256", "ES256", "EdDSA"]
+SYMMETRIC_ALGS = ["HS256"]
+
+
+class SupabaseJWTVerifier:
+    """
+    Xác thực access token của Supabase ngay trong process (không gọi mạng).
+    - Khóa JWKS được cache và làm mới định kỳ ở background; kid lạ chỉ kích hoạt nạp đồng bộ tối đa mỗi
+      jwks_min_refetch giây, nạp lỗi thì giãn dần (tới jwks_ttl) thay vì gọi lại ở mọi request.
+    - Token đã xác thực được nhớ theo sha256(token) cho tới khi hết hạn.
+    """
+
+    def __init__(self, jwt_secret: Optional[str] = None, jwks_url: Optional[str] = None,
+                 audience: Optional[str] = "authenticated", issuer: Optional[str] = None,
+                 cache_size: int = 2048, jwks_ttl: int = 600, leeway: int = 10, jwks_min_refetch: float = 5):
+        self.jwt_secret = jwt_secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.issuer = issuer
+        self.cache_size = cache_size
+        self.jwks_ttl = jwks_ttl
+        self.leeway = leeway
+        self.jwks_min_refetch = jwks_min_refetch
+
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._keys_fetched_at = 0.0
+        self._keys_lock = threading.Lock()
+        self._next_fetch_at = 0.0
+        self._fetch_failures = 0
+        self._token_cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.jwt_secret or self.jwks_url)
+
+    # --- JWKS ---
+
+    def set_jwks(self, jwks: dict) -> None:
+        """Nạp bộ khóa JWKS (dạng dict) - dùng khi refresh hoặc khi test với khóa tự tạo."""
+        keys = {}
+        for jwk in jwt.PyJWKSet.from_dict(jwks).keys:
+            keys[jwk.key_id or ""] = jwk
+        with self._keys_lock:
+            self._keys = keys
+            self._keys_fetched_at = time.monotonic()
+
+    def refresh_jwks(self) -> None:
+        if not self.jwks_url:
+            return
+        with urllib.request.urlopen(self.jwks_url, timeout=5) as resp:
+            self.set_jwks(json.loads(resp.read().decode("utf-8")))
+        logger.info(f"🔑 Đã làm mới JWKS ({len(self._keys)} khóa)")
+
+    async def _refresh_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.refresh_jwks)
+            except Exception as e:
+                logger.warning(f"⚠️ Không làm mới được JWKS: {e}")
+            await asyncio.sleep(self.jwks_ttl)
+
+    def start_background_refresh(self) -> None:
+        """Gọi trong startup hook của FastAPI (cần event loop đang chạy)."""
+        if self.jwks_url and self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop_background_refresh(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def _claim_fetch(self) -> bool:
+        """Chỉ một request được nạp đồng bộ trong mỗi khoảng chờ (jwks_min_refetch, hoặc backoff khi đang lỗi)."""
+        now = time.monotonic()
+        with self._keys_lock:
+            if now < self._next_fetch_at:
+                return False
+            self._next_fetch_at = now + self.jwks_min_refetch
+            return True
+
+    def _fetch_on_demand(self) -> None:
+        try:
+            self.refresh_jwks()
+        except Exception as e:
+            with self._keys_lock:
+                self._fetch_failures += 1
+                delay = min(self.jwks_ttl, self.jwks_min_refetch * 2 ** self._fetch_failures)
+                self._next_fetch_at = time.monotonic() + delay
+            logger.warning(f"⚠️ Không nạp được JWKS ({e}), thử lại sau {delay:.0f}s")
+            return
+        with self._keys_lock:
+            self._fetch_failures = 0
+
+    def _get_signing_key(self, kid: str):
+        with self._keys_lock:
+            jwk = self._keys.get(kid)
+        if jwk is None and self.jwks_url and self._claim_fetch():
+            # Khóa mới (rotate) hoặc chưa nạp lần nào: nạp đồng bộ (có giới hạn tần suất)
+            self._fetch_on_demand()
+            with self._keys_lock:
+                jwk = self._keys.get(kid)
+        if jwk is None:
+            raise jwt.InvalidTokenError(f"Không tìm thấy khóa ký kid={kid!r}")
+        return jwk.key
+
+    # --- TOKEN CACHE ---
+
+    def _cache_get(self, digest: str) -> Optional[str]:
+        with self._cache_lock:
+            hit = self._token_cache.get(digest)
+            if hit is None:
+                return None
+            user_id, exp = hit
+            if exp <= time.time():
+                del self._token_cache[digest]
+                return None
+            self._token_cache.move_to_end(digest)
+            return user_id
+
+    def _cache_put(self, digest: str, user_id: str, exp: float) -> None:
+        with self._cache_lock:
+            self._token_cache[digest] = (user_id, exp)
+            self._token_cache.move_to_end(digest)
+            while len(self._token_cache) > self.cache_size:
+                self._token_cache.popitem(last=False)
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._token_cache.clear()
+
+    # --- VERIFY ---
+
+    def decode(self, token: str) -> dict:
+        header = jwt.get_unverified_header(token)
+        alg = header.get("alg")
+        if alg in SYMMETRIC_ALGS:
+            if not self.jwt_secret:
+                raise jwt.InvalidTokenError("Chưa cấu hình SUPABASE_JWT_SECRET")
+            key = self.jwt_secret
+        elif alg in ASYMMETRIC_ALGS:
+            key = self._get_signing_key(header.get("kid", ""))
+        else:
+            raise jwt.InvalidAlgorithmError(f"Thuật toán không hỗ trợ: {alg}")
+
+        options = {"require": ["exp", "sub"], "verify_aud": self.audience is not None}
+        return jwt.decode(token, key, algorithms=[alg], audience=self.audience,
+                          issuer=self.issuer, leeway=self.leeway, options=options)
+
+    def verify(self, token: str) -> str:
+        """Trả về user_id (claim `sub`); ném jwt.InvalidTokenError nếu token không hợp lệ."""
+        digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        user_id = self._cache_get(digest)
+        if user_id:
+            return user_id
+
+        claims = self.decode(token)
+        user_id = str(claims["sub"])
+        self._cache_put(digest, user_id, float(claims["exp"]))
+        return user_id
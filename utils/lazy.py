@@ -0,0 +1,83 @@
+# File: utils/lazy.py
+
+import asyncio
+import importlib
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Chi phí import (giây) của các module nặng được nạp qua timed_import, theo thứ tự nạp
+import_costs: dict[str, float] = {}
+# Thời gian dựng các đối tượng nặng (LLM, agent, engine DB, Supabase client...)
+init_costs: dict[str, float] = {}
+_process_start = time.perf_counter()
+
+
+def timed_import(name: str) -> Any:
+    """importlib.import_module + ghi lại thời gian nếu module chưa được nạp trước đó."""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_costs[name] = time.perf_counter() - start
+    return module
+
+
+class Lazy(Generic[T]):
+    """Dựng giá trị ở lần dùng đầu tiên (thread-safe); lỗi khi dựng không bị cache, lần sau thử lại."""
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self.factory = factory
+        self._value: Optional[T] = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> T:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                self._value = self.factory()
+                init_costs[self.name] = time.perf_counter() - start
+                self._ready = True
+                logger.info(f"⚙️ Đã khởi tạo {self.name} ({init_costs[self.name] * 1000:.0f} ms)")
+        return self._value
+
+    async def aget(self) -> T:
+        """Như get() nhưng dựng trong thread để không chặn event loop."""
+        if self._ready:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def set(self, value: T) -> None:
+        with self._lock:
+            self._value = value
+            self._ready = True
+
+    def peek(self) -> Optional[T]:
+        return self._value if self._ready else None
+
+
+def startup_report(limit: int = 20) -> dict:
+    """Báo cáo chi phí khởi động: import từng module nặng + dựng từng client, sắp theo thời gian giảm dần."""
+    to_ms = lambda costs: [
+        {"name": name, "ms": round(seconds * 1000, 1)}
+        for name, seconds in sorted(costs.items(), key=lambda item: item[1], reverse=True)[:limit]
+    ]
+    return {
+        "uptime_s": round(time.perf_counter() - _process_start, 1),
+        "imports": to_ms(import_costs),
+        "inits": to_ms(init_costs),
+    }
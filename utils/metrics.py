@@ -0,0 +1,208 @@
+# File: utils/metrics.py
+
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Thời gian từng stage của request hiện tại (middleware tạo dict, các stage cộng dồn vào)
+request_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cố định) + reservoir các mẫu gần nhất để tính percentile."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, reservoir: int = 2048):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque = deque(maxlen=reservoir)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _label_str(labels: tuple) -> str:
+    return ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in labels)
+
+
+class _StageTimer:
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: dict):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None, **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "skedule"):
+        self.prefix = prefix
+        self._histograms: dict[tuple, Histogram] = {}
+        self._counters: dict[tuple, float] = {}
+        self._collectors: dict[str, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+
+    # --- GHI NHẬN ---
+
+    def observe(self, stage: str, seconds: float, error: bool = False, **labels) -> None:
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+        if error:
+            self.inc("stage_errors_total", stage=stage, **labels)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def stage(self, stage: str, **labels) -> _StageTimer:
+        """Dùng được với cả `with` và `async with`."""
+        return _StageTimer(self, stage, labels)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, name: str, collect: Callable[[], dict]) -> None:
+        """Đăng ký hàm trả về dict số liệu (vd: history_store.stats) để xuất thành gauge."""
+        self._collectors[name] = collect
+
+    # --- XUẤT ---
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f"{stage}{'{' + _label_str(labels) + '}' if labels else ''}": {
+                    "count": h.count, "sum": round(h.sum, 6),
+                    **{f"p{int(q * 100)}": round(h.percentile(q), 6) for q in QUANTILES},
+                }
+                for (stage, labels), h in sorted(self._histograms.items())
+            }
+
+    def render_prometheus(self) -> str:
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            recent = []
+            for (stage, labels), h in histograms:
+                base = (("stage", stage),) + labels
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{{{_label_str(base + (('le', bound),))}}} {cumulative}")
+                lines.append(f"{name}_sum{{{_label_str(base)}}} {h.sum:.6f}")
+                lines.append(f"{name}_count{{{_label_str(base)}}} {h.count}")
+                for q in QUANTILES:
+                    recent.append(f"{name}_recent{{{_label_str(base + (('quantile', q),))}}} {h.percentile(q):.6f}")
+        lines.append(f"# TYPE {name}_recent gauge")
+        lines.extend(recent)
+
+        # Một dòng TYPE cho mỗi tên counter (lặp lại thì Prometheus bỏ cả lần scrape); counters đã sắp theo tên
+        typed = None
+        for (counter, labels), value in counters:
+            metric = f"{self.prefix}_{counter}"
+            if metric != typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed = metric
+            lines.append(f"{metric}{{{_label_str(labels)}}} {value}" if labels else f"{metric} {value}")
+
+        for collector_name, collect in list(self._collectors.items()):
+            try:
+                stats = collect()
+            except Exception as e:
+                logger.warning(f"⚠️ Collector {collector_name} lỗi: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"{self.prefix}_{collector_name}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def server_timing_header(timings: dict) -> str:
+    return ", ".join(f"{stage.replace(' ', '_')};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Đo thời gian từng lần gọi LLM và từng tool trong agent (truyền qua config["callbacks"])."""
+
+    run_inline = True
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._starts: dict[UUID, tuple[str, dict, float]] = {}
+
+    def _start(self, run_id: UUID, stage: str, **labels) -> None:
+        self._starts[run_id] = (stage, labels, time.perf_counter())
+
+    def _end(self, run_id: UUID, error: bool = False) -> None:
+        started = self._starts.pop(run_id, None)
+        if started:
+            stage, labels, start = started
+            self.registry.observe(stage, time.perf_counter() - start, error=error, **labels)
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized: dict, prompts: list, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=True)
+
+    def on_tool_start(self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "tool", tool=(serialized or {}).get("name") or kwargs.get("name", "unknown"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=True)
+
+
+metrics = MetricsRegistry()
+metrics_callback = MetricsCallbackHandler(metrics)
@@ -0,0 +1,209 @@
+# File: utils/recurrence.py
+
+import calendar
+import json
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Any, Iterable, Iterator, Optional
+
+from sqlalchemy import text
+
+STEPS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+REPEAT_LABEL = {"daily": "hằng ngày", "weekly": "hằng tuần", "monthly": "hằng tháng"}
+
+
+def to_datetime(value) -> Optional[datetime]:
+    # json_build_object trả timestamptz dạng chuỗi ISO
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+@dataclass(frozen=True)
+class Override:
+    """Ngoại lệ cho một lần lặp (khóa theo giờ bắt đầu gốc): hủy, hoặc dời giờ / đổi tên."""
+    original_start: datetime
+    cancelled: bool = False
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    title: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Occurrence:
+    event_id: int
+    title: str
+    type: str
+    start: datetime
+    end: Optional[datetime]
+    recurring: str = "none"
+    moved: bool = False
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    # Ngày 31 ở tháng ít ngày hơn -> ngày cuối tháng
+    month = dt.month - 1 + months
+    year = dt.year + month // 12
+    month = month % 12 + 1
+    return dt.replace(year=year, month=month, day=min(dt.day, calendar.monthrange(year, month)[1]))
+
+
+def _overlaps(start: datetime, end: Optional[datetime], window_start: datetime, window_end: datetime) -> bool:
+    if start >= window_end:
+        return False
+    return end > window_start if end and end > start else start >= window_start
+
+
+def iter_starts(first_start: datetime, recurring: str, window_start: datetime, window_end: datetime,
+                duration: timedelta = timedelta(0), until: Optional[datetime] = None) -> Iterator[datetime]:
+    """
+    Các mốc bắt đầu có giao với [window_start, window_end), theo thứ tự.
+    Nhảy thẳng tới lần lặp đầu tiên gần cửa sổ nên chi phí = O(số lần lặp trong cửa sổ).
+    Cộng theo giờ địa phương của first_start (lớp học 7h sáng vẫn là 7h sau khi đổi giờ mùa hè).
+    """
+    if recurring in STEPS:
+        step = STEPS[recurring]
+        index = max(0, math.floor((window_start - duration - first_start) / step))
+        advance = lambda k: first_start + k * step
+    elif recurring == "monthly":
+        months = (window_start.year - first_start.year) * 12 + window_start.month - first_start.month
+        # Lùi thêm theo thời lượng để không bỏ sót lần lặp bắt đầu trước cửa sổ nhưng còn kéo dài vào trong
+        index = max(0, months - 1 - duration.days // 28)
+        advance = lambda k: _add_months(first_start, k)
+    else:
+        if _overlaps(first_start, first_start + duration if duration else None, window_start, window_end):
+            yield first_start
+        return
+
+    current = advance(index)
+    while current < window_end and (until is None or current <= until):
+        if _overlaps(current, current + duration if duration else None, window_start, window_end):
+            yield current
+        index += 1
+        current = advance(index)
+
+
+def expand(event: Any, window_start: datetime, window_end: datetime,
+           tz: tzinfo = timezone.utc) -> Iterator[Occurrence]:
+    """
+    Sinh các lần diễn ra của một event (dict hoặc Row có id, title, type, start_time, end_time, recurring,
+    recurring_until, overrides) trong cửa sổ, không lưu lần lặp nào vào DB.
+    """
+    get = event.get if isinstance(event, dict) else lambda key, default=None: getattr(event, key, default)
+    first = to_datetime(get("start_time"))
+    if first is None:
+        return
+    first = first.astimezone(tz)
+    end = to_datetime(get("end_time"))
+    duration = (end.astimezone(tz) - first) if end else timedelta(0)
+    recurring = get("recurring") or "none"
+    until = to_datetime(get("recurring_until"))
+    overrides = {o.original_start: o for o in parse_overrides(get("overrides"), tz)}
+
+    base = dict(event_id=get("id"), title=get("title"), type=get("type"), recurring=recurring)
+    seen = set()
+    for start in iter_starts(first, recurring, window_start, window_end, duration, until):
+        override = overrides.get(start)
+        if override is None:
+            yield Occurrence(start=start, end=start + duration if duration else None, **base)
+            continue
+        seen.add(start)
+        if override.cancelled:
+            continue
+        moved = _apply(override, start, duration, base)
+        if _overlaps(moved.start, moved.end, window_start, window_end):
+            yield moved
+
+    # Lần lặp gốc nằm ngoài cửa sổ nhưng bị dời vào trong
+    for original, override in overrides.items():
+        if original in seen or override.cancelled or override.start is None:
+            continue
+        moved = _apply(override, original, duration, base)
+        if _overlaps(moved.start, moved.end, window_start, window_end) and \
+                not _overlaps(original, original + duration if duration else None, window_start, window_end):
+            yield moved
+
+
+def _apply(override: Override, original: datetime, duration: timedelta, base: dict) -> Occurrence:
+    start = override.start or original
+    end = override.end or (start + duration if duration else None)
+    return Occurrence(**{**base, "title": override.title or base["title"]}, start=start, end=end, moved=True)
+
+
+def parse_overrides(value, tz: tzinfo = timezone.utc) -> list[Override]:
+    if not value:
+        return []
+    items = json.loads(value) if isinstance(value, str) else value
+    return [
+        Override(
+            original_start=to_datetime(item["original_start"]).astimezone(tz),
+            cancelled=bool(item.get("is_cancelled")),
+            start=to_datetime(item.get("start_time")).astimezone(tz) if item.get("start_time") else None,
+            end=to_datetime(item.get("end_time")).astimezone(tz) if item.get("end_time") else None,
+            title=item.get("title"),
+        )
+        for item in items
+    ]
+
+
+def expand_all(events: Iterable[Any], window_start: datetime, window_end: datetime,
+               tz: tzinfo = timezone.utc) -> list[Occurrence]:
+    return sorted((occ for event in events for occ in expand(event, window_start, window_end, tz)),
+                  key=lambda occ: occ.start)
+
+
+def next_occurrence(event: Any, after: datetime, horizon: timedelta = timedelta(days=400),
+                    tz: tzinfo = timezone.utc) -> Optional[Occurrence]:
+    return next(iter(expand_all([event], after, after + horizon, tz)), None)
+
+
+# --- TRUY VẤN ---
+
+# Ngoại lệ của từng event gom thành JSON trong cùng truy vấn
+OVERRIDES_JSON = """(
+    SELECT json_agg(json_build_object('original_start', o.original_start, 'is_cancelled', o.is_cancelled,
+                                      'start_time', o.start_time, 'end_time', o.end_time, 'title', o.title))
+    FROM event_occurrence_overrides o WHERE o.event_id = e.id
+)"""
+
+EVENT_COLUMNS = f"""e.id, e.title, e.type, e.start_time, e.end_time, e.recurring, e.recurring_until,
+    {OVERRIDES_JSON} AS overrides"""
+
+
+def recurring_events_sql(start_param: str, end_param: str, extra: str = "") -> str:
+    """Các event lặp của :uid có thể rơi vào cửa sổ (dùng idx_events_user_recurring)."""
+    return f"""
+        SELECT {EVENT_COLUMNS} FROM events e
+        WHERE e.user_id = :uid AND e.recurring <> 'none' AND e.start_time IS NOT NULL
+          AND e.start_time < CAST(:{end_param} AS timestamptz)
+          AND (e.recurring_until IS NULL OR e.recurring_until >= CAST(:{start_param} AS timestamptz)) {extra}
+    """
+
+
+def recurring_events_json(start_param: str, end_param: str, extra: str = "") -> str:
+    """Như recurring_events_sql nhưng gom thành một cột JSON để ghép vào câu lệnh khác (1 round trip)."""
+    return f"(SELECT json_agg(r) FROM ({recurring_events_sql(start_param, end_param, extra)}) r)"
+
+
+def parse_events_json(value) -> list[dict]:
+    if not value:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
+
+
+async def fetch_occurrences(conn, user_id: str, window_start: datetime, window_end: datetime,
+                            event_type: Optional[str] = None, tz: tzinfo = timezone.utc) -> list[Occurrence]:
+    """
+    Mọi lần diễn ra trong [window_start, window_end): event thường lọc theo start_time (index user_id, start_time),
+    event lặp lấy riêng rồi mở rộng trong Python.
+    """
+    type_filter = "AND e.type = CAST(:type AS event_type)" if event_type else ""
+    rows = (await conn.execute(text(f"""
+        SELECT {EVENT_COLUMNS} FROM events e
+        WHERE e.user_id = :uid AND (e.recurring IS NULL OR e.recurring = 'none')
+          AND e.start_time >= :start AND e.start_time < :end {type_filter}
+        UNION ALL
+        {recurring_events_sql("start", "end", type_filter)}
+    """), {"uid": user_id, "start": window_start, "end": window_end, "type": event_type})).fetchall()
+    return expand_all(rows, window_start, window_end, tz)
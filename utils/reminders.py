@@ -0,0 +1,327 @@
+# File: utils/reminders.py
+
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional, Protocol
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Reminder:
+    id: int
+    user_id: str
+    remind_time: datetime
+    type: str
+    attempts: int = 0
+    event_id: Optional[int] = None
+    task_id: Optional[int] = None
+    title: Optional[str] = None
+    start_time: Optional[datetime] = None
+
+
+# --- 1. KÊNH GỬI ---
+
+
+class ReminderDelivery(Protocol):
+    name: str
+
+    async def deliver(self, reminders: list[Reminder]) -> set[int]:
+        """Gửi một lô; trả về id đã gửi được (id còn lại sẽ được thử lại sau)."""
+        ...
+
+
+class LogDelivery:
+    name = "log"
+
+    async def deliver(self, reminders: list[Reminder]) -> set[int]:
+        for r in reminders:
+            logger.info(f"⏰ Nhắc user {r.user_id}: {r.title or 'Nhắc nhở'} ({r.remind_time.isoformat()})")
+        return {r.id for r in reminders}
+
+
+class StubDelivery:
+    """Kênh giả lập cho test/benchmark: giữ lại mọi reminder đã gửi, độ trễ và id lỗi cấu hình được."""
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, fail_ids: Optional[set[int]] = None):
+        self.latency = latency
+        self.fail_ids = fail_ids or set()
+        self.delivered: list[Reminder] = []
+
+    async def deliver(self, reminders: list[Reminder]) -> set[int]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        ok = [r for r in reminders if r.id not in self.fail_ids]
+        self.delivered.extend(ok)
+        return {r.id for r in ok}
+
+
+class WebhookDelivery:
+    """POST cả lô dạng JSON tới url (vd: Edge Function gửi push); 2xx = gửi được, trừ các id trong "failed"."""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+        self._client = None
+
+    async def deliver(self, reminders: list[Reminder]) -> set[int]:
+        import httpx
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        payload = {"reminders": [{**asdict(r), "remind_time": r.remind_time.isoformat(),
+                                  "start_time": r.start_time.isoformat() if r.start_time else None}
+                                 for r in reminders]}
+        response = await self._client.post(self.url, json=payload)
+        response.raise_for_status()
+        failed = set(response.json().get("failed", [])) if response.content else set()
+        return {r.id for r in reminders} - failed
+
+
+def create_delivery(name: str = "log", url: Optional[str] = None) -> ReminderDelivery:
+    if name == "webhook":
+        if not url:
+            raise ValueError("REMINDER_WEBHOOK_URL chưa được cấu hình")
+        return WebhookDelivery(url)
+    if name == "stub":
+        return StubDelivery()
+    return LogDelivery()
+
+
+# --- 2. TRUY VẤN (dùng partial index idx_reminders_pending: chỉ chứa reminder chưa gửi) ---
+
+# due_at: thời điểm được gửi (lần thử lại nếu đã gửi lỗi); next_attempt_at >= remind_time nên vẫn lọc theo index
+PENDING_WINDOW_SQL = text("""
+    SELECT id, COALESCE(next_attempt_at, remind_time) AS due_at FROM public.reminders
+    WHERE status = 'pending' AND remind_time <= :horizon
+    ORDER BY remind_time, id
+    LIMIT :limit
+""")
+
+# Khóa theo lô, bỏ qua dòng worker khác đang giữ và dòng chưa tới lần thử lại; chỉ JOIN lấy tiêu đề cho các dòng đã khóa
+CLAIM_SQL = text("""
+    WITH claimed AS (
+        SELECT id FROM public.reminders
+        WHERE status = 'pending' AND remind_time <= :now AND (next_attempt_at IS NULL OR next_attempt_at <= :now)
+        ORDER BY remind_time, id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    SELECT r.id, r.user_id, r.remind_time, r.attempts, r.type::text AS type, r.event_id, r.task_id,
+           COALESCE(t.title, e.title) AS title, e.start_time
+    FROM claimed c
+    JOIN public.reminders r ON r.id = c.id
+    LEFT JOIN public.tasks t ON t.id = r.task_id
+    LEFT JOIN public.events e ON e.id = COALESCE(r.event_id, t.event_id)
+    ORDER BY r.remind_time, r.id
+""")
+
+MARK_SQL = text("""
+    UPDATE public.reminders SET status = CAST(:status AS reminder_status)
+    WHERE id = ANY(CAST(:ids AS bigint[]))
+""")
+
+# Gửi lỗi: tăng attempts trên dòng (mọi instance cùng thấy), hẹn lần sau retry_delay * attempts giây;
+# đủ max_attempts -> expired
+RETRY_SQL = text("""
+    UPDATE public.reminders
+    SET attempts = attempts + 1,
+        next_attempt_at = CAST(:now AS timestamptz) + (attempts + 1) * CAST(:delay AS interval),
+        status = CASE WHEN attempts + 1 >= :max_attempts THEN 'expired'::reminder_status ELSE status END
+    WHERE id = ANY(CAST(:ids AS bigint[]))
+    RETURNING id, status::text AS status, next_attempt_at
+""")
+
+EXPIRE_SQL = text("""
+    UPDATE public.reminders SET status = 'expired'
+    WHERE id IN (
+        SELECT id FROM public.reminders
+        WHERE status = 'pending' AND remind_time < :cutoff
+        ORDER BY remind_time, id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+""")
+
+
+# --- 3. DISPATCHER ---
+
+
+class ReminderDispatcher:
+    """
+    - Heap (remind_time, id) các reminder pending trong `lookahead` giây tới, nạp lại mỗi `refresh` giây từ partial
+      index (chỉ đọc một lát mỏng phía trước, không quét bảng) -> ngủ đúng đến lần nhắc gần nhất thay vì cron quét.
+    - Đến hạn: lấy theo lô `batch` bằng FOR UPDATE SKIP LOCKED (nhiều worker/instance chia nhau, không gửi trùng),
+      gửi qua `delivery`, đánh dấu sent rồi commit; worker chết giữa chừng -> rollback, reminder vẫn pending.
+    - Dậy tối đa mỗi `tick` giây (như timer wheel): reminder đến hạn trong cùng một tick gộp vào một lô,
+      tải DB không tăng theo mật độ reminder, đổi lại trễ tối đa một tick.
+    - Gửi lỗi: thử lại sau retry_delay * số lần, quá max_attempts -> expired; trễ quá max_late -> expired.
+      Số lần và mốc thử lại lưu trên dòng (attempts, next_attempt_at) nên đúng cả khi chạy nhiều instance.
+    """
+
+    def __init__(self, engine_factory: Callable[[], Any], delivery: ReminderDelivery, batch: int = 200,
+                 lookahead: float = 600, refresh: float = 30, tick: float = 1.0, max_late: float = 3600,
+                 max_heap: int = 50000, retry_delay: float = 60, max_attempts: int = 5, delivery_timeout: float = 15):
+        self.engine_factory = engine_factory
+        self.delivery = delivery
+        self.batch = batch
+        self.lookahead = lookahead
+        self.refresh = refresh
+        self.tick = tick
+        self.max_late = max_late
+        self.max_heap = max_heap
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.delivery_timeout = delivery_timeout
+        self._heap: list[tuple[datetime, int]] = []
+        self._known: dict[int, datetime] = {}
+        self._next_refresh: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lags: deque[float] = deque(maxlen=2048)
+        self._recent: deque[tuple[float, int]] = deque()
+        self.delivered = 0
+        self.failed = 0
+        self.expired = 0
+        self.retries = 0
+        self.batches = 0
+        self.refreshes = 0
+        self.rows_loaded = 0
+        self.errors = 0
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(timezone.utc)
+
+    # --- NẠP HEAP ---
+
+    async def _refresh(self, now: datetime) -> None:
+        engine = self.engine_factory()
+        if self.max_late:
+            async with engine.begin() as conn:
+                result = await conn.execute(EXPIRE_SQL, {"cutoff": now - timedelta(seconds=self.max_late),
+                                                         "limit": self.batch * 10})
+                self.expired += result.rowcount or 0
+        async with engine.connect() as conn:
+            rows = (await conn.execute(PENDING_WINDOW_SQL, {"horizon": now + timedelta(seconds=self.lookahead),
+                                                            "limit": self.max_heap})).fetchall()
+        for reminder_id, due_at in rows:
+            # Chưa biết hoặc đã bị dời giờ -> thêm mốc mới; mốc cũ còn trong heap chỉ làm dậy sớm một lần
+            if self._known.get(reminder_id) != due_at:
+                self._known[reminder_id] = due_at
+                heapq.heappush(self._heap, (due_at, reminder_id))
+        self.refreshes += 1
+        self.rows_loaded += len(rows)
+        # Cửa sổ đầy (quá max_heap reminder trong lookahead) -> nạp lại ngay sau khi xử lý xong lát hiện tại
+        self._next_refresh = now + timedelta(seconds=self.refresh if len(rows) < self.max_heap else 1)
+
+    # --- LẤY & GỬI ---
+
+    async def _claim_batch(self, now: datetime) -> int:
+        async with self.engine_factory().begin() as conn:
+            rows = (await conn.execute(CLAIM_SQL, {"now": now, "limit": self.batch})).fetchall()
+            if not rows:
+                return 0
+            reminders = [Reminder(id=r.id, user_id=str(r.user_id), remind_time=r.remind_time, type=r.type,
+                                  attempts=r.attempts, event_id=r.event_id, task_id=r.task_id, title=r.title,
+                                  start_time=r.start_time)
+                         for r in rows]
+            try:
+                ok = await asyncio.wait_for(self.delivery.deliver(reminders), timeout=self.delivery_timeout)
+                ok &= {r.id for r in reminders}
+            except Exception as e:
+                logger.warning(f"⚠️ Gửi nhắc nhở ({self.delivery.name}) thất bại: {e or type(e).__name__}")
+                ok = set()
+
+            if ok:
+                await conn.execute(MARK_SQL, {"status": "sent", "ids": list(ok)})
+            failed = [r.id for r in reminders if r.id not in ok]
+            expired = 0
+            if failed:
+                retried = (await conn.execute(RETRY_SQL, {
+                    "now": now, "delay": timedelta(seconds=self.retry_delay), "max_attempts": self.max_attempts,
+                    "ids": failed,
+                })).fetchall()
+                for reminder_id, status, retry_at in retried:
+                    if status == "expired":
+                        expired += 1
+                    else:
+                        self._known[reminder_id] = retry_at
+                        heapq.heappush(self._heap, (retry_at, reminder_id))
+                        self.retries += 1
+
+        sent_at = self._now()
+        for r in reminders:
+            if r.id in ok:
+                self._lags.append((sent_at - r.remind_time).total_seconds())
+        self._recent.append((time.monotonic(), len(ok)))
+        self.delivered += len(ok)
+        self.failed += len(reminders) - len(ok)
+        self.expired += expired
+        self.batches += 1
+        return len(rows)
+
+    async def _drain(self, now: datetime) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            remind_time, reminder_id = heapq.heappop(self._heap)
+            if self._known.get(reminder_id) == remind_time:
+                del self._known[reminder_id]
+        # Lấy hết phần đã đến hạn (kể cả reminder vừa thêm chưa kịp vào heap) theo từng lô
+        while await self._claim_batch(now) >= self.batch:
+            now = self._now()
+
+    async def run_once(self) -> None:
+        now = self._now()
+        if self._next_refresh is None or now >= self._next_refresh:
+            await self._refresh(now)
+        if self._heap and self._heap[0][0] <= now:
+            await self._drain(now)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"⚠️ Reminder dispatcher lỗi: {e}")
+                await asyncio.sleep(min(self.refresh, 5))
+                continue
+            wake_at = self._next_refresh
+            if self._heap and self._heap[0][0] < wake_at:
+                wake_at = max(self._heap[0][0], self._now() + timedelta(seconds=self.tick))
+            await asyncio.sleep(max(0.0, (wake_at - self._now()).total_seconds()))
+
+    def start(self) -> None:
+        """Gọi trong startup hook của FastAPI (cần event loop đang chạy)."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        cutoff = time.monotonic() - 60
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        lags = sorted(self._lags)
+        return {
+            "running": self._task is not None, "delivery": self.delivery.name, "heap": len(self._heap),
+            "delivered": self.delivered, "failed": self.failed, "expired": self.expired, "batches": self.batches,
+            "refreshes": self.refreshes, "rows_loaded": self.rows_loaded, "retries": self.retries,
+            "errors": self.errors,
+            "delivered_per_sec": round(sum(n for _, n in self._recent) / 60, 3),
+            "lag_p50_seconds": round(lags[len(lags) // 2], 3) if lags else 0.0,
+            "lag_p95_seconds": round(lags[int(len(lags) * 0.95)], 3) if lags else 0.0,
+            "lag_max_seconds": round(lags[-1], 3) if lags else 0.0,
+        }
@@ -0,0 +1,138 @@
+# File: utils/scheduler.py
+
+import bisect
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from typing import Any, Iterable, Optional
+
+# Trọng số ưu tiên theo enum task_priority
+PRIORITY_WEIGHT = {"high": 3, "medium": 2, "low": 1}
+
+
+@dataclass(frozen=True, order=True)
+class Interval:
+    start: datetime
+    end: datetime
+
+    @property
+    def minutes(self) -> float:
+        return (self.end - self.start).total_seconds() / 60
+
+
+@dataclass
+class TaskRequest:
+    """Một việc cần xếp giờ (thường là event của một task chưa xong)."""
+    key: Any
+    title: str
+    duration: timedelta
+    priority: str = "medium"
+    deadline: Optional[datetime] = None
+
+
+@dataclass
+class Placement:
+    task: TaskRequest
+    start: datetime
+    end: datetime
+
+
+@dataclass
+class Plan:
+    placements: list[Placement] = field(default_factory=list)
+    unplaced: list[tuple[TaskRequest, str]] = field(default_factory=list)
+
+
+# --- KHOẢNG TRỐNG ---
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> list[Interval]:
+    """Sắp xếp + gộp các khoảng chồng/chạm nhau: O(n log n)."""
+    merged: list[Interval] = []
+    for item in sorted(i for i in intervals if i.end > i.start):
+        if merged and item.start <= merged[-1].end:
+            if item.end > merged[-1].end:
+                merged[-1] = Interval(merged[-1].start, item.end)
+        else:
+            merged.append(item)
+    return merged
+
+
+def free_slots(busy: Iterable[Interval], window_start: datetime, window_end: datetime,
+               day_start: time = time(8, 0), day_end: time = time(22, 0),
+               min_duration: timedelta = timedelta(minutes=15)) -> list[Interval]:
+    """
+    Khoảng trống trong [window_start, window_end), chỉ trong giờ làm việc mỗi ngày.
+    Quét một lượt qua danh sách bận đã gộp: O(n log n + số ngày).
+    window_start/window_end phải cùng múi giờ với giờ làm việc mong muốn.
+    """
+    merged = merge_intervals(busy)
+    ends = [b.end for b in merged]
+    slots: list[Interval] = []
+    tz = window_start.tzinfo
+    day = window_start.date()
+    while day <= window_end.date():
+        open_at = max(window_start, datetime.combine(day, day_start, tz))
+        close_at = min(window_end, datetime.combine(day, day_end, tz))
+        if open_at < close_at:
+            cursor = open_at
+            # Khoảng bận đầu tiên kết thúc sau giờ mở cửa
+            index = bisect.bisect_right(ends, open_at)
+            while index < len(merged) and merged[index].start < close_at:
+                if merged[index].start > cursor:
+                    slots.append(Interval(cursor, merged[index].start))
+                cursor = max(cursor, merged[index].end)
+                index += 1
+            if cursor < close_at:
+                slots.append(Interval(cursor, close_at))
+        day += timedelta(days=1)
+    return [s for s in slots if s.end - s.start >= min_duration]
+
+
+# --- XẾP LỊCH ---
+
+
+def _align(value: datetime, minutes: int) -> datetime:
+    """Làm tròn lên bội số `minutes` (vd 15 phút) để giờ đề xuất dễ đọc."""
+    if minutes <= 1:
+        return value
+    base = value.replace(second=0, microsecond=0)
+    if base < value:
+        base += timedelta(minutes=1)
+    extra = (-base.minute) % minutes
+    return base + timedelta(minutes=extra)
+
+
+def task_order(task: TaskRequest) -> tuple:
+    # Deadline sớm trước, cùng deadline thì ưu tiên cao trước, còn lại theo thời lượng dài trước
+    deadline = task.deadline.timestamp() if task.deadline else math.inf
+    return deadline, -PRIORITY_WEIGHT.get(task.priority, 2), -task.duration.total_seconds()
+
+
+def plan_tasks(tasks: Iterable[TaskRequest], slots: list[Interval], align_minutes: int = 15) -> Plan:
+    """
+    Earliest-fit theo thứ tự (deadline, ưu tiên): mỗi việc lấy khoảng trống sớm nhất vừa đủ và kết thúc
+    trước deadline; khoảng đã dùng bị cắt nên các việc không bao giờ chồng nhau.
+    """
+    free = sorted(slots)
+    plan = Plan()
+    for task in sorted(tasks, key=task_order):
+        placed = False
+        for index, slot in enumerate(free):
+            start = _align(slot.start, align_minutes)
+            end = start + task.duration
+            if end > slot.end:
+                continue
+            if task.deadline and end > task.deadline:
+                break  # các khoảng sau còn muộn hơn
+            plan.placements.append(Placement(task, start, end))
+            remaining = [piece for piece in (Interval(slot.start, start), Interval(end, slot.end))
+                         if piece.end - piece.start >= timedelta(minutes=max(align_minutes, 1))]
+            free[index:index + 1] = remaining
+            placed = True
+            break
+        if not placed:
+            reason = "không còn khoảng trống trước deadline" if task.deadline else "không còn khoảng trống đủ dài"
+            plan.unplaced.append((task, reason))
+    plan.placements.sort(key=lambda p: p.start)
+    return plan
@@ -0,0 +1,171 @@
+# File: utils/search.py
+
+import json
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime, tzinfo
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+
+from utils.recurrence import to_datetime
+
+logger = logging.getLogger(__name__)
+
+SEARCH_KINDS = ("event", "note")
+_WORDS = re.compile(r"[a-z0-9]+")
+# Thứ tự xếp hạng dùng chung cho mọi câu lệnh ghép CTE `hits` (kết quả tốt nhất = dòng đầu)
+HIT_ORDER = "score DESC, start_time DESC NULLS LAST, id"
+
+# Ngưỡng điểm (xem hits_sql): tiêu đề trùng hẳn từ khóa / tiêu đề bắt đầu bằng từ khóa
+EXACT_TITLE, HIGH_CONFIDENCE = 2.0, 1.0
+
+# pg_trgm có hay không (Postgres local/CI có thể thiếu contrib) -> kiểm tra một lần cho cả process
+_trigram_enabled: Optional[bool] = None
+
+
+def vn_unaccent(value: str) -> str:
+    """Giống hàm SQL public.vn_unaccent: bỏ dấu tiếng Việt (kể cả đ) + chữ thường."""
+    value = unicodedata.normalize("NFD", value).replace("đ", "d").replace("Đ", "D")
+    return "".join(c for c in value if unicodedata.category(c) != "Mn").lower()
+
+
+@dataclass
+class SearchHit:
+    kind: str              # "event" | "note"
+    id: int
+    title: str
+    type: str
+    start_time: Optional[datetime]
+    score: float
+    fulltext: bool = True  # False: chỉ khớp gần đúng (trigram), có thể là mục khác tên gần giống
+
+
+@dataclass
+class SearchResult:
+    """Kết quả tốt nhất + các kết quả gần giống (để hỏi lại user khi mơ hồ)."""
+    best: Optional[SearchHit] = None
+    others: list[SearchHit] = field(default_factory=list)
+
+    @property
+    def hits(self) -> list[SearchHit]:
+        return ([self.best] if self.best else []) + self.others
+
+    def unique(self, min_score: float = HIGH_CONFIDENCE, fulltext_fallback: bool = False) -> Optional[SearchHit]:
+        """Mục duy nhất khớp chắc chắn: một tiêu đề trùng hẳn, hoặc (không có) một mục duy nhất đạt min_score;
+        fulltext_fallback: không có cả hai thì nhận mục duy nhất khớp full-text (không tính khớp gần đúng)."""
+        for threshold in (EXACT_TITLE, min_score):
+            confident = [hit for hit in self.hits if hit.fulltext and hit.score >= threshold]
+            if confident:
+                return confident[0] if len(confident) == 1 else None
+        if fulltext_fallback:
+            matched = [hit for hit in self.hits if hit.fulltext]
+            return matched[0] if len(matched) == 1 else None
+        return None
+
+    def describe_others(self, limit: int = 3) -> str:
+        if not self.others:
+            return ""
+        names = ", ".join(f"'{hit.title}'" for hit in self.others[:limit])
+        return f"(Các mục khác cũng khớp: {names})"
+
+    def describe_candidates(self, limit: int = 5, tz: Optional[tzinfo] = None) -> str:
+        """Liệt kê ứng viên kèm id + giờ (theo tz) để hỏi lại user (gọi lại tool với id đã chọn)."""
+        return "; ".join(
+            f"#{hit.id} '{hit.title}'" + (f" ({hit.start_time.astimezone(tz):%d/%m %H:%M})" if hit.start_time else "")
+            for hit in self.hits[:limit])
+
+
+def search_params(keyword: str) -> Optional[dict]:
+    """Tham số cho hits_sql; None nếu từ khóa không có chữ/số nào để tìm."""
+    normalized = " ".join(_WORDS.findall(vn_unaccent(keyword)))
+    if not normalized:
+        return None
+    # Mọi từ đều phải có, từ nào cũng khớp tiền tố ("hop nh" -> "Họp nhóm")
+    return {"q_norm": normalized, "q_ts": " & ".join(f"{word}:*" for word in normalized.split())}
+
+
+def hits_sql(kinds: Sequence[str] = SEARCH_KINDS, trigram: bool = False) -> str:
+    """
+    CTE `hits(kind, id, title, type, start_time, score)` đã xếp hạng cho :uid, dùng với search_params.
+    - search_vector @@ tsquery: GIN idx_events_search_vector / idx_notes_search_vector.
+    - trigram (nếu có pg_trgm): `<%` trên search_title / search_text (cột không dấu lưu sẵn) để bắt lỗi gõ, GIN *_trgm.
+    Điểm = ts_rank + độ giống trigram + thưởng khi tiêu đề trùng/bắt đầu bằng từ khóa.
+    """
+    parts = []
+    if "event" in kinds:
+        fuzzy = "OR q.norm <% e.search_title" if trigram else ""
+        similarity = "+ word_similarity(q.norm, e.search_title)" if trigram else ""
+        parts.append(f"""
+            SELECT 'event' AS kind, e.id, e.title, CAST(e.type AS text) AS type, e.start_time,
+                   ts_rank(e.search_vector, q.ts) {similarity}
+                   + CASE WHEN e.search_title = q.norm THEN 2
+                          WHEN e.search_title LIKE q.norm || '%' THEN 1 ELSE 0 END AS score,
+                   e.search_vector @@ q.ts AS fulltext
+            FROM events e, q
+            WHERE e.user_id = :uid AND (e.search_vector @@ q.ts {fuzzy})""")
+    if "note" in kinds:
+        fuzzy = "OR q.norm <% n.search_text" if trigram else ""
+        similarity = "+ word_similarity(q.norm, n.search_text)" if trigram else ""
+        parts.append(f"""
+            SELECT 'note' AS kind, n.id, left(n.content, 80) AS title, 'note' AS type, n.created_at AS start_time,
+                   ts_rank(n.search_vector, q.ts) {similarity} AS score, n.search_vector @@ q.ts AS fulltext
+            FROM notes n, q
+            WHERE n.user_id = :uid AND (n.search_vector @@ q.ts {fuzzy})""")
+    return f"""
+        q AS (SELECT to_tsquery('simple', :q_ts) AS ts, CAST(:q_norm AS text) AS norm),
+        hits AS ({" UNION ALL ".join(parts)})"""
+
+
+# Các kết quả còn lại (sau kết quả tốt nhất) gom thành JSON để trả trong cùng câu lệnh
+OTHERS_JSON = """(
+    SELECT json_agg(json_build_object('kind', h.kind, 'id', h.id, 'title', h.title, 'type', h.type,
+                                      'start_time', h.start_time, 'score', h.score, 'fulltext', h.fulltext)
+                              ORDER BY h.score DESC)
+    FROM (SELECT * FROM hits ORDER BY {order} OFFSET 1 LIMIT :search_limit) h
+)""".format(order=HIT_ORDER)
+
+
+def parse_hits(value) -> list[SearchHit]:
+    if not value:
+        return []
+    items = json.loads(value) if isinstance(value, str) else value
+    return [SearchHit(kind=i["kind"], id=i["id"], title=i["title"], type=i["type"],
+                      start_time=to_datetime(i["start_time"]), score=i["score"], fulltext=i.get("fulltext", True))
+            for i in items]
+
+
+async def trigram_enabled(conn) -> bool:
+    global _trigram_enabled
+    if _trigram_enabled is None:
+        _trigram_enabled = bool((await conn.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"))).scalar())
+        if not _trigram_enabled:
+            logger.info("🔎 Không có pg_trgm: tìm kiếm chỉ dùng full-text (không bắt lỗi gõ)")
+    return _trigram_enabled
+
+
+async def search(conn, user_id: str, keyword: str, kinds: Sequence[str] = SEARCH_KINDS,
+                 limit: int = 5) -> SearchResult:
+    """Tìm sự kiện/ghi chú theo từ khóa (không dấu, sai chính tả nhẹ): 1 round trip, trả về best + others."""
+    query = search_params(keyword)
+    if query is None:
+        return SearchResult()
+    rows = (await conn.execute(text(f"""
+        WITH {hits_sql(kinds, await trigram_enabled(conn))}
+        SELECT kind, id, title, type, start_time, score, fulltext FROM hits
+        ORDER BY {HIT_ORDER}
+        LIMIT :search_limit
+    """), {"uid": user_id, "search_limit": limit, **query})).fetchall()
+    hits = [SearchHit(kind=r.kind, id=r.id, title=r.title, type=r.type, start_time=r.start_time, score=r.score,
+                      fulltext=r.fulltext) for r in rows]
+    return SearchResult(best=hits[0] if hits else None, others=hits[1:])
+
+
+async def unique_match(conn, user_id: str, keyword: str, kinds: Sequence[str] = ("event",),
+                       min_score: float = HIGH_CONFIDENCE) -> Optional[SearchHit]:
+    """Mục duy nhất khớp chắc chắn: một tiêu đề trùng hẳn, hoặc (không có) một mục duy nhất đạt min_score.
+    None nếu không có hoặc từ hai mục trở lên (mơ hồ, phải hỏi lại)."""
+    return (await search(conn, user_id, keyword, kinds, limit=3)).unique(min_score)
@@ -0,0 +1,127 @@
+# File: utils/session_lanes.py
+
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+from utils.admission import Overloaded
+
+
+def content_key(text: str) -> str:
+    """Khóa gộp theo nội dung: bỏ khoảng trắng thừa, giữ nguyên chữ (hai tin khác nhau không bị gộp nhầm)."""
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+class _Lane:
+    __slots__ = ("lock", "users", "waiting")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.waiting = 0  # chỉ đếm request đang chờ, không tính request đang chạy
+
+
+class SessionLanes:
+    """
+    - lane(session_id): request của cùng một session chạy lần lượt (đọc/ghi history, tool ghi không chồng nhau),
+      session khác nhau vẫn song song. Lock tạo khi cần, bỏ đi khi không còn ai dùng.
+    - coalesce(key, factory): request giống hệt đang chạy -> chờ và dùng chung kết quả thay vì chạy lại.
+      keep > 0 giữ kết quả thêm keep giây (cho Idempotency-Key: client retry sau khi request đầu đã xong).
+    """
+
+    def __init__(self, max_waiting: int = 4):
+        self.max_waiting = max_waiting
+        self._lanes: dict[str, _Lane] = {}
+        self._inflight: dict[Hashable, tuple[asyncio.Future, float]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.queued = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    # --- 1. TUẦN TỰ THEO SESSION ---
+
+    @asynccontextmanager
+    async def lane(self, session_id: str) -> AsyncIterator[None]:
+        lane = self._lanes.get(session_id)
+        if lane is None:
+            lane = self._lanes[session_id] = _Lane()
+        if lane.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded("Tin nhắn trước của bạn vẫn đang được xử lý, thử lại sau nhé.", status_code=429,
+                             retry_after=2)
+        if lane.lock.locked():
+            self.queued += 1
+        lane.users += 1
+        lane.waiting += 1
+        acquired = False
+        try:
+            async with lane.lock:
+                lane.waiting -= 1
+                acquired = True
+                yield
+        finally:
+            if not acquired:
+                lane.waiting -= 1
+            lane.users -= 1
+            if lane.users == 0:
+                self._lanes.pop(session_id, None)
+
+    # --- 2. GỘP REQUEST TRÙNG ---
+
+    def _purge(self, now: float) -> None:
+        # Entry đã xong lưu (future, hạn giữ kết quả); đang chạy lưu (future, số giây sẽ giữ)
+        expired = [key for key, (future, until) in self._inflight.items() if future.done() and until <= now]
+        for key in expired:
+            del self._inflight[key]
+
+    def claim(self, key: Hashable, keep: float = 0) -> tuple[asyncio.Future, bool]:
+        """(future, True) nếu là request đầu tiên (phải gọi resolve), (future đang chạy/đã xong, False) nếu trùng."""
+        self._purge(time.monotonic())
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.coalesced += 1
+            return entry[0], False
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, keep)
+        return future, True
+
+    def resolve(self, key: Hashable, future: asyncio.Future, result: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+                future.exception()  # không ai chờ cũng không log "exception was never retrieved"
+            else:
+                future.set_result(result)
+        entry = self._inflight.get(key)
+        if entry is None or entry[0] is not future:
+            return
+        if entry[1] > 0 and error is None and not future.cancelled():
+            self._inflight[key] = (future, time.monotonic() + entry[1])
+        else:
+            del self._inflight[key]
+
+    async def coalesce(self, key: Hashable, factory: Callable[[], Awaitable[Any]], keep: float = 0) -> Any:
+        future, leader = self.claim(key, keep)
+        if leader:
+            # Chạy thành task riêng: request đầu bị hủy (client ngắt) thì các request trùng vẫn có kết quả
+            task = asyncio.ensure_future(factory())
+            self._tasks.add(task)
+
+            def done(t: asyncio.Task) -> None:
+                self._tasks.discard(t)
+                if t.cancelled():
+                    future.cancel()
+                    self.resolve(key, future)
+                else:
+                    self.resolve(key, future, None if t.exception() else t.result(), t.exception())
+
+            task.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._lanes), "busy": sum(1 for lane in self._lanes.values() if lane.lock.locked()),
+                "inflight": len(self._inflight), "queued": self.queued, "rejected": self.rejected,
+                "coalesced": self.coalesced}
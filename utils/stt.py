@@ -0,0 +1,200 @@
+# File: utils/stt.py
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol
+
+from utils.admission import ConcurrencyGate, Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Container có metadata ở cuối file (moov atom) không giải mã được từ pipe -> phải ghi ra file tạm
+_SEEKABLE_ONLY = {"m4a", "mp4", "mov", "3gp", "caf"}
+
+
+class SpeechInputTooLarge(Exception):
+    pass
+
+
+class SpeechBusy(Overloaded):
+    """Hàng đợi STT đầy hoặc chờ quá lâu."""
+
+
+# --- 1. RECOGNIZER ---
+
+
+class Recognizer(Protocol):
+    name: str
+
+    def recognize(self, pcm: bytes, sample_rate: int, sample_width: int) -> str: ...
+
+
+class GoogleRecognizer:
+    name = "google"
+
+    def __init__(self, language: str = "vi-VN"):
+        self.language = language
+
+    def recognize(self, pcm: bytes, sample_rate: int, sample_width: int) -> str:
+        import speech_recognition as sr
+        return sr.Recognizer().recognize_google(
+            sr.AudioData(pcm, sample_rate, sample_width), language=self.language)
+
+
+class SphinxRecognizer:
+    """Offline (cần pocketsphinx + mô hình ngôn ngữ)."""
+    name = "sphinx"
+
+    def __init__(self, language: str = "vi-VN"):
+        self.language = language
+
+    def recognize(self, pcm: bytes, sample_rate: int, sample_width: int) -> str:
+        import speech_recognition as sr
+        return sr.Recognizer().recognize_sphinx(
+            sr.AudioData(pcm, sample_rate, sample_width), language=self.language)
+
+
+class StubRecognizer:
+    """Recognizer giả lập cho test/benchmark: trả về câu cố định, không gọi mạng."""
+    name = "stub"
+
+    def __init__(self, transcript: str = "lịch tuần này"):
+        self.transcript = transcript
+        self.calls = 0
+
+    def recognize(self, pcm: bytes, sample_rate: int, sample_width: int) -> str:
+        self.calls += 1
+        return self.transcript
+
+
+def create_recognizer(name: str = "google") -> Recognizer:
+    if name == "stub":
+        return StubRecognizer()
+    if name == "sphinx":
+        return SphinxRecognizer()
+    return GoogleRecognizer()
+
+
+# --- 2. SERVICE ---
+
+
+class SpeechToText:
+    """
+    Giải mã + nhận dạng giọng nói ngoài event loop:
+    - Upload được đọc theo chunk, vượt `max_bytes` thì dừng ngay.
+    - ffmpeg chạy ở process riêng, xuất thẳng PCM s16le mono (định dạng recognizer cần), không qua WAV.
+    - Số lượt xử lý đồng thời và số lượt chờ đều có giới hạn (backpressure).
+    """
+
+    def __init__(self, recognizer: Recognizer, max_bytes: int = 10 * 1024 * 1024,
+                 max_seconds: int = 120, sample_rate: int = 16000, chunk_size: int = 64 * 1024,
+                 max_concurrency: int = 2, max_waiting: int = 8, queue_timeout: float = 10.0,
+                 ffmpeg: str = "ffmpeg"):
+        self.recognizer = recognizer
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.ffmpeg = ffmpeg
+        self.gate = ConcurrencyGate("stt", max_concurrency, max_waiting=max_waiting, timeout=queue_timeout,
+                                    label="xử lý giọng nói")
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="stt")
+
+    def _ffmpeg_args(self, source: str) -> list[str]:
+        return [self.ffmpeg, "-hide_banner", "-loglevel", "error", "-i", source,
+                "-t", str(self.max_seconds), "-f", "s16le", "-ac", "1", "-ar", str(self.sample_rate), "pipe:1"]
+
+    async def _read_chunks(self, upload):
+        total = 0
+        while True:
+            chunk = await upload.read(self.chunk_size)
+            if not chunk:
+                return
+            total += len(chunk)
+            if total > self.max_bytes:
+                raise SpeechInputTooLarge(f"File âm thanh vượt quá {self.max_bytes // (1024 * 1024)}MB")
+            yield chunk
+
+    async def _decode_stream(self, upload) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            *self._ffmpeg_args("pipe:0"), stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+        async def feed():
+            try:
+                async for chunk in self._read_chunks(upload):
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg đã dừng sớm, lỗi sẽ nằm trong stderr
+            finally:
+                proc.stdin.close()
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            pcm, err = await asyncio.gather(proc.stdout.read(), proc.stderr.read())
+            await feeder
+        except BaseException:
+            feeder.cancel()
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+            raise
+        if await proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg lỗi: {err.decode(errors='ignore').strip()}")
+        return pcm
+
+    async def _decode_file(self, upload) -> bytes:
+        fd, path = tempfile.mkstemp(suffix=".audio")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in self._read_chunks(upload):
+                    await asyncio.to_thread(f.write, chunk)
+            proc = await asyncio.create_subprocess_exec(
+                *self._ffmpeg_args(path), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            pcm, err = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg lỗi: {err.decode(errors='ignore').strip()}")
+            return pcm
+        finally:
+            os.unlink(path)
+
+    @staticmethod
+    def _audio_format(upload) -> str:
+        filename = getattr(upload, "filename", None) or ""
+        ext = os.path.splitext(filename)[1].lstrip(".").lower()
+        if ext:
+            return ext
+        content_type = getattr(upload, "content_type", None) or ""
+        return content_type.split("/")[-1].lower()
+
+    async def _acquire(self) -> None:
+        try:
+            await self.gate.acquire()
+        except Overloaded as e:
+            raise SpeechBusy(str(e), retry_after=e.retry_after) from e
+
+    async def transcribe(self, upload) -> str:
+        await self._acquire()
+        start = time.monotonic()
+        try:
+            if self._audio_format(upload) in _SEEKABLE_ONLY:
+                pcm = await self._decode_file(upload)
+            else:
+                pcm = await self._decode_stream(upload)
+            if not pcm:
+                return ""
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self.recognizer.recognize, pcm, self.sample_rate, 2)
+        finally:
+            self.gate.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        gate = self.gate.stats()
+        return {"recognizer": self.recognizer.name, **gate,
+                "rejected": gate["rejected_full"] + gate["rejected_timeout"]}
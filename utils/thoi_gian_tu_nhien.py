@@ -1,7 +1,14 @@
 # File: utils/thoi_gian_tu_nhien.py
 
+import calendar
+import functools
 import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
+from typing import Iterable, Optional
 
 # --- CÁC HÀM PHỤ TRỢ ---
 
@@ -10,7 +17,8 @@ def add_months(dt: datetime, months: int) -> datetime:
     month = dt.month - 1 + months
     year = dt.year + month // 12
     month = month % 12 + 1
-    day = min(dt.day, 28)
+    # Ngày 31 ở tháng ít ngày hơn -> ngày cuối tháng
+    day = min(dt.day, calendar.monthrange(year, month)[1])
     return dt.replace(year=year, month=month, day=day)
 
 
@@ -25,42 +33,417 @@ def end_of_month(dt: datetime) -> datetime:
     next_month = add_months(dt, 1).replace(day=1)
     return next_month - timedelta(days=1)
 
+
+# --- BẢNG TỪ VỰNG ---
+
+WEEKDAYS = {
+    "hai": 0, "2": 0, "ba": 1, "3": 1, "tư": 2, "tu": 2, "4": 2, "năm": 3, "nam": 3, "5": 3,
+    "sáu": 4, "sau": 4, "6": 4, "bảy": 5, "bay": 5, "7": 5,
+}
+# Hướng dịch chuyển: "tuần sau", "tháng trước", "năm nay"...
+DIRECTIONS = {"sau": 1, "tới": 1, "nữa": 1, "này": 0, "nay": 0, "trước": -1}
+DAY_WORDS = {
+    "hôm nay": 0, "bữa nay": 0, "nay": 0, "ngày mai": 1, "mai": 1,
+    "ngày mốt": 2, "mốt": 2, "ngày kia": 2, "hôm qua": -1, "hôm kia": -2,
+}
+# Giờ mặc định khi chỉ nói buổi ("sáng mai", "tối nay")
+PERIOD_HOURS = {"sáng": 8, "trưa": 12, "chiều": 14, "tối": 19, "đêm": 22, "khuya": 23}
+NUMBER_WORDS = {
+    "một": "1", "hai": "2", "ba": "3", "bốn": "4", "tư": "4", "năm": "5", "sáu": "6", "bảy": "7",
+    "tám": "8", "chín": "9", "mười": "10", "mười một": "11", "mười hai": "12", "mười lăm": "15",
+}
+
+# --- NGỮ PHÁP (biên dịch một lần khi import) ---
+
+_SPACES = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s,.;!?]+$")
+_HALF_HOUR = re.compile(r"\bnửa\s+(?:tiếng|giờ)\b")
+# Số bằng chữ đứng trước đơn vị: "hai ngày nữa", "tám giờ tối" ("thứ năm tuần sau" -> "thứ 5 tuần sau" vẫn đúng)
+_NUMBER_WORDS = re.compile(
+    r"\b(" + "|".join(sorted(map(re.escape, NUMBER_WORDS), key=len, reverse=True)) + r")\s+"
+    r"(?=(?:giờ|tiếng|phút|ngày|tuần|tháng|năm)\b)")
+_LETTER_AFTER = r"(?![^\W\d_])"
+_DIR = r"sau|tới|nữa|trước"
+
+# Thứ tự quan trọng: cùng vị trí bắt đầu thì nhánh đứng trước thắng ("2 giờ nữa" là khoảng, không phải 2h)
+_TOKENS = [
+    ("rel", rf"(?<!\d)(?P<rel_n>\d+)\s*(?P<rel_unit>ngày|tuần|tháng|năm|giờ|tiếng|phút)\s*(?P<rel_dir>{_DIR})\b"),
+    ("duration", r"(?:trong\s+(?P<dur_a>\d+(?:[.,]\d+)?)\s*(?P<dur_ua>giờ|tiếng|phút)"
+                 r"|(?<!\d)(?P<dur_b>\d+(?:[.,]\d+)?)\s*(?P<dur_ub>tiếng|phút))(?P<dur_half>\s*rưỡi)?"),
+    ("iso_date", r"(?<!\d)(?P<iso_y>\d{4})-(?P<iso_m>\d{1,2})-(?P<iso_d>\d{1,2})(?!\d)"),
+    ("date", r"(?<!\d)(?:(?P<d_day>\d{1,2})\s*/\s*(?P<d_month>\d{1,2})(?:\s*/\s*(?P<d_year>\d{2,4}))?"
+             r"|(?P<d_day2>\d{1,2})-(?P<d_month2>\d{1,2})-(?P<d_year2>\d{2,4}))(?!\d)"),
+    ("date_words", r"\b(?:ngày|mùng|mồng)\s+(?P<w_day>\d{1,2})(?!\s*[/-]\s*\d)"
+                   r"(?:\s+tháng\s+(?P<w_month>\d{1,2})(?:\s+năm\s+(?P<w_year>\d{4}))?)?(?!\d)"),
+    ("weekday", r"(?:\b(?:thứ|thu)\s*(?P<wd>hai|ba|tư|tu|năm|nam|sáu|sau|bảy|bay|[2-7])\b"
+                r"|\bt(?P<wd_short>[2-7])\b|\b(?P<wd_sun>chủ\s*nhật|chu\s*nhat|cn)\b)"
+                r"(?:\s*tuần\s*(?P<wd_mod>sau|tới|này|trước))?"),
+    ("edge", r"\b(?P<edge_at>đầu|cuối)\s*(?P<edge_unit>tuần|tháng)(?:\s*(?P<edge_mod>sau|tới|này|trước))?"),
+    ("shift", r"\b(?P<shift_unit>tuần|tháng|năm)\s*(?P<shift_dir>sau|tới|này|nay|trước)\b"),
+    ("day_word", r"\b(?P<day>hôm\s*nay|bữa\s*nay|ngày\s*mai|ngày\s*mốt|ngày\s*kia|hôm\s*qua|hôm\s*kia|mai|mốt|nay)\b"),
+    ("clock", rf"(?<!\d)(?P<c_h>\d{{1,2}})(?::(?P<c_m>\d{{2}})|\s*(?:giờ|h|g){_LETTER_AFTER}"
+              r"(?:\s*(?P<c_m2>\d{1,2})(?:\s*(?:phút|p)" + _LETTER_AFTER + r")?)?)"
+              r"(?P<c_half>\s*rưỡi)?(?:\s*kém\s*(?P<c_less>\d{1,2})(?:\s*phút)?)?"
+              r"(?:\s*(?P<c_period>sáng|trưa|chiều|tối|đêm|khuya|am|pm)\b)?"),
+    ("period", r"\b(?P<p_word>sáng|trưa|chiều|tối|đêm|khuya)\b"),
+    ("num", r"(?<!\d)(?P<n_val>\d{1,2})(?!\d)"),
+    ("sep", r"(?P<sep_word>\bđến\b|\btới\b|[-–~])"),
+]
+_GRAMMAR = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in _TOKENS))
+
+
+@dataclass(frozen=True)
+class TimeSpec:
+    """Một mốc thời gian đã phân tích (chưa gắn ngày gốc) -> có thể cache theo biểu thức."""
+    has_date: bool = False
+    absolute: Optional[tuple] = None          # (năm | None, tháng, ngày)
+    day_shift: int = 0
+    month_shift: int = 0
+    year_shift: int = 0
+    weekday: Optional[int] = None              # 0 = thứ hai
+    week_shift: Optional[int] = None           # None = lần gần nhất kể từ hôm nay
+    month_edge: Optional[str] = None           # "start" | "end"
+    clock: Optional[tuple] = None              # (giờ, phút, buổi | None)
+    period: Optional[str] = None
+    bare_hour: Optional[int] = None            # "từ 8 đến 10 giờ": số trơn chỉ dùng trong khoảng
+    offset: timedelta = timedelta(0)           # "2 tiếng nữa"
+    duration: Optional[timedelta] = None       # "trong 2 tiếng"
+    matched: bool = False
+
+    @property
+    def anchored(self) -> bool:
+        # Có giờ cụ thể -> kết quả chỉ phụ thuộc NGÀY gốc (cache được theo ngày)
+        return (self.clock is not None or self.period is not None) and not self.offset
+
+    @property
+    def floating(self) -> bool:
+        # Không có giờ nào ("mai", "2 tiếng nữa") -> kết quả = tính từ 0h ngày gốc + giờ trong ngày của gốc
+        return self.clock is None and self.period is None
+
+    def date_fields(self) -> dict:
+        return {name: getattr(self, name) for name in
+                ("has_date", "absolute", "day_shift", "month_shift", "year_shift", "weekday", "week_shift", "month_edge")}
+
+
+@dataclass(frozen=True)
+class CompiledTime:
+    start: TimeSpec
+    end: Optional[TimeSpec] = None
+
+    @property
+    def matched(self) -> bool:
+        return self.start.matched or (self.end is not None and self.end.matched)
+
+    @property
+    def anchored(self) -> bool:
+        return self.start.anchored and (self.end is None or self.end.anchored)
+
+    @property
+    def floating(self) -> bool:
+        return self.start.floating and (self.end is None or self.end.floating)
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(expression: str) -> str:
+    expr = unicodedata.normalize("NFC", expression).lower().strip()
+    expr = _TRAILING.sub("", _SPACES.sub(" ", expr))
+    expr = _HALF_HOUR.sub("30 phút", expr)
+    return _NUMBER_WORDS.sub(lambda m: NUMBER_WORDS[m.group(1)] + " ", expr)
+
+
+def _year(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def _spec_from(tokens: list) -> TimeSpec:
+    """Gộp các token của một nửa biểu thức thành TimeSpec."""
+    spec: dict = {"offset": timedelta(0)}
+    for match in tokens:
+        kind, g = match.lastgroup, match.groupdict()
+        if kind == "rel":
+            amount = int(g["rel_n"]) * (-1 if g["rel_dir"] == "trước" else 1)
+            unit = g["rel_unit"]
+            if unit in ("giờ", "tiếng"):
+                spec["offset"] += timedelta(hours=amount)
+            elif unit == "phút":
+                spec["offset"] += timedelta(minutes=amount)
+            else:
+                key = {"ngày": "day_shift", "tuần": "day_shift", "tháng": "month_shift", "năm": "year_shift"}[unit]
+                spec[key] = spec.get(key, 0) + amount * (7 if unit == "tuần" else 1)
+                spec["has_date"] = True
+        elif kind == "duration":
+            amount = _number(g["dur_a"] or g["dur_b"]) + (0.5 if g["dur_half"] else 0)
+            unit = g["dur_ua"] or g["dur_ub"]
+            spec["duration"] = timedelta(minutes=amount) if unit == "phút" else timedelta(hours=amount)
+        elif kind in ("iso_date", "date", "date_words"):
+            if kind == "iso_date":
+                year, month, day = int(g["iso_y"]), int(g["iso_m"]), int(g["iso_d"])
+            elif kind == "date":
+                day, month = int(g["d_day"] or g["d_day2"]), int(g["d_month"] or g["d_month2"])
+                year = _year(g["d_year"] or g["d_year2"])
+            else:
+                day, month, year = int(g["w_day"]), int(g["w_month"] or 0), _year(g["w_year"])
+            if not 1 <= day <= 31 or not 0 <= month <= 12:
+                continue
+            spec.update(absolute=(year, month, day), has_date=True)
+        elif kind == "weekday":
+            if g["wd_sun"]:
+                weekday = 6
+            else:
+                weekday = WEEKDAYS[g["wd"] or g["wd_short"]]
+            spec.update(weekday=weekday, has_date=True,
+                        week_shift=DIRECTIONS[g["wd_mod"]] if g["wd_mod"] else None)
+        elif kind == "edge":
+            shift = DIRECTIONS[g["edge_mod"]] if g["edge_mod"] else None
+            if g["edge_unit"] == "tuần":
+                spec.update(weekday=0 if g["edge_at"] == "đầu" else 5, week_shift=shift)
+            else:
+                spec.update(month_edge="start" if g["edge_at"] == "đầu" else "end",
+                            month_shift=spec.get("month_shift", 0) + (shift or 0))
+            spec["has_date"] = True
+        elif kind == "shift":
+            amount = DIRECTIONS[g["shift_dir"]]
+            unit = g["shift_unit"]
+            key = {"tuần": "day_shift", "tháng": "month_shift", "năm": "year_shift"}[unit]
+            spec[key] = spec.get(key, 0) + amount * (7 if unit == "tuần" else 1)
+            spec["has_date"] = True
+        elif kind == "day_word":
+            spec["day_shift"] = spec.get("day_shift", 0) + DAY_WORDS[_SPACES.sub(" ", g["day"])]
+            spec["has_date"] = True
+        elif kind == "clock":
+            hour = int(g["c_h"])
+            minute = int(g["c_m"] or g["c_m2"] or 0) + (30 if g["c_half"] else 0)
+            if g["c_less"]:
+                hour, minute = hour - 1, 60 - int(g["c_less"])
+            if not (0 <= hour <= 24 and 0 <= minute < 60):
+                continue
+            spec["clock"] = (hour, minute, g["c_period"])
+        elif kind == "period":
+            spec["period"] = g["p_word"]
+        elif kind == "num":
+            spec.setdefault("bare_hour", int(g["n_val"]))
+        else:
+            continue
+        if kind != "num":
+            spec["matched"] = True
+    return TimeSpec(**spec)
+
+
+def _inherit(child: TimeSpec, parent: TimeSpec, child_first: bool) -> TimeSpec:
+    """Nửa còn thiếu mượn ngày / buổi của nửa kia: "từ 8h đến 10h sáng mai", "2 đến 4 giờ chiều"."""
+    changes: dict = {}
+    if not child.has_date and parent.has_date:
+        changes.update(parent.date_fields())
+    clock = child.clock
+    if clock is None and child.bare_hour is not None and parent.clock is not None:
+        clock = (child.bare_hour, 0, None)
+        changes.update(clock=clock, matched=True)
+    if child.period is None and parent.period is not None:
+        changes["period"] = parent.period
+    elif clock is not None and clock[2] is None and child.period is None and parent.clock and parent.clock[2]:
+        # Chỉ mượn buổi khi thứ tự giờ vẫn hợp lý ("11 đến 1 giờ chiều" giữ 11h trưa)
+        period = parent.clock[2]
+        mine, theirs = _apply_period(clock[0], period), _apply_period(parent.clock[0], period)
+        if (mine <= theirs) if child_first else (mine >= theirs):
+            changes["clock"] = (clock[0], clock[1], period)
+    return replace(child, **changes) if changes else child
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expression(normalized: str) -> CompiledTime:
+    """Phân tích biểu thức đã chuẩn hóa (không phụ thuộc ngày gốc) -> cache theo chuỗi."""
+    tokens = list(_GRAMMAR.finditer(normalized))
+    # Tách khoảng tại dấu nối đầu tiên có mốc thời gian ở cả hai phía
+    for index, match in enumerate(tokens):
+        if match.lastgroup == "sep" and 0 < index < len(tokens) - 1:
+            start, end = _spec_from(tokens[:index]), _spec_from(tokens[index + 1:])
+            if (start.matched or start.bare_hour is not None) and end.matched:
+                start = _inherit(start, end, child_first=True)
+                return CompiledTime(start, _inherit(end, start, child_first=False))
+    return CompiledTime(_spec_from([t for t in tokens if t.lastgroup != "sep"]))
+
+
+def _apply_period(hour: int, period: Optional[str]) -> int:
+    if period in ("chiều", "tối", "pm") and hour < 12:
+        return hour + 12
+    if period == "trưa" and 1 <= hour <= 4:
+        return hour + 12
+    if period in ("đêm", "khuya"):
+        return 0 if hour == 12 else hour + 12 if 6 <= hour < 12 else hour
+    if period == "am" and hour == 12:
+        return 0
+    return hour
+
+
+def resolve(spec: TimeSpec, base: datetime) -> Optional[datetime]:
+    value = base
+    if spec.absolute:
+        year, month, day = spec.absolute
+        try:
+            value = value.replace(year=year or value.year, month=month or value.month, day=day)
+        except ValueError:
+            return None
+        # Không ghi năm/tháng mà ngày đã qua -> hiểu là lần tới (lịch hướng về tương lai)
+        if value.date() < base.date() and year is None:
+            value = add_years(value, 1) if month else add_months(value, 1)
+    if spec.year_shift:
+        value = add_years(value, spec.year_shift)
+    if spec.month_shift:
+        value = add_months(value, spec.month_shift)
+    value += timedelta(days=spec.day_shift)
+    if spec.weekday is not None:
+        if spec.week_shift is None:
+            value += timedelta(days=(spec.weekday - value.weekday()) % 7)
+        else:
+            value += timedelta(days=spec.weekday - value.weekday(), weeks=spec.week_shift)
+    if spec.month_edge == "start":
+        value = value.replace(day=1)
+    elif spec.month_edge == "end":
+        value = end_of_month(value)
+
+    if spec.clock is not None:
+        hour, minute, period = spec.clock
+        hour = _apply_period(hour, period or spec.period)
+        value = value.replace(hour=hour % 24, minute=minute, second=0, microsecond=0)
+        if hour == 24:
+            value += timedelta(days=1)
+    elif spec.period is not None:
+        value = value.replace(hour=PERIOD_HOURS[spec.period], minute=0, second=0, microsecond=0)
+    return value + spec.offset
+
+
+def _resolve_range(compiled: CompiledTime, base: datetime) -> Optional[tuple[datetime, datetime]]:
+    start = resolve(compiled.start, base)
+    if start is None:
+        return None
+    if compiled.end is None:
+        return start, start + (compiled.start.duration or timedelta(hours=1))
+    end = resolve(compiled.end, base)
+    if end is None:
+        return start, start + timedelta(hours=1)
+    if end <= start and compiled.end.clock is not None:
+        # "từ 10h đến 2h" -> 14h; "từ 22h đến 1h" -> 1h hôm sau
+        later = end + timedelta(hours=12)
+        end = later if compiled.end.clock[2] is None and compiled.end.period is None and \
+            end.hour < 12 and later > start else end + timedelta(days=1)
+    if end <= start:
+        end = start + timedelta(hours=1)
+    return start, end
+
+
+def _localize(value: datetime, base: datetime) -> datetime:
+    # Chuỗi ISO không ghi múi giờ -> hiểu theo múi giờ của ngày gốc
+    return value.replace(tzinfo=base.tzinfo) if value.tzinfo is None and base.tzinfo is not None else value
+
+
+class NaturalTimeParser:
+    """
+    Bộ phân tích thời gian tiếng Việt: ngữ pháp biên dịch sẵn + 2 tầng cache.
+    - compile_expression: biểu thức chuẩn hóa -> TimeSpec (không phụ thuộc ngày gốc).
+    - Kết quả: LRU theo (biểu thức, ngày gốc). Biểu thức không có giờ nào được tính từ 0h rồi cộng giờ trong ngày
+      của thời điểm gốc khi trả về; biểu thức lẫn giờ cụ thể với độ lệch tương đối thì không cache.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._results: OrderedDict[tuple, Optional[tuple[datetime, datetime]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _bucket(compiled: CompiledTime, base: datetime) -> Optional[tuple[tuple, datetime]]:
+        """(khóa theo ngày gốc, mốc để tính) hoặc None nếu kết quả phụ thuộc giờ gốc theo cách khác."""
+        day = (base.date(), base.tzinfo)
+        if compiled.anchored:
+            return day, base
+        if compiled.floating:
+            return day, base.replace(hour=0, minute=0, second=0, microsecond=0)
+        return None
+
+    def parse(self, expression: str, base_date: datetime) -> Optional[tuple[datetime, datetime]]:
+        """(bắt đầu, kết thúc) hoặc None nếu không hiểu được biểu thức."""
+        text = expression.strip()
+        if text[:4].isdigit():
+            try:
+                # Chuỗi ngày giờ đầy đủ (ví dụ: '2025-10-20 09:00:00')
+                start = _localize(datetime.fromisoformat(text), base_date)
+                return start, start + timedelta(hours=1)
+            except ValueError:
+                pass
+
+        normalized = normalize(text)
+        compiled = compile_expression(normalized)
+        if not compiled.matched:
+            return None
+        bucket = self._bucket(compiled, base_date)
+        if bucket is None:
+            with self._lock:
+                self.misses += 1
+            return _resolve_range(compiled, base_date)
+        day, origin = bucket
+        key = (normalized, *day)
+        with self._lock:
+            cached = key in self._results
+            if cached:
+                self._results.move_to_end(key)
+                self.hits += 1
+                result = self._results[key]
+            else:
+                self.misses += 1
+        if not cached:
+            result = _resolve_range(compiled, origin)
+            with self._lock:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        shift = base_date - origin
+        return (result[0] + shift, result[1] + shift) if result and shift else result
+
+    def parse_many(self, expressions: Iterable[str], base_date: datetime) -> list[tuple[datetime, datetime]]:
+        """Phân tích cả loạt với cùng một ngày gốc (import CSV, tạo nhiều sự kiện); biểu thức lặp lại chỉ tính một lần."""
+        return [self.parse(expression, base_date) or (base_date, base_date + timedelta(hours=1))
+                for expression in expressions]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+        compile_expression.cache_clear()
+        normalize.cache_clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        compiled = compile_expression.cache_info()
+        return {
+            "entries": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "compiled_entries": compiled.currsize,
+            "compiled_hits": compiled.hits,
+        }
+
+
+parser = NaturalTimeParser()
+
 # --- HÀM CHÍNH ĐỂ EXPORT ---
 
 
 def parse_natural_time(expression: str, base_date: datetime) -> tuple[datetime, datetime]:
     """
     Chuyển cụm thời gian tiếng Việt thành (ngày_bắt_đầu, ngày_kết_thúc).
-    Hàm này đã được sửa để xử lý cả ngày giờ cụ thể.
+    Hiểu: ISO, "3 ngày sau", "mai", "thứ sáu tuần sau", "3 giờ chiều", "từ 8h đến 10h", "20/10", "trong 2 tiếng"...
+    Không hiểu thì trả về base_date (kéo dài 1 giờ) như trước.
     """
-    try:
-        # Ưu tiên 1: Thử phân tích chuỗi ngày giờ đầy đủ (ví dụ: '2025-10-20 09:00:00')
-        new_start = datetime.fromisoformat(expression)
-        return new_start, new_start + timedelta(hours=1)
-    except (ValueError, TypeError):
-        # Nếu không phải chuỗi đầy đủ, tiếp tục xử lý ngôn ngữ tự nhiên
-        pass
-
-    expr = expression.lower().strip()
-    new_start = base_date
-
-    match = re.search(r"(\d+)\s*(ngày|tuần|tháng|năm)\s*(sau|tới|trước)", expr)
-    if match:
-        amount, unit, direction = int(
-            match.group(1)), match.group(2), match.group(3)
-        multiplier = 1 if direction in ["sau", "tới"] else -1
-
-        if unit == "ngày":
-            new_start += timedelta(days=amount * multiplier)
-        elif unit == "tuần":
-            new_start += timedelta(weeks=amount * multiplier)
-        elif unit == "tháng":
-            new_start = add_months(new_start, amount * multiplier)
-        elif unit == "năm":
-            new_start = add_years(new_start, amount * multiplier)
-
-    # Thêm các logic khác nếu cần, ví dụ: "ngày mai", "tuần sau"
-    elif "mai" in expr or "ngày sau" in expr:
-        new_start += timedelta(days=1)
-
-    return new_start, new_start + timedelta(hours=1)
+    return parser.parse(expression, base_date) or (base_date, base_date + timedelta(hours=1))
+
+
+def parse_many(expressions: Iterable[str], base_date: datetime) -> list[tuple[datetime, datetime]]:
+    return parser.parse_many(expressions, base_date)
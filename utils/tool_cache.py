@@ -0,0 +1,167 @@
+# File: utils/tool_cache.py
+
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Optional
+
+
+def _default_cacheable(result: Any) -> bool:
+    # Các tool bắt exception và trả về chuỗi lỗi -> không cache để lần sau còn thử lại
+    return not (isinstance(result, str) and result.startswith(("Lỗi", "❌")))
+
+
+class ToolResultCache:
+    """
+    Cache kết quả tool đọc theo (user, tool, tham số), LRU + TTL.
+    Mỗi user có một generation; tool ghi tăng generation sau khi commit nên mọi entry cũ của user đó
+    tự hết hiệu lực mà không phải duyệt cache. TTL chặn dữ liệu cũ do app ghi thẳng vào Supabase.
+    Generation chỉ nằm trong process: chỉ dùng khi chạy MỘT worker. Nhiều worker thì lệnh ghi ở worker này
+    không làm mất hiệu lực cache của worker khác (dữ liệu cũ tới hết TTL) -> tắt cache (max_entries=0).
+    Generation chỉ giữ cho user còn entry hoặc đang có lần đọc dở (bỏ cùng entry cuối cùng) -> bộ nhớ có giới hạn.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 60,
+                 cacheable: Callable[[Any], bool] = _default_cacheable):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cacheable = cacheable
+        self._entries: OrderedDict[tuple, tuple[int, float, Any]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._user_entries: Counter = Counter()  # số entry đang giữ của từng user
+        self._reading: Counter = Counter()       # số lần đọc DB đang dở (đã lấy generation, chưa put)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(user_id: str, tool_name: str, args: dict) -> tuple:
+        return user_id, tool_name, json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def _release(self, user_id: str) -> None:
+        # Gọi khi giữ _lock: user không còn entry lẫn lần đọc dở thì không cần nhớ generation nữa
+        if not self._user_entries[user_id] and not self._reading[user_id]:
+            self._generations.pop(user_id, None)
+            self._user_entries.pop(user_id, None)
+            self._reading.pop(user_id, None)
+
+    def _drop(self, key: tuple) -> None:
+        del self._entries[key]
+        self._user_entries[key[0]] -= 1
+        self._release(key[0])
+
+    def begin_read(self, user_id: str) -> int:
+        """Generation trước khi đọc DB; phải gọi end_read sau đó (put trước end_read)."""
+        with self._lock:
+            self._reading[user_id] += 1
+            return self._generations.get(user_id, 0)
+
+    def end_read(self, user_id: str) -> None:
+        with self._lock:
+            self._reading[user_id] -= 1
+            if not self._reading[user_id]:
+                del self._reading[user_id]
+            self._release(user_id)
+
+    def bump(self, user_id: str) -> None:
+        with self._lock:
+            self.invalidations += 1
+            if not self._user_entries[user_id] and not self._reading[user_id]:
+                self._release(user_id)  # không có gì để làm mất hiệu lực
+                return
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def get(self, user_id: str, tool_name: str, args: dict) -> tuple[bool, Any]:
+        key = self._key(user_id, tool_name, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self._generations.get(user_id, 0) and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._drop(key)
+            self.misses += 1
+            return False, None
+
+    def put(self, user_id: str, tool_name: str, args: dict, value: Any, generation: int) -> None:
+        """generation phải lấy TRƯỚC khi đọc DB: nếu có lệnh ghi chen giữa, entry sinh ra đã cũ ngay."""
+        with self._lock:
+            if generation != self._generations.get(user_id, 0):
+                return
+            key = self._key(user_id, tool_name, args)
+            if key not in self._entries:
+                self._user_entries[user_id] += 1
+            self._entries[key] = (generation, time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "users": len(self._generations),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    # --- DECORATOR CHO TOOL (đặt dưới @tool) ---
+
+    @staticmethod
+    def _call_args(signature: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
+    def cached(self, func: Callable) -> Callable:
+        """Tool đọc: trả kết quả từ cache nếu generation của user chưa đổi."""
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            call_args = self._call_args(signature, args, kwargs)
+            user_id = str(call_args.pop("user_id"))
+            hit, value = self.get(user_id, func.__name__, call_args)
+            if hit:
+                return value
+            generation = self.begin_read(user_id)
+            try:
+                value = await func(*args, **kwargs)
+                if self.cacheable(value):
+                    self.put(user_id, func.__name__, call_args, value, generation)
+            finally:
+                self.end_read(user_id)
+            return value
+
+        return wrapper
+
+    def invalidates(self, func: Callable) -> Callable:
+        """Tool ghi: tăng generation của user sau khi chạy xong (kể cả khi lỗi giữa chừng)."""
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            user_id: Optional[str] = self._call_args(signature, args, kwargs).get("user_id")
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                if user_id is not None:
+                    self.bump(str(user_id))
+
+        return wrapper
@@ -0,0 +1,86 @@
+# File: utils/tool_scheduler.py
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, Optional
+
+
+class _UserOrder:
+    __slots__ = ("last_write", "reads", "slots", "users")
+
+    def __init__(self, per_user: int):
+        self.last_write: Optional[asyncio.Future] = None
+        self.reads: list[asyncio.Future] = []  # lệnh đọc gọi sau lần ghi cuối
+        self.slots = asyncio.Semaphore(per_user)
+        self.users = 0
+
+
+class ToolScheduler:
+    """
+    Điều phối các tool call mà AgentExecutor chạy cùng lúc trong một bước (asyncio.gather):
+    - tool đọc của cùng user chạy song song, tối đa per_user; tool ghi chạy một mình và đúng thứ tự model gọi
+      (ghi chờ mọi lệnh gọi trước nó, đọc chỉ chờ lệnh ghi gọi trước nó);
+    - cả server tối đa `limit` tool cùng giữ connection (nhỏ hơn pool, chừa chỗ cho các API khác).
+    Thứ tự được ghi nhận ngay khi vào slot() (trước await đầu tiên) nên trùng với thứ tự tạo task.
+    """
+
+    def __init__(self, limit: int, per_user: int = 4, writes: Iterable[str] = ()):
+        self.limit = max(1, limit)
+        self.per_user = max(1, per_user)
+        self.writes = set(writes)
+        self._slots = asyncio.Semaphore(self.limit)
+        self._users: dict[str, _UserOrder] = {}
+        self.running = 0
+        self.waiting = 0
+        self.peak = 0
+        self.reads = 0
+        self.writes_run = 0
+        self.ordered_waits = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str], tool_name: str) -> AsyncIterator[None]:
+        key = str(user_id) if user_id else ""
+        order = self._users.get(key)
+        if order is None:
+            order = self._users[key] = _UserOrder(self.per_user)
+        order.users += 1
+        done = asyncio.get_running_loop().create_future()
+        if tool_name in self.writes:
+            deps = [f for f in (order.last_write, *order.reads) if f is not None and not f.done()]
+            order.last_write, order.reads = done, []
+            self.writes_run += 1
+        else:
+            deps = [order.last_write] if order.last_write is not None and not order.last_write.done() else []
+            order.reads.append(done)
+            self.reads += 1
+
+        self.waiting += 1
+        started = False
+        try:
+            if deps:
+                self.ordered_waits += 1
+                await asyncio.wait(deps)  # không await trực tiếp: hủy lệnh này không được hủy lệnh trước nó
+            async with order.slots, self._slots:
+                self.waiting -= 1
+                started = True
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+                try:
+                    yield
+                finally:
+                    self.running -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+            if not done.done():
+                done.set_result(None)
+            if done in order.reads:
+                order.reads.remove(done)
+            order.users -= 1
+            if order.users == 0:
+                self._users.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "per_user": self.per_user, "running": self.running, "waiting": self.waiting,
+                "peak": self.peak, "reads": self.reads, "writes": self.writes_run,
+                "ordered_waits": self.ordered_waits}
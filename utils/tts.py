@@ -0,0 +1,342 @@
+# File: utils/tts.py
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+# --- 1. TÁCH CÂU ---
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…;])\s+|\n+")
+_SOFT_BREAK = re.compile(r"(?<=[,])\s+")
+
+
+def clean_text_for_speech(text: str) -> str:
+    # Loại bỏ các ký tự markdown để giọng đọc tự nhiên hơn
+    return text.replace('*', '').replace('#', '').replace('-', ' ').replace('_', '')
+
+
+def normalize_for_cache(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+def split_sentences(text: str, max_chars: int = 200) -> list[str]:
+    """Tách theo ranh giới câu; câu quá dài được chia tiếp theo dấu phẩy rồi theo từ."""
+    chunks: list[str] = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            chunks.append(sentence)
+            continue
+        current = ""
+        for piece in _SOFT_BREAK.split(sentence):
+            for word in piece.split(" "):
+                if current and len(current) + len(word) + 1 > max_chars:
+                    chunks.append(current)
+                    current = word
+                else:
+                    current = f"{current} {word}".strip()
+        if current:
+            chunks.append(current)
+
+    # Gộp các câu quá ngắn để giảm số lần gọi engine
+    merged: list[str] = []
+    for chunk in chunks:
+        if merged and len(merged[-1]) + len(chunk) + 1 <= max_chars // 2:
+            merged[-1] = f"{merged[-1]} {chunk}"
+        else:
+            merged.append(chunk)
+    return merged
+
+
+def truncate_at_sentence(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(c) for c in ".!?\n")
+    return cut[:boundary + 1] if boundary > max_chars // 2 else cut
+
+
+# --- 2. ENGINE ---
+
+
+class TTSEngine(Protocol):
+    name: str
+    audio_format: str
+
+    def synthesize(self, text: str) -> bytes: ...
+
+
+class GTTSEngine:
+    name = "gtts"
+    audio_format = "mp3"
+
+    def __init__(self, lang: str = "vi"):
+        self.lang = lang
+
+    def synthesize(self, text: str) -> bytes:
+        from gtts import gTTS
+        audio_fp = io.BytesIO()
+        gTTS(text, lang=self.lang).write_to_fp(audio_fp)
+        return audio_fp.getvalue()
+
+
+class LocalStubEngine:
+    """Engine giả lập cho test/benchmark: trả về byte xác định, độ trễ cấu hình được."""
+    name = "local"
+    audio_format = "mp3"
+
+    def __init__(self, latency_per_char: float = 0.0005, bytes_per_char: int = 64):
+        self.latency_per_char = latency_per_char
+        self.bytes_per_char = bytes_per_char
+        self.calls = 0
+
+    def synthesize(self, text: str) -> bytes:
+        self.calls += 1
+        if self.latency_per_char:
+            time.sleep(len(text) * self.latency_per_char)
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        size = max(len(text), 1) * self.bytes_per_char
+        return (digest * (size // len(digest) + 1))[:size]
+
+
+def create_engine(name: str = "gtts") -> TTSEngine:
+    if name == "local":
+        return LocalStubEngine()
+    return GTTSEngine()
+
+
+# --- 3. CACHE THEO NỘI DUNG ---
+
+
+class AudioCache:
+    """
+    LRU theo sha256(văn bản chuẩn hóa), giới hạn tổng dung lượng; có thể ghi thêm ra đĩa.
+    Tầng đĩa giữ chỉ mục {key: kích thước} trong bộ nhớ (quét thư mục một lần lúc khởi tạo) -> không listdir mỗi lần ghi;
+    aget/aput đọc/ghi đĩa trong thread, không chặn event loop.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()  # cũ nhất trước
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def key(text: str, variant: str = "") -> str:
+        return hashlib.sha256(f"{variant}|{normalize_for_cache(text)}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".bin"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def _on_disk(self, key: str) -> bool:
+        with self._lock:
+            return key in self._disk
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # giữ thứ tự LRU qua các lần khởi động lại
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return data
+
+    def _missed(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def _disk_hit(self, key: str, data: bytes) -> bytes:
+        self._put_memory(key, data)
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return data
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._get_memory(key)
+        if data is not None:
+            return data
+        if self.disk_dir and self._on_disk(key):
+            data = self._read_disk(key)
+            if data is not None:
+                return self._disk_hit(key, data)
+        self._missed()
+        return None
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        """Như get(), nhưng đọc đĩa trong thread; key không có trong chỉ mục thì không chạm đĩa."""
+        data = self._get_memory(key)
+        if data is not None:
+            return data
+        if self.disk_dir and self._on_disk(key):
+            data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                return self._disk_hit(key, data)
+        self._missed()
+        return None
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def _put_disk(self, key: str, data: bytes) -> None:
+        tmp = self._disk_path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._disk_path(key))
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            evict = []
+            while self._disk_bytes > self.disk_max_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evict.append(old_key)
+        for old_key in evict:
+            try:
+                os.remove(self._disk_path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def _put_disk_safe(self, key: str, data: bytes) -> None:
+        try:
+            self._put_disk(key, data)
+        except OSError as e:
+            logger.warning(f"⚠️ Không ghi được cache TTS ra đĩa: {e}")
+
+    def put(self, key: str, data: bytes) -> None:
+        self._put_memory(key, data)
+        if self.disk_dir:
+            self._put_disk_safe(key, data)
+
+    async def aput(self, key: str, data: bytes) -> None:
+        """Như put(), nhưng ghi đĩa trong thread."""
+        self._put_memory(key, data)
+        if self.disk_dir:
+            await asyncio.to_thread(self._put_disk_safe, key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"items": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "disk_items": len(self._disk), "disk_bytes": self._disk_bytes, "disk_hits": self.disk_hits}
+
+
+# --- 4. SERVICE ---
+
+
+class TTSService:
+    """Tách câu -> tổng hợp song song trong thread pool -> ghép lại; mỗi câu được cache riêng."""
+
+    def __init__(self, engine: TTSEngine, cache: Optional[AudioCache] = None, max_workers: int = 4,
+                 chunk_chars: int = 200, max_chars: int = 2000):
+        self.engine = engine
+        self.cache = cache or AudioCache()
+        self.chunk_chars = chunk_chars
+        self.max_chars = max_chars
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def chunks(self, text: str) -> list[str]:
+        text = truncate_at_sentence(clean_text_for_speech(text or ""), self.max_chars)
+        return split_sentences(text, self.chunk_chars)
+
+    async def synthesize_chunk(self, chunk: str) -> bytes:
+        key = AudioCache.key(chunk, self.engine.name)
+        data = await self.cache.aget(key)
+        if data is not None:
+            return data
+        # Tổng hợp chạy trong task riêng, mọi request (kể cả request đầu) chờ qua shield: request nào bị hủy
+        # (client ngắt, iter_audio dọn dẹp, AudioStore bỏ clip) cũng không hủy kết quả của request khác cùng câu
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._synthesize_and_store(key, chunk))
+            # Không còn ai chờ mà task lỗi -> vẫn lấy exception ra, tránh log "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _synthesize_and_store(self, key: str, chunk: str) -> bytes:
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._executor, self.engine.synthesize, chunk)
+            await self.cache.aput(key, data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    async def iter_audio(self, text: str) -> AsyncIterator[bytes]:
+        """Sinh audio từng câu theo đúng thứ tự; các câu sau được tổng hợp song song ở nền."""
+        tasks = [asyncio.ensure_future(self.synthesize_chunk(c)) for c in self.chunks(text)]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def synthesize(self, text: str) -> bytes:
+        chunks = self.chunks(text)
+        if not chunks:
+            return b""
+        # Các khung MP3 ghép nối trực tiếp được
+        return b"".join(await asyncio.gather(*(self.synthesize_chunk(c) for c in chunks)))
+
+    def stats(self) -> dict:
+        return {"engine": self.engine.name, "inflight": len(self._inflight), **self.cache.stats()}